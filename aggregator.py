@@ -0,0 +1,180 @@
+#!/usr/bin/python
+""" Event storm suppression.
+
+    A flapping port logs the same error over and over.  Events are
+    grouped by (device, error code, interface), and only the first event
+    of each group within a time window is remediated.  The rest are
+    suppressed, and their number is recorded on the remediated event, so
+    remediation load follows the number of distinct problems rather than
+    the number of log lines.
+"""
+
+# Standard library modules
+import re
+import threading
+import time
+
+# Local modules
+import db
+
+
+# Seconds after the first event of a group during which repeats of it are
+# suppressed.  A problem that outlasts the window is remediated again.
+WINDOW = 300
+
+# Seconds between writes of the suppressed counts to the DB
+FLUSH_INTERVAL = 5.0
+
+# Events added between sweeps for groups whose window has passed
+EXPIRE_EVERY = 1024
+
+# Matches "Ethernet1/4" from:
+#     Interface Ethernet1/4 is down (Link failure)
+INTERFACE_RE = re.compile(r'[Ii]nterface\s+([\w./:-]+)')
+
+
+def group_key(device, error_code, error_message):
+    """ Gets the key events are grouped by.
+
+        @return key         a tuple of (device, error_code, interface); the
+                            interface is None if the message names none
+    """
+    interface = INTERFACE_RE.search(error_message)
+    return device, error_code, interface.group(1) if interface else None
+
+
+def _log_error(future):
+    """ Reports a queued write of suppressed counts that failed. """
+    if future.exception() is not None:
+        print('[aggregator]  ERROR:  Writing suppressed counts failed:  '
+              '{0}'.format(future.exception()))
+
+
+class Aggregator(object):
+    """ Decides which events to remediate, suppressing repeats of an
+        event within "window" seconds of the first one.  Counts are
+        written with "submit", e.g. an executor's submit(), if given, so
+        a caller on an event loop is not blocked by a busy DB.  Between
+        start() and stop(), a thread also flushes every flush interval,
+        so repeats are marked even when no more events arrive.
+    """
+
+    def __init__(self, window=WINDOW, flush_interval=FLUSH_INTERVAL,
+                 submit=None):
+        self.window = window
+        self.flush_interval = flush_interval
+        self.submit = submit
+        self.remediated = 0
+        self.suppressed = 0
+        self._groups = {}       # key -> [event_id, first epoch, suppressed]
+        self._dirty = {}        # event_id -> suppressed count to write
+        self._repeats = []      # ids of suppressed events to mark
+        self._latest = None
+        self._flushed = time.time()
+        self._lock = threading.RLock()
+        self._stopped = threading.Event()
+        self._flusher = None
+
+    def add(self, event_id, device, error_code, error_message, epoch):
+        """ Adds an event to its group.
+
+            @return remediate   True if the event should be remediated,
+                                False if it was suppressed
+        """
+        key = group_key(device, error_code, error_message)
+        with self._lock:
+            if epoch is not None and (self._latest is None or
+                                      epoch > self._latest):
+                self._latest = epoch
+            if not (self.remediated + self.suppressed + 1) % EXPIRE_EVERY:
+                self._expire()
+
+            group = self._groups.get(key)
+            if group and group[0] == event_id:
+                # A duplicate line; the DB already holds it as this event
+                return False
+            if (group is None or epoch is None or group[1] is None or
+                    abs(epoch - group[1]) >= self.window):
+                self._groups[key] = [event_id, epoch, 0]
+                self.remediated += 1
+                return True
+
+            group[2] += 1
+            self.suppressed += 1
+            self._dirty[group[0]] = group[2]
+            self._repeats.append(event_id)
+            if time.time() - self._flushed >= self.flush_interval:
+                self.flush()
+            return False
+
+    def _expire(self):
+        """ Forgets groups whose window has passed. """
+        if self._latest is None:
+            return
+        cutoff = self._latest - self.window
+        for key, group in list(self._groups.items()):
+            if group[1] is None or group[1] <= cutoff:
+                del self._groups[key]
+
+    def flush(self, wait=False):
+        """ Writes the suppressed counts that changed since the last flush,
+            and marks the suppressed events.  With a submit function the
+            write is only queued, unless "wait" is set.
+
+            @return None
+        """
+        with self._lock:
+            if self._dirty:
+                if self.submit and not wait:
+                    self.submit(db.update_suppressed, self._dirty,
+                                self._repeats).add_done_callback(_log_error)
+                else:
+                    db.update_suppressed(self._dirty, self._repeats)
+                self._dirty = {}
+                self._repeats = []
+            self._flushed = time.time()
+
+    def _flush_periodically(self):
+        """ Flushes every flush interval until stop(). """
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as error:
+                print('[aggregator]  ERROR:  Flushing suppressed counts '
+                      'failed:  {0}'.format(error))
+
+    def start(self):
+        """ Starts the thread flushing every flush interval.
+
+            @return self
+        """
+        self._stopped.clear()
+        self._flusher = threading.Thread(target=self._flush_periodically,
+                                         name='aggregator-flush')
+        self._flusher.daemon = True
+        self._flusher.start()
+        return self
+
+    def stop(self):
+        """ Stops the flushing thread, if started, and flushes a last
+            time, waiting for the write.
+
+            @return None
+        """
+        self._stopped.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        self.flush(wait=True)
+
+    def filter(self, events):
+        """ Yields the ids of the events to remediate from an iterable of
+            (event_id, device, error_code, error_message, epoch) tuples.
+        """
+        self.start()
+        try:
+            for event in events:
+                if self.add(*event):
+                    yield event[0]
+        finally:
+            self.stop()
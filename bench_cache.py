@@ -0,0 +1,90 @@
+#!/usr/bin/python
+""" Benchmark of a remediation burst with and without the command cache.
+
+    Remediates a burst of link-failure events spread over a few devices
+    and interfaces against mock SSH sessions, and reports wall time and
+    device round trips with the cache disabled and enabled.
+
+        python bench_cache.py --devices 4 --events 200 --latency 0.2
+"""
+
+# Standard library modules
+import argparse
+import contextlib
+import io
+import sys
+import time
+
+# Local modules
+import command_cache
+import engine
+import mock_outputs
+import remediations
+import ssh_helper
+
+
+class CountingSession(mock_outputs.SSHSession):
+    """ A mock session that counts its round trips. """
+
+    round_trips = 0
+
+    def write_pipelined(self, commands):
+        CountingSession.round_trips += 1
+        return super(CountingSession, self).write_pipelined(commands)
+
+
+def run(name, cache, events, concurrency):
+    """ Remediates every event, printing wall time, round trips and cache
+        counters.
+    """
+    command_cache.CACHE = cache
+    CountingSession.round_trips = 0
+
+    def remediate(event_id):
+        device, message = events[event_id]
+        remediations.link_failure(event_id, device, message)
+
+    started = time.time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        engine.run_remediations(
+            ((event_id, device) for event_id, (device, _) in
+             enumerate(events)),
+            remediate, max_concurrency=concurrency, per_device_limit=2)
+    elapsed = time.time() - started
+    stats = cache.stats()
+    print('{0:<10} {1:>8.2f} {2:>12} {3:>8} {4:>10} {5:>9.0%}'.format(
+        name, elapsed, CountingSession.round_trips, stats['hits'],
+        stats['coalesced'], stats['hit_rate']))
+
+
+def main(argv=None):
+    """ Main program logic """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--devices', type=int, default=4)
+    parser.add_argument('--interfaces', type=int, default=4,
+                        help='distinct interfaces per device '
+                             '(default: %(default)s)')
+    parser.add_argument('--events', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.2,
+                        help='seconds per device round trip '
+                             '(default: %(default)s)')
+    parser.add_argument('--concurrency', type=int, default=16)
+    args = parser.parse_args(argv)
+
+    mock_outputs.LATENCY = args.latency
+    ssh_helper.SSHSession = CountingSession
+    events = [
+        ('switch{0}'.format(number % args.devices),
+         'Interface Ethernet1/{0} is down (Link failure)'.format(
+             number // args.devices % args.interfaces))
+        for number in range(args.events)]
+
+    print('{0:<10} {1:>8} {2:>12} {3:>8} {4:>10} {5:>9}'.format(
+        'cache', 'seconds', 'round trips', 'hits', 'coalesced', 'hit rate'))
+    run('disabled', command_cache.CommandCache(ttl_rules=[]), events,
+        args.concurrency)
+    run('enabled', command_cache.CommandCache(), events, args.concurrency)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,96 @@
+#!/usr/bin/python
+""" Benchmark of per-event remediation dispatch cost as rules grow.
+
+    Compares the original loop (a substring test of every registered key
+    against every error code) with the compiled registry, both uncached
+    (exact dict + Aho-Corasick scan) and memoized.  The registry columns
+    should stay flat as the rule count grows.
+
+        python bench_dispatch.py --rules 10 100 1000 10000
+"""
+
+# Standard library modules
+import argparse
+import random
+import sys
+import time
+
+# Local modules
+import dispatch
+
+
+FACILITIES = ['ETHPORT', 'PLATFORM', 'BGP', 'OSPF', 'LACP', 'STP']
+
+
+def remediation(event_id, device_name, error_message):
+    """ A no-op remediation to register. """
+
+
+def synthetic_rules(count):
+    """ Generates (pattern, match type) rules, mostly exact mnemonics with
+        some substring and wildcard rules mixed in.
+    """
+    for number in range(count):
+        if number % 20 == 0:
+            yield 'FLAP_{0}'.format(number), dispatch.SUBSTRING
+        elif number % 20 == 1:
+            yield '{0}-*-LINK_{1}_*'.format(
+                FACILITIES[number % len(FACILITIES)], number), dispatch.WILDCARD
+        else:
+            yield 'IF_DOWN_REASON_{0}'.format(number), dispatch.EXACT
+
+
+def synthetic_codes(count, rules):
+    """ Generates error codes, half of them matching some rule. """
+    random.seed(rules)
+    for _ in range(count):
+        number = random.randrange(rules * 2)
+        yield '{0}-5-IF_DOWN_REASON_{1}'.format(
+            FACILITIES[number % len(FACILITIES)], number)
+
+
+def per_event_ns(function, codes):
+    """ Times dispatching every code.
+
+        @return cost        mean nanoseconds per event
+    """
+    started = time.time()
+    for error_code in codes:
+        function(error_code)
+    return (time.time() - started) * 1e9 / len(codes)
+
+
+def main(argv=None):
+    """ Main program logic """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rules', type=int, nargs='+',
+                        default=[10, 100, 1000, 10000],
+                        help='rule counts to measure (default: %(default)s)')
+    parser.add_argument('--events', type=int, default=20000,
+                        help='events dispatched per measurement '
+                             '(default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    print('{0:>7}  {1:>14}  {2:>14}  {3:>14}'.format(
+        'rules', 'loop ns/event', 'compiled ns', 'memoized ns'))
+    for rules in args.rules:
+        legacy = {}
+        registry = dispatch.RemediationRegistry()
+        for pattern, match in synthetic_rules(rules):
+            legacy[pattern] = remediation
+            registry.register(pattern, match=match)(remediation)
+        registry.compile()
+        codes = list(synthetic_codes(args.events, rules))
+
+        def loop(error_code):
+            return [legacy[known] for known in legacy if known in error_code]
+
+        print('{0:>7}  {1:>14.0f}  {2:>14.0f}  {3:>14.0f}'.format(
+            rules,
+            per_event_ns(loop, codes),
+            per_event_ns(registry.match, codes),
+            per_event_ns(registry.lookup, codes)))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,382 @@
+#!/usr/bin/python
+""" End-to-end benchmark of the whole pipeline.
+
+    Generates a synthetic syslog corpus at each requested scale, then runs
+    it through the same stages as demo_better.py:
+
+        read_logs -> parse_logs_to_events -> db -> aggregation
+                  -> run_remediation on the remediation engine
+
+    against mock SSH sessions whose per-command latency varies with a
+    configurable jitter.  The corpus mixes error codes in chosen
+    proportions and includes storms:  bursts of one link failure repeated
+    in the same few seconds, as a flapping port produces.
+
+    Each scale runs in a fresh process and scratch DB, and reports
+    lines/sec and events/sec ingested, remediations/sec, p50/p99
+    remediation latency and peak RSS.  --output writes the results as
+    JSON; --baseline compares them with an earlier file, so releases can
+    be checked for regressions:
+
+        python bench_e2e.py --lines 10000 1000000 --output 20150525.json
+        python bench_e2e.py --lines 10000 1000000 --baseline 20150525.json
+"""
+
+# Standard library modules
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+# Local modules
+import aggregator
+import command_cache
+import db
+import demo_better
+import engine
+import mock_outputs
+import ssh_helper
+import timestamps
+
+# Share of the corpus per error code; codes with no remediation are
+# parsed and stored but never reach a device
+MIX = {
+    'ETHPORT-5-IF_DOWN_LINK_FAILURE': 0.2,
+    'ETHPORT-5-IF_DOWN_INTERFACE_REMOVED': 0.02,
+    'ETHPORT-5-IF_UP': 0.4,
+    'ETH_PORT_CHANNEL-5-PORT_UP': 0.2,
+    'SYSMGR-2-SERVICE_CRASHED': 0.01,
+    'USER-5-SYSTEM_MSG': 0.17,
+}
+
+MESSAGES = {
+    'ETHPORT-5-IF_DOWN_LINK_FAILURE':
+        'Interface Ethernet{0}/{1} is down (Link failure)',
+    'ETHPORT-5-IF_DOWN_INTERFACE_REMOVED':
+        'Interface Ethernet{0}/{1} is down (Interface removed)',
+    'ETHPORT-5-IF_UP':
+        'Interface Ethernet{0}/{1} is up in mode access',
+    'ETH_PORT_CHANNEL-5-PORT_UP':
+        'port-channel{1}: Ethernet{0}/{1} is up',
+}
+DEFAULT_MESSAGE = 'Service "{0}" ({1}) hasn\'t caught signal 6'
+
+# Lines carrying one storm, and lines between storms
+STORM_SIZE = 500
+STORM_EVERY = 20000
+
+# Share of lines that are not syslog events at all
+NOISE = 0.01
+
+# Seconds between checks that a scale's child process is still running
+POLL_INTERVAL = 1.0
+
+VERSION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'VERSION')
+
+
+def write_corpus(path, lines, devices=500, mix=None, storm_size=STORM_SIZE,
+                 storm_every=STORM_EVERY, noise=NOISE, seed=1):
+    """ Writes a reproducible syslog file of "lines" lines, about 20
+        lines per second of log time.
+
+        @return None
+    """
+    rng = random.Random(seed)
+    mix = mix or MIX
+    codes = list(mix)
+    weights = list(mix.values())
+    storm = 0
+    with open(path, mode='w') as syslog:
+        for number in range(lines):
+            # 28-day months from 2016 Apr  1
+            day, clock = divmod(number // 20, 86400)
+            stamp = '2016 {0} {1:2d} {2:02d}:{3:02d}:{4:02d}'.format(
+                timestamps.MONTH_NAMES[(3 + day // 28) % 12], 1 + day % 28,
+                clock // 3600, clock // 60 % 60, clock % 60)
+            if number % storm_every == storm_every - 1:
+                storm = storm_size
+                storm_device = rng.randrange(devices)
+                storm_port = rng.randrange(1, 49)
+            if storm:
+                storm -= 1
+                syslog.write(
+                    '{0} switch{1} %ETHPORT-5-IF_DOWN_LINK_FAILURE: '
+                    'Interface Ethernet1/{2} is down (Link failure)\n'.format(
+                        stamp, storm_device, storm_port))
+                continue
+            if rng.random() < noise:
+                syslog.write('{0} -- MARK --\n'.format(stamp))
+                continue
+            code = rng.choices(codes, weights)[0]
+            module = rng.randrange(1, 9)
+            port = rng.randrange(1, 49)
+            syslog.write('{0} switch{1} %{2}: {3}\n'.format(
+                stamp, rng.randrange(devices), code,
+                MESSAGES.get(code, DEFAULT_MESSAGE).format(module, port)))
+
+
+class JitterSession(mock_outputs.SSHSession):
+    """ A mock session taking "latency" seconds per command, varied by a
+        normally distributed "jitter" (standard deviation, in seconds).
+    """
+
+    latency = 0.05
+    jitter = 0.01
+    rng = random.Random(1)
+
+    def _sleep(self, commands):
+        time.sleep(sum(max(0, self.rng.gauss(self.latency, self.jitter))
+                       for _ in commands))
+
+    def write(self, commands):
+        lines = super(JitterSession, self).write(commands)
+        self._sleep(commands)
+        return lines
+
+    def write_pipelined(self, commands):
+        outputs = super(JitterSession, self).write_pipelined(commands)
+        self._sleep(commands)
+        return outputs
+
+
+def percentile(values, fraction):
+    """ @return value       the nearest-rank percentile of sorted values """
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def peak_rss():
+    """ @return megabytes   this process's peak resident memory """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # KiB on Linux, bytes on macOS
+    return peak / (1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0)
+
+
+def _run(lines, args, workdir, results):
+    """ Runs one scale in a child process, reporting a dict of results. """
+    mock_outputs.LATENCY = 0
+    JitterSession.latency = args.latency
+    JitterSession.jitter = args.jitter
+    ssh_helper.SSHSession = JitterSession
+    command_cache.CACHE = command_cache.CommandCache()
+
+    path = os.path.join(workdir, 'syslog{0}.txt'.format(lines))
+    write_corpus(path, lines, devices=args.devices, mix=args.mix,
+                 storm_size=args.storm_size, storm_every=args.storm_every,
+                 seed=args.seed)
+    with db.scratch(workdir, 'events{0}.sqlite'.format(lines)):
+        started = time.time()
+        event_ids = demo_better.parse_logs_to_events(
+            demo_better.read_logs(path))
+        ingest = time.time() - started
+
+        started = time.time()
+        kept = list(demo_better._aggregate(event_ids, args.window))
+        aggregate = time.time() - started
+        # Only events with a remediation cost a device round trip
+        remediable = list(itertools.islice(
+            ((event_id, event.device) for event_id, event in (
+                (event_id, db.get_event(event_id)) for event_id in kept)
+             if demo_better.ERROR_CODES_TO_REMEDIATIONS.lookup(
+                 event.error_code)),
+            args.remediations))
+
+        latencies = []
+
+        def remediate(event_id):
+            began = time.time()
+            demo_better.run_remediation(event_id)
+            latencies.append(time.time() - began)
+
+        started = time.time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            finished = engine.run_remediations(
+                remediable, remediate, max_concurrency=args.concurrency)
+        remediate_seconds = time.time() - started
+    latencies.sort()
+
+    results.put({
+        'lines': lines,
+        'events': len(event_ids),
+        'remediations': len(remediable),
+        'failed': finished.failed,
+        'ingest_seconds': round(ingest, 3),
+        'lines_per_sec': round(lines / ingest, 1),
+        'events_per_sec': round(len(event_ids) / ingest, 1),
+        'aggregate_seconds': round(aggregate, 3),
+        'remediations_per_sec': round(
+            len(remediable) / remediate_seconds, 1)
+            if remediable else None,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 1)
+            if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1)
+            if latencies else None,
+        'peak_rss_mb': round(peak_rss(), 1),
+    })
+
+
+def _wait(child, results):
+    """ Waits for a child process's results, or for it to exit without
+        reporting any (it raised, or was killed, e.g. out of memory).
+
+        @return run         the child's dict of results, or None
+    """
+    while True:
+        try:
+            return results.get(timeout=POLL_INTERVAL)
+        except queue.Empty:
+            if not child.is_alive():
+                break
+    # The child may have exited just after reporting
+    try:
+        return results.get(timeout=POLL_INTERVAL)
+    except queue.Empty:
+        return None
+
+
+# Reported metrics, and whether a larger value is better
+METRICS = [
+    ('lines_per_sec', True),
+    ('events_per_sec', True),
+    ('remediations_per_sec', True),
+    ('p50_ms', False),
+    ('p99_ms', False),
+    ('peak_rss_mb', False),
+]
+
+
+def compare(runs, baseline, tolerance):
+    """ Prints each metric's change against a baseline run of the same
+        size, flagging changes for the worse beyond "tolerance".
+
+        @return regressions the number of metrics flagged
+    """
+    before = dict((run['lines'], run) for run in baseline['runs'])
+    regressions = 0
+    print('\nAgainst {0} ({1}):'.format(baseline.get('version'),
+                                        baseline.get('started')))
+    for run in runs:
+        old = before.get(run['lines'])
+        if old is None:
+            continue
+        for name, higher_is_better in METRICS:
+            if not old.get(name) or run.get(name) is None:
+                continue
+            change = run[name] / old[name] - 1
+            worse = -change if higher_is_better else change
+            flag = ''
+            if worse > tolerance:
+                flag = '  REGRESSION'
+                regressions += 1
+            print('{0:>10} {1:<22} {2:>12} -> {3:<12} {4:>+7.1%}{5}'.format(
+                run['lines'], name, old[name], run[name], change, flag))
+    return regressions
+
+
+def main(argv=None):
+    """ Main program logic """
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--lines', type=int, nargs='+',
+                        default=[10000, 100000],
+                        help='corpus sizes to run (default: %(default)s)')
+    parser.add_argument('--devices', type=int, default=500)
+    parser.add_argument('--mix', nargs='+', metavar='CODE=SHARE',
+                        help='error code mix, e.g. '
+                             'ETHPORT-5-IF_DOWN_LINK_FAILURE=0.5 '
+                             'ETHPORT-5-IF_UP=0.5 (default: MIX)')
+    parser.add_argument('--storm-size', type=int, default=STORM_SIZE,
+                        help='lines per storm (default: %(default)s)')
+    parser.add_argument('--storm-every', type=int, default=STORM_EVERY,
+                        help='lines between storms (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='seconds per command on a device '
+                             '(default: %(default)s)')
+    parser.add_argument('--jitter', type=float, default=0.01,
+                        help='standard deviation of the latency, in seconds '
+                             '(default: %(default)s)')
+    parser.add_argument('-w', '--window', type=int, default=aggregator.WINDOW,
+                        help='aggregation window, in seconds '
+                             '(default: %(default)s)')
+    parser.add_argument('-c', '--concurrency', type=int, default=32,
+                        help='remediations at once (default: %(default)s)')
+    parser.add_argument('--remediations', type=int, default=1000,
+                        help='most remediations run per scale '
+                             '(default: %(default)s)')
+    parser.add_argument('--output', metavar='FILE',
+                        help='write the results to a JSON file')
+    parser.add_argument('--baseline', metavar='FILE',
+                        help='compare with the results in a JSON file, '
+                             'exiting 1 on a regression')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='change for the worse allowed against the '
+                             'baseline (default: %(default)s)')
+    args = parser.parse_args(argv)
+    if args.mix:
+        try:
+            args.mix = dict((code, float(share)) for code, share in (
+                item.split('=') for item in args.mix))
+        except ValueError:
+            parser.error('--mix takes CODE=SHARE pairs')
+
+    with open(VERSION_FILE) as version:
+        report = {
+            'version': version.read().strip(),
+            'started': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'args': vars(args),
+            'runs': [],
+        }
+
+    print('{0:>10} {1:>10} {2:>12} {3:>12} {4:>8} {5:>9} {6:>8} {7:>8} '
+          '{8:>8}'.format('lines', 'events', 'lines/sec', 'events/sec',
+                          'remeds', 'remeds/s', 'p50 ms', 'p99 ms',
+                          'RSS MB'))
+    workdir = tempfile.mkdtemp()
+    try:
+        for lines in args.lines:
+            results = multiprocessing.Queue()
+            child = multiprocessing.Process(
+                target=_run, args=(lines, args, workdir, results))
+            child.start()
+            run = _wait(child, results)
+            child.join()
+            if run is None:
+                print('[bench_e2e]  ERROR:  The run of {0} lines failed '
+                      '(exit code {1}).'.format(lines, child.exitcode))
+                return 1
+            report['runs'].append(run)
+            print('{lines:>10} {events:>10} {lines_per_sec:>12} '
+                  '{events_per_sec:>12} {remediations:>8} '
+                  '{remediations_per_sec!s:>9} {p50_ms!s:>8} {p99_ms!s:>8} '
+                  '{peak_rss_mb:>8}'.format(**run))
+    finally:
+        shutil.rmtree(workdir)
+
+    if args.output:
+        with open(args.output, mode='w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            if compare(report['runs'], json.load(baseline), args.tolerance):
+                return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
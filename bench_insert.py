@@ -0,0 +1,91 @@
+#!/usr/bin/python
+""" Benchmark of event ingestion rates into SQLite.
+
+    Compares the original per-line path (a duplicate-check SELECT on one
+    connection, then an INSERT and commit on another) against the batched
+    db.insert_events() API.
+
+        python bench_insert.py --events 20000
+"""
+
+# Standard library modules
+import argparse
+import sqlite3
+import sys
+import time
+
+# Local modules
+import db
+
+
+def synthetic_events(count, devices=200):
+    """ Generates (datestamp, timestamp, device, error_code, error_message)
+        tuples, with roughly one in ten repeating an earlier event.
+    """
+    for number in range(count):
+        if number % 10 == 9:
+            number -= 5
+        seconds = number % 86400
+        yield ('2016 Apr  2',
+               '{0:02d}:{1:02d}:{2:02d}'.format(
+                   seconds // 3600, seconds // 60 % 60, seconds % 60),
+               'switch{0}'.format(number % devices),
+               'ETHPORT-5-IF_DOWN_LINK_FAILURE',
+               'Interface Ethernet1/{0} is down (Link failure)'.format(
+                   number % 48))
+
+
+def legacy_insert_event(datestamp, timestamp, device, error_code,
+                        error_message):
+    """ The per-line ingest path insert_event() used before bulk inserts. """
+    datestamp = '{0} {1}'.format(datestamp, timestamp)
+    session = sqlite3.connect(db.DB_FILE)
+    result = session.execute('''
+        SELECT id
+        FROM events
+        WHERE datestamp=? AND device=? AND error_code=? AND error_message=?
+    ''', (datestamp, device, error_code, error_message)).fetchone()
+    if result:
+        return result[0]
+    session = sqlite3.connect(db.DB_FILE)
+    cursor = session.cursor()
+    cursor.execute('''
+        INSERT INTO events (datestamp, device, error_code, error_message)
+        VALUES (?, ?, ?, ?)
+    ''', (datestamp, device, error_code, error_message))
+    event_id = cursor.lastrowid
+    session.commit()
+    session.close()
+    return event_id
+
+
+def run(name, count, ingest):
+    """ Times one ingest path against a fresh DB file. """
+    with db.scratch():
+        started = time.time()
+        ingest(synthetic_events(count))
+        elapsed = time.time() - started
+    print('{0:<10} {1:>8} rows  {2:>8.2f} s  {3:>10.0f} rows/sec'.format(
+        name, count, elapsed, count / elapsed))
+    return count / elapsed
+
+
+def main(argv=None):
+    """ Main program logic """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--events', type=int, default=20000,
+                        help='events to ingest per run (default: %(default)s)')
+    parser.add_argument('--legacy-events', type=int, default=2000,
+                        help='events for the slower per-line path '
+                             '(default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    legacy = run('per-line', args.legacy_events,
+                 lambda events: [legacy_insert_event(*event)
+                                 for event in events])
+    batched = run('batched', args.events, db.insert_events)
+    print('speedup:  {0:.1f}x'.format(batched / legacy))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+#!/usr/bin/python
+""" Benchmark of memory held per parsed event.
+
+    Parses synthetic syslog lines and keeps every event, as regex group
+    tuples, as events.Event objects and as one events.EventBatch.  Each
+    form is built in a fresh child process, and its resident memory
+    growth is reported as bytes per event.
+
+        python bench_memory.py --events 10000000
+        python bench_memory.py --events 1000000 --kinds tuples events batch
+"""
+
+# Standard library modules
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+# Local modules
+import events
+import syslog_parser
+import timestamps
+
+
+def synthetic_lines(count, devices=500):
+    """ Generates syslog lines without holding them in memory. """
+    for number in range(count):
+        seconds = number % 86400
+        yield ('2016 {0} {1:2d} {2:02d}:{3:02d}:{4:02d} switch{5} '
+               '%ETHPORT-5-IF_DOWN_LINK_FAILURE: Interface Ethernet1/{6} '
+               'is down (Link failure)\n'.format(
+                   timestamps.MONTH_NAMES[number // 86400 % 12],
+                   1 + number // 3600 % 28, seconds // 3600,
+                   seconds // 60 % 60, seconds % 60,
+                   number % devices, number % 48))
+
+
+def rss():
+    """ @return bytes       this process's resident memory """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError):
+        # Peak rather than current, in KiB on Linux and bytes on macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _measure(kind, count, results):
+    """ Builds one form of the events in a child process, reporting
+        (bytes, seconds).
+    """
+    parsed = syslog_parser.parse_lines(synthetic_lines(count))
+    before = rss()
+    started = time.time()
+    if kind == 'tuples':
+        held = list(parsed)
+    elif kind == 'events':
+        held = [events.Event.from_fields(fields) for fields in parsed]
+    else:
+        held = events.EventBatch()
+        held.extend(parsed)
+    results.put((rss() - before, time.time() - started))
+    del held
+
+
+def main(argv=None):
+    """ Main program logic """
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--events', type=int, default=10000000,
+                        help='events held (default: %(default)s)')
+    parser.add_argument('--kinds', nargs='+',
+                        choices=['tuples', 'events', 'batch'],
+                        default=['tuples', 'events', 'batch'])
+    args = parser.parse_args(argv)
+
+    print('{0:<8} {1:>12} {2:>12} {3:>10}'.format(
+        'form', 'events', 'bytes/event', 'seconds'))
+    for kind in args.kinds:
+        results = multiprocessing.Queue()
+        child = multiprocessing.Process(
+            target=_measure, args=(kind, args.events, results))
+        child.start()
+        held, elapsed = results.get()
+        child.join()
+        print('{0:<8} {1:>12} {2:>12.1f} {3:>10.1f}'.format(
+            kind, args.events, held / args.events, elapsed))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
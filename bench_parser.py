@@ -0,0 +1,112 @@
+#!/usr/bin/python
+""" Benchmark of syslog parsing throughput.
+
+    Writes a synthetic syslog file, then parses it on 2 processes for a
+    consumer slower than the workers, and exits 1 if this process's memory
+    grows by more than the chunks the workers may parse ahead
+    (syslog_parser.CHUNKS_AHEAD) account for.  Otherwise reports
+    lines/sec for the regex and fast-path parsers on 1, 4 and all CPU
+    cores.
+
+        python bench_parser.py --lines 2000000
+"""
+
+# Standard library modules
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# Local modules
+import bench_memory
+import syslog_parser
+import timestamps
+
+
+def write_syslog(path, lines, devices=500):
+    """ Writes a syslog file of well-formed lines with a sprinkling of
+        lines the fast path has to hand to the regex.
+    """
+    with open(path, mode='w') as syslog:
+        for number in range(lines):
+            seconds = number % 86400
+            stamp = '2016 {0} {1:2d} {2:02d}:{3:02d}:{4:02d}'.format(
+                timestamps.MONTH_NAMES[number // 86400 % 12],
+                1 + number // 3600 % 28, seconds // 3600, seconds // 60 % 60,
+                seconds % 60)
+            if number % 100 == 99:
+                # Irregular spacing, still matched by SYSLOG_RE
+                stamp = stamp.replace(' ', '  ', 1)
+            syslog.write(
+                '{0} switch{1} %ETHPORT-5-IF_DOWN_LINK_FAILURE: Interface '
+                'Ethernet1/{2} is down (Link failure)\n'.format(
+                    stamp, number % devices, number % 48))
+
+
+def slow_consumer_growth(path, processes, chunk_size, delay):
+    """ Parses a file into batches, sleeping "delay" seconds on each.
+
+        @return growth      the most this process's memory grew, in bytes
+    """
+    before = growth = bench_memory.rss()
+    for _ in syslog_parser.parse_file_batches(
+            path, processes=processes, chunk_size=chunk_size):
+        time.sleep(delay)
+        growth = max(growth, bench_memory.rss())
+    return growth - before
+
+
+def main(argv=None):
+    """ Main program logic """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--lines', type=int, default=2000000,
+                        help='lines in the synthetic file '
+                             '(default: %(default)s)')
+    parser.add_argument('--chunk-size', type=int,
+                        default=syslog_parser.CHUNK_SIZE,
+                        help='bytes per worker chunk (default: %(default)s)')
+    parser.add_argument('--slow-chunk-size', type=int, default=1024 * 1024,
+                        help='bytes per chunk for the slow consumer check '
+                             '(default: %(default)s)')
+    parser.add_argument('--slow-delay', type=float, default=0.2,
+                        help='seconds the slow consumer spends per chunk '
+                             '(default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp()
+    path = os.path.join(workdir, 'syslog.txt')
+    try:
+        write_syslog(path, args.lines)
+        # Each chunk's batch takes a few times the chunk's size; allow the
+        # chunks in flight plus the one being consumed, twice over
+        processes = 2
+        limit = 2 * 4 * args.slow_chunk_size * (
+            processes * syslog_parser.CHUNKS_AHEAD + 1)
+        growth = slow_consumer_growth(path, processes, args.slow_chunk_size,
+                                      args.slow_delay)
+        print('slow consumer:  memory grew {0:.1f} MB (limit {1:.1f} '
+              'MB)\n'.format(growth / 1e6, limit / 1e6))
+        if growth > limit:
+            return 1
+
+        cores = sorted(set([1, 4, os.cpu_count() or 1]))
+        print('{0:<10} {1:>6}  {2:>14}'.format('mode', 'cores', 'lines/sec'))
+        for fast in (False, True):
+            for processes in cores:
+                started = time.time()
+                parsed = sum(1 for _ in syslog_parser.parse_file(
+                    path, processes=processes, fast=fast,
+                    chunk_size=args.chunk_size))
+                elapsed = time.time() - started
+                assert parsed == args.lines
+                print('{0:<10} {1:>6}  {2:>14.0f}'.format(
+                    'fast-path' if fast else 'regex', processes,
+                    args.lines / elapsed))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+#!/usr/bin/python
+""" Benchmark of insert and query latency as the events table grows.
+
+    Loads the table in steps up to --rows (1M by default), and after each
+    step times one insert batch and a set of indexed queries, including a
+    page deep into a device's history fetched with a keyset cursor.  With
+    the indexes in place every column should stay roughly flat.
+
+        python bench_query.py --rows 1000000 --step 100000
+"""
+
+# Standard library modules
+import argparse
+import sys
+import time
+
+# Local modules
+import db
+
+
+ERROR_CODES = [
+    'ETHPORT-5-IF_DOWN_LINK_FAILURE',
+    'ETHPORT-5-IF_DOWN_INTERFACE_REMOVED',
+    'ETHPORT-5-IF_UP',
+    'PLATFORM-2-MOD_PWRDN',
+]
+
+
+def synthetic_events(first, count, devices):
+    """ Generates unique (datestamp, timestamp, device, error_code,
+        error_message) tuples numbered from "first".
+    """
+    for number in range(first, first + count):
+        seconds = number % 86400
+        yield ('2016 Apr {0:2d}'.format(1 + number // 86400 % 28),
+               '{0:02d}:{1:02d}:{2:02d}'.format(
+                   seconds // 3600, seconds // 60 % 60, seconds % 60),
+               'switch{0}'.format(number % devices),
+               ERROR_CODES[number // devices % len(ERROR_CODES)],
+               'Interface Ethernet1/{0} is down [{1}]'.format(
+                   number % 48, number))
+
+
+def timed(function, repeat=20):
+    """ Runs the function "repeat" times.
+
+        @return latency     the mean latency, in milliseconds
+    """
+    started = time.time()
+    for _ in range(repeat):
+        function()
+    return (time.time() - started) * 1000 / repeat
+
+
+def deep_page(device, error_code, pages=5, page_size=100):
+    """ Walks a few pages into a device's events with keyset cursors. """
+    after_id = 0
+    for _ in range(pages):
+        events = db.query_events(device=device, error_code=error_code,
+                                 after_id=after_id, limit=page_size)
+        if not events:
+            break
+        after_id = events[-1][0]
+
+
+def main(argv=None):
+    """ Main program logic """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1000000,
+                        help='rows to load in total (default: %(default)s)')
+    parser.add_argument('--step', type=int, default=100000,
+                        help='rows loaded between measurements '
+                             '(default: %(default)s)')
+    parser.add_argument('--devices', type=int, default=500,
+                        help='distinct device names (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    print('{0:>9}  {1:>12}  {2:>12}  {3:>12}  {4:>12}'.format(
+        'rows', 'insert ms', 'dup ms', 'device ms', 'deep page ms'))
+    with db.scratch():
+        loaded = 0
+        while loaded < args.rows:
+            db.insert_events(synthetic_events(
+                loaded, args.step - db.INSERT_BATCH_SIZE, args.devices))
+            loaded += args.step - db.INSERT_BATCH_SIZE
+
+            # One fresh batch, then the same batch again (all duplicates)
+            batch = list(synthetic_events(
+                loaded, db.INSERT_BATCH_SIZE, args.devices))
+            insert_ms = timed(lambda: db.insert_events(batch), repeat=1)
+            duplicate_ms = timed(lambda: db.insert_events(batch), repeat=1)
+            loaded += db.INSERT_BATCH_SIZE
+
+            device = 'switch{0}'.format(loaded % args.devices)
+            device_ms = timed(lambda: db.query_events(
+                device=device, error_code=ERROR_CODES[0], limit=100))
+            deep_ms = timed(lambda: deep_page(device, ERROR_CODES[0]))
+            print('{0:>9}  {1:>12.2f}  {2:>12.2f}  {3:>12.2f}  {4:>12.2f}'
+                  .format(loaded, insert_ms, duplicate_ms, device_ms,
+                          deep_ms))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,149 @@
+#!/usr/bin/python
+""" Regression loop of demo_better.main over a recorded incident.
+
+    Runs demo_better.main --runs times over the same syslog file with the
+    "replay" SSH backend, each time on a fresh scratch DB and command
+    cache, and checks that every run prints the same remediations.
+    Reports the time per run, so remediation logic can be tuned against
+    a real incident without touching a device.
+
+    The transcript is recorded beforehand with --ssh-backend record, or
+    here with --record, which first runs once against an in-process
+    ssh_simulator over a synthetic log (see bench_e2e.write_corpus):
+
+        python bench_replay.py --record --lines 20000 --runs 20
+        python bench_replay.py --log-file incident.log \\
+            --transcript incident.sqlite --runs 1000 --save expected.txt
+        python bench_replay.py --log-file incident.log \\
+            --transcript incident.sqlite --expect expected.txt
+
+    Exits 1 if runs disagree with each other or with --expect.
+"""
+
+# Standard library modules
+import argparse
+import contextlib
+import hashlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# Local modules
+import bench_e2e
+import command_cache
+import db
+import demo_better
+import ssh_helper
+import ssh_pool
+import ssh_simulator
+import transcripts
+
+
+def run(log_file, workdir, number, concurrency):
+    """ Runs demo_better.main once on a fresh DB and cache.
+
+        @return lines       the lines printed, sorted so concurrent
+                            remediations compare equal
+    """
+    command_cache.CACHE = command_cache.CommandCache()
+    transcripts.open_transcript().rewind()
+    output = io.StringIO()
+    with db.scratch(workdir, 'run{0}.sqlite'.format(number)):
+        with contextlib.redirect_stdout(output):
+            demo_better.main(['--log-file', log_file,
+                              '-c', str(concurrency)])
+    return sorted(output.getvalue().splitlines())
+
+
+def main(argv=None):
+    """ Main program logic """
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--log-file', help='syslog file of the incident')
+    parser.add_argument('--transcript',
+                        help='transcript to replay, or to record into with '
+                             '--record (default: a scratch file with '
+                             '--record, else {0})'.format(
+                                 transcripts.TRANSCRIPT_FILE))
+    parser.add_argument('--record', action='store_true',
+                        help='record the transcript from a simulator first')
+    parser.add_argument('--lines', type=int, default=20000,
+                        help='with --record and no --log-file, lines of '
+                             'synthetic log (default: %(default)s)')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--speed', type=float, default=0,
+                        help='replay speed; 0 answers instantly '
+                             '(default: %(default)s)')
+    parser.add_argument('-c', '--concurrency', type=int, default=1)
+    parser.add_argument('--record-concurrency', type=int, default=32,
+                        help='concurrency while recording '
+                             '(default: %(default)s)')
+    parser.add_argument('--save', metavar='FILE',
+                        help='save the remediations printed')
+    parser.add_argument('--expect', metavar='FILE',
+                        help='fail unless the runs print these '
+                             'remediations')
+    args = parser.parse_args(argv)
+    if not args.log_file and not args.record:
+        parser.error('--log-file is required without --record')
+
+    workdir = tempfile.mkdtemp()
+    try:
+        transcripts.TRANSCRIPT_FILE = args.transcript or (
+            os.path.join(workdir, 'transcript.sqlite') if args.record
+            else transcripts.TRANSCRIPT_FILE)
+        log_file = args.log_file
+        if args.record:
+            if not log_file:
+                log_file = os.path.join(workdir, 'syslog.txt')
+                bench_e2e.write_corpus(log_file, args.lines)
+            simulator = ssh_simulator.DeviceSimulator(port=0).start()
+            transcripts.RECORD_BACKEND = 'simulator'
+            ssh_helper.use_backend('record', '{0}:{1}'.format(
+                simulator.host, simulator.port))
+            started = time.time()
+            run(log_file, workdir, 'record', args.record_concurrency)
+            # Pooled sessions would otherwise keep recording
+            ssh_pool.POOL.close_all()
+            simulator.stop()
+            print('record:  {0:.2f}s, {1}'.format(
+                time.time() - started,
+                transcripts.open_transcript().stats()))
+
+        transcripts.REPLAY_SPEED = args.speed
+        ssh_helper.use_backend('replay')
+        digests = set()
+        seconds = []
+        for number in range(args.runs):
+            started = time.time()
+            lines = run(log_file, workdir, number, args.concurrency)
+            seconds.append(time.time() - started)
+            digests.add(hashlib.sha1(
+                '\n'.join(lines).encode('utf-8')).hexdigest())
+        seconds.sort()
+        print('replay:  {0} runs, {1} lines each, {2:.3f}s per run (best '
+              '{3:.3f}s), {4} distinct output{5}'.format(
+                  args.runs, len(lines), sum(seconds) / len(seconds),
+                  seconds[0], len(digests), '' if len(digests) == 1
+                  else 's'))
+
+        if args.save:
+            with open(args.save, mode='w') as saved:
+                saved.write('\n'.join(lines) + '\n')
+        failed = len(digests) > 1
+        if args.expect:
+            with open(args.expect, mode='r') as expected:
+                if expected.read().splitlines() != lines:
+                    print('Remediations differ from {0}.'.format(
+                        args.expect))
+                    failed = True
+        return 1 if failed else 0
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,112 @@
+#!/usr/bin/python
+""" Benchmark of expiring old events by DELETE and by dropping partitions.
+
+    Fills two scratch DBs with the same synthetic events spread over
+    several days.  One expires the oldest days with db.expire_events();
+    the other archives them into day partitions and drops those with
+    partitions.drop_before().  Also times a one-hour query through the
+    partition router and shows the file shrinking under
+    partitions.incremental_vacuum().
+
+        python bench_retention.py --events 500000 --days 10 --expire 5
+"""
+
+# Standard library modules
+import argparse
+import os
+import sys
+import time
+
+# Local modules
+import db
+import partitions
+import timestamps
+
+
+def synthetic_events(count, days, devices=500):
+    """ Generates parsed event fields evenly spread over "days" days from
+        2016 Apr 1.
+    """
+    step = days * partitions.DAY / count
+    for number in range(count):
+        seconds = int(number * step)
+        day, seconds = divmod(seconds, partitions.DAY)
+        yield ('2016 Apr {0:2d}'.format(1 + day),
+               '{0:02d}:{1:02d}:{2:02d}'.format(
+                   seconds // 3600, seconds // 60 % 60, seconds % 60),
+               'switch{0}'.format(number % devices),
+               'ETHPORT-5-IF_DOWN_LINK_FAILURE',
+               'Interface Ethernet1/{0} is down (Link failure)'.format(
+                   number % 48))
+
+
+def _fill(args):
+    """ Loads the synthetic events into the current DB. """
+    db.insert_events(synthetic_events(args.events, args.days),
+                     return_ids=False)
+
+
+def _size(db_file):
+    """ @return megabytes   the size of the DB file """
+    return os.path.getsize(db_file) / 1024.0 / 1024.0
+
+
+def main(argv=None):
+    """ Main program logic """
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--events', type=int, default=500000)
+    parser.add_argument('--days', type=int, default=10)
+    parser.add_argument('--expire', type=int, default=5,
+                        help='oldest days to expire (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    start = timestamps.day_epoch('2016 Apr  1')
+    before = start + args.expire * partitions.DAY
+    with db.scratch(name='delete.sqlite') as delete_file:
+        _fill(args)
+        started = time.time()
+        deleted = db.expire_events(before)
+        print('DELETE:     {0} events in {1:.2f}s, file {2:.0f} MB'.format(
+            deleted, time.time() - started, _size(delete_file)))
+
+    with db.scratch(name='drop.sqlite') as drop_file:
+        _fill(args)
+        started = time.time()
+        archived = partitions.archive(hot_days=1)
+        print('archive:    {0} events into {1} partitions in {2:.2f}s'
+              ''.format(archived, len(partitions.list_partitions()),
+                        time.time() - started))
+        started = time.time()
+        dropped = partitions.drop_before(before)
+        print('DROP TABLE: {0} partitions in {1:.3f}s, file {2:.0f} MB'
+              ''.format(len(dropped), time.time() - started,
+                        _size(drop_file)))
+
+        hour = before + partitions.DAY + 3600 * 12
+        started = time.time()
+        found = partitions.query_events(start=hour, end=hour + 3599,
+                                        limit=args.events)
+        print('query:      {0} events in one hour from {1} of {2} tables '
+              'in {3:.3f}s'.format(
+                  len(found), 1 + len(partitions.list_partitions(
+                      hour, hour + 3599)),
+                  1 + len(partitions.list_partitions()),
+                  time.time() - started))
+
+        calls = 0
+        slowest = 0
+        while True:
+            started = time.time()
+            free = partitions.incremental_vacuum()
+            slowest = max(slowest, time.time() - started)
+            calls += 1
+            if not free:
+                break
+        print('vacuum:     {0} calls of {1} pages, slowest {2:.3f}s, file '
+              '{3:.0f} MB'.format(calls, partitions.VACUUM_PAGES, slowest,
+                                  _size(drop_file)))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,145 @@
+#!/usr/bin/python
+""" Harness running several sharded remediation nodes on one machine.
+
+    Queues link-failure events for many devices in a scratch DB, then
+    drains them with 1, 2 and 4 node processes running the real
+    remediations against mock SSH sessions.  Reports throughput, shard
+    sizes, devices remediated by more than one node and events remediated
+    more than once.  --crash-after kills one node part way through to
+    show its devices moving to the others; shorten --lease and
+    --node-timeout with it, or the others wait out the production
+    defaults before taking over.
+
+        python bench_sharding.py --devices 40 --latency 0.1
+        python bench_sharding.py --nodes 3 --crash-after 2 --lease 2 \\
+            --node-timeout 2
+"""
+
+# Standard library modules
+import argparse
+import collections
+import contextlib
+import io
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# Local modules
+import command_cache
+import db
+import demo_better
+import mock_outputs
+import sharding
+import ssh_helper
+
+
+def _node(name, latency, log_file, lease, node_timeout):
+    """ Runs one node in a child process, logging the device of every
+        remediation it completes.
+    """
+    mock_outputs.LATENCY = latency
+    ssh_helper.SSHSession = mock_outputs.SSHSession
+    command_cache.CACHE = command_cache.CommandCache()
+    remediated = open(log_file, mode='a', buffering=1)
+
+    def remediate(event_id):
+        demo_better.run_remediation(event_id)
+        remediated.write('{0}\n'.format(db.get_event_by_id(event_id)[1]))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        sharding.run_node(name, remediate, heartbeat_interval=0.5,
+                          node_timeout=node_timeout, lease=lease,
+                          poll_interval=0.2)
+
+
+def run(nodes, args, workdir):
+    """ Drains a freshly queued DB with the given number of nodes and
+        prints the results.
+    """
+    workdir = os.path.join(workdir, 'nodes{0}'.format(nodes))
+    os.mkdir(workdir)
+    with db.scratch(workdir, 'events.sqlite'):
+        db.insert_events(
+            ('2016 Apr  2', '14:25:{0:02d}'.format(number % 60),
+             'switch{0}'.format(number % args.devices),
+             'ETHPORT-5-IF_DOWN_LINK_FAILURE',
+             'Interface Ethernet1/{0} is down (Link failure)'.format(
+                 number // args.devices))
+            for number in range(args.devices * args.events_per_device))
+        names = ['node{0}'.format(number) for number in range(nodes)]
+        # Register every node up front so they start with the same ring
+        for name in names:
+            db.heartbeat(name)
+        db.close_session()
+
+        started = time.time()
+        processes = {}
+        for name in names:
+            processes[name] = multiprocessing.Process(
+                target=_node, args=(name, args.latency,
+                                    os.path.join(workdir, name + '.log'),
+                                    args.lease, args.node_timeout))
+            processes[name].start()
+        crashed = None
+        if args.crash_after and nodes > 1:
+            time.sleep(args.crash_after)
+            crashed = names[-1]
+            processes[crashed].terminate()
+        for process in processes.values():
+            process.join()
+        elapsed = time.time() - started
+        repeated = db._open_session().execute(
+            'SELECT COUNT(*) FROM events WHERE attempts > 1').fetchone()[0]
+
+    owners = collections.defaultdict(set)
+    shard_sizes = []
+    for name in names:
+        with open(os.path.join(workdir, name + '.log')) as remediated:
+            devices = remediated.read().split()
+        shard_sizes.append(len(devices))
+        for device in devices:
+            owners[device].add(name)
+    events = args.devices * args.events_per_device
+    print('{0:>6} {1:>9.2f} {2:>11.1f} {3:>18} {4:>14} {5:>9}{6}'.format(
+        nodes, elapsed, events / elapsed,
+        '/'.join(str(size) for size in shard_sizes),
+        sum(1 for names in owners.values() if len(names) > 1), repeated,
+        '  ({0} crashed)'.format(crashed) if crashed else ''))
+
+
+def main(argv=None):
+    """ Main program logic """
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--nodes', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--devices', type=int, default=40)
+    parser.add_argument('--events-per-device', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.1,
+                        help='seconds per SSH round trip')
+    parser.add_argument('--crash-after', type=float, default=0,
+                        help='kill one node after this many seconds')
+    parser.add_argument('--lease', type=int, default=db.LEASE_SECONDS,
+                        help='event lease, in seconds (default: '
+                             '%(default)s)')
+    parser.add_argument('--node-timeout', type=int,
+                        default=sharding.NODE_TIMEOUT,
+                        help='seconds without a heartbeat before a node is '
+                             'dropped from the ring (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp()
+    try:
+        print('{0:>6} {1:>9} {2:>11} {3:>18} {4:>14} {5:>9}'.format(
+            'nodes', 'seconds', 'events/sec', 'remediations/node',
+            'shared devices', 'repeated'))
+        for nodes in args.nodes:
+            run(nodes, args, workdir)
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
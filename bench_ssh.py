@@ -0,0 +1,152 @@
+#!/usr/bin/python
+""" Load test of ssh_helper.SSHSession against simulated devices.
+
+    Starts ssh_simulator in-process (or uses one already running, with
+    --address) and has --concurrency threads each log in to devices
+    switch0 .. switchN-1 over real paramiko sessions, run --batches
+    pipelined batches of the remediations' show commands and log out.
+    Reports connect and round-trip latency percentiles, throughput and
+    the failures seen, so connection and I/O bottlenecks in the real code
+    path show up at fleet scale:
+
+        python bench_ssh.py --devices 2000 --concurrency 200 \\
+            --latency 0.05 --drop-rate 0.001
+"""
+
+# Standard library modules
+import argparse
+import collections
+import sys
+import threading
+import time
+
+# Local modules
+import ssh_helper
+import ssh_simulator
+
+
+# One remediation's worth of show commands, for module and interface 1/N
+COMMANDS = [
+    'show module {0}',
+    'show module uptime | egrep -A 3 "Module {0}"',
+    'show interface ethernet 1/{0} | egrep "(Ethernet|resets)"',
+    'show interface ethernet 1/{0} transceiver details | egrep "(Rx|rx)"',
+]
+
+
+def percentile(values, fraction):
+    """ @return value       the nearest-rank percentile of sorted values """
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def _worker(devices, args, results, lock):
+    """ Logs in to each device taken from "devices" and times its batches.
+    """
+    while True:
+        with lock:
+            if not devices:
+                return
+            device = devices.pop()
+        try:
+            started = time.perf_counter()
+            session = ssh_helper.SSHSession(
+                device=device, username='', passwd='', timeout=args.timeout)
+            connected = time.perf_counter()
+            with lock:
+                results['connect'].append(connected - started)
+        except Exception as error:
+            with lock:
+                results['connect failed'].append(str(error))
+            continue
+        try:
+            for number in range(args.batches):
+                commands = [command.format(1 + number % 8)
+                            for command in COMMANDS]
+                started = time.perf_counter()
+                outputs = session.write_pipelined(
+                    commands, timeout=args.timeout)
+                elapsed = time.perf_counter() - started
+                with lock:
+                    results['round trip'].append(elapsed)
+                    results['bytes'].append(
+                        sum(len(output) for output in outputs.values()))
+        except Exception as error:
+            with lock:
+                results['session failed'].append(str(error))
+        finally:
+            session.close()
+
+
+def main(argv=None):
+    """ Main program logic """
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--devices', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--batches', type=int, default=5,
+                        help='pipelined batches per session '
+                             '(default: %(default)s)')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--address', metavar='HOST:PORT',
+                        help='use a running ssh_simulator.py instead of '
+                             'starting one')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--output-size', type=int, default=0)
+    parser.add_argument('--refuse-rate', type=float, default=0.0)
+    parser.add_argument('--auth-failure-rate', type=float, default=0.0)
+    parser.add_argument('--drop-rate', type=float, default=0.0)
+    parser.add_argument('--hang-rate', type=float, default=0.0)
+    args = parser.parse_args(argv)
+
+    simulator = None
+    address = args.address
+    if not address:
+        simulator = ssh_simulator.DeviceSimulator(
+            port=0, latency=args.latency, jitter=args.jitter,
+            output_size=args.output_size, refuse_rate=args.refuse_rate,
+            auth_failure_rate=args.auth_failure_rate,
+            drop_rate=args.drop_rate, hang_rate=args.hang_rate,
+            seed=0).start()
+        address = '{0}:{1}'.format(simulator.host, simulator.port)
+    ssh_helper.use_backend('simulator', address)
+
+    devices = ['switch{0}'.format(number)
+               for number in reversed(range(args.devices))]
+    results = collections.defaultdict(list)
+    lock = threading.Lock()
+    threads = [threading.Thread(target=_worker,
+                                args=(devices, args, results, lock))
+               for _ in range(args.concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    for name in ('connect', 'round trip'):
+        values = sorted(results[name])
+        print('{0:<11} {1:>7} done, p50 {2}, p99 {3}'.format(
+            name + ':', len(values),
+            *('{0:.1f} ms'.format(value * 1000) if value is not None
+              else '-' for value in (percentile(values, 0.50),
+                                     percentile(values, 0.99)))))
+    print('throughput: {0:.0f} sessions/s, {1:.0f} commands/s, {2:.1f} MB '
+          'in {3:.1f}s'.format(
+              len(results['connect']) / elapsed,
+              len(results['round trip']) * len(COMMANDS) / elapsed,
+              sum(results['bytes']) / 1024.0 / 1024.0, elapsed))
+    for name in ('connect failed', 'session failed'):
+        if results[name]:
+            print('{0}: {1}, e.g. {2}'.format(
+                name, len(results[name]), results[name][0]))
+    if simulator:
+        print('simulator:  {0}'.format(simulator.stats()))
+        simulator.stop()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
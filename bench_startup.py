@@ -0,0 +1,126 @@
+#!/usr/bin/python
+""" Cold-start benchmark of the modules short CLI runs import.
+
+    Imports each module in a fresh interpreter under "python -X
+    importtime", several times, and checks the best cumulative import
+    time against its budget in BUDGETS.  Also fails if importing one of
+    them loads paramiko or its crypto stack (which should only load when
+    the first SSH session opens), or creates a DB file (the schema is set
+    up when the first DB session opens).  Prints the slowest imports
+    under each module, to show where a regression came from.
+
+        python bench_startup.py --repeat 10
+        python bench_startup.py --scale 2      # on a slower machine
+
+    Exits 1 if any check fails.
+"""
+
+# Standard library modules
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+
+# Cold-start budget per module, in milliseconds
+BUDGETS = {
+    'show_parsers': 40,
+    'syslog_parser': 80,
+    'db': 80,
+    'remediations': 120,
+    'demo_better': 300,
+}
+
+# Top-level packages that must not load on import
+HEAVY = ('paramiko', 'cryptography', 'nacl', 'bcrypt', 'invoke')
+
+# "import time:       412 |       1391 |   re._compiler"
+IMPORTTIME_RE = re.compile(
+    r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)\s*$', re.M)
+
+# Source directory, imported from in the child interpreters
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def import_times(module, workdir):
+    """ Imports a module in a fresh interpreter, with "workdir" as the
+        current directory so files it creates can be spotted.
+
+        @return imports     a list of (name, self microseconds, cumulative
+                            microseconds, depth), in import order
+    """
+    environment = dict(os.environ, PYTHONPATH=HERE)
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c',
+         'import {0}'.format(module)],
+        cwd=workdir, env=environment, stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode:
+        error = 'Importing {0} failed:\n{1}'.format(module, result.stderr)
+        raise Exception(error)
+    return [(name, int(own), int(cumulative), len(indent) // 2)
+            for own, cumulative, indent, name in
+            IMPORTTIME_RE.findall(result.stderr)]
+
+
+def main(argv=None):
+    """ Main program logic """
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('modules', nargs='*', default=sorted(BUDGETS),
+                        help='modules to import (default: those in '
+                             'BUDGETS)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='imports per module, the best counts '
+                             '(default: %(default)s)')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiply every budget by this')
+    parser.add_argument('--top', type=int, default=5,
+                        help='slowest imports to show per module')
+    args = parser.parse_args(argv)
+
+    failures = 0
+    workdir = tempfile.mkdtemp()
+    try:
+        for module in args.modules:
+            runs = [import_times(module, workdir)
+                    for _ in range(args.repeat)]
+            best = min(runs, key=lambda imports: imports[-1][2])
+            milliseconds = best[-1][2] / 1000.0
+            budget = BUDGETS.get(module)
+            problems = []
+            if budget is not None and milliseconds > budget * args.scale:
+                problems.append('over budget')
+            heavy = sorted(set(
+                name.split('.')[0] for name, _, _, _ in best
+                if name.split('.')[0] in HEAVY))
+            if heavy:
+                problems.append('loads {0}'.format(', '.join(heavy)))
+            created = os.listdir(workdir)
+            if created:
+                problems.append('creates {0}'.format(', '.join(created)))
+                for name in created:
+                    os.remove(os.path.join(workdir, name))
+            failures += bool(problems)
+
+            print('{0:<16} {1:7.1f} ms  budget {2:>7}  {3}'.format(
+                module, milliseconds,
+                '{0:.0f} ms'.format(budget * args.scale) if budget
+                else '-', '; '.join(problems) or 'ok'))
+            # The module's own imports follow the interpreter's startup
+            # imports, the last top-level line before its own
+            start = max([number for number, item in enumerate(best[:-1])
+                         if item[3] == 0] or [-1]) + 1
+            slowest = sorted(best[start:-1], key=lambda item: -item[1])
+            for name, own, _, _ in slowest[:args.top]:
+                print('    {0:7.1f} ms  {1}'.format(own / 1000.0, name))
+    finally:
+        shutil.rmtree(workdir)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
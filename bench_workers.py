@@ -0,0 +1,70 @@
+#!/usr/bin/python
+""" Benchmark of queue draining throughput by worker count.
+
+    Queues synthetic events, then drains them with 1, 2, 4 and 8 worker
+    processes running an I/O-bound stand-in remediation, reporting
+    events/sec and any event remediated more than once.
+
+        python bench_workers.py --events 400 --latency 0.05
+"""
+
+# Standard library modules
+import argparse
+import sys
+import time
+
+# Local modules
+import db
+import workers
+
+
+# Seconds each stand-in remediation takes; set from the command line
+LATENCY = 0.05
+
+
+def remediate(event_id):
+    """ Stands in for a remediation waiting on a device. """
+    time.sleep(LATENCY)
+
+
+def main(argv=None):
+    """ Main program logic """
+    global LATENCY
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--events', type=int, default=400)
+    parser.add_argument('--latency', type=float, default=LATENCY,
+                        help='seconds per remediation (default: %(default)s)')
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=[1, 2, 4, 8])
+    args = parser.parse_args(argv)
+    LATENCY = args.latency
+
+    with db.scratch():
+        db.insert_events(
+            ('2016 Apr  2', '14:25:06', 'switch{0}'.format(number),
+             'ETHPORT-5-IF_DOWN_LINK_FAILURE',
+             'Interface Ethernet1/1 is down (Link failure)')
+            for number in range(args.events))
+
+        print('{0:>8} {1:>10} {2:>12} {3:>12}'.format(
+            'workers', 'seconds', 'events/sec', 'duplicates'))
+        for processes in args.workers:
+            with db.transaction() as session:
+                session.execute('''
+                    UPDATE events
+                    SET result=NULL, lease_owner=NULL, lease_expires=NULL,
+                        attempts=0
+                ''')
+            started = time.time()
+            completed, failed = workers.run_workers(
+                remediate, processes=processes)
+            elapsed = time.time() - started
+            duplicates = db._open_session().execute(
+                'SELECT COUNT(*) FROM events WHERE attempts != 1').fetchone()
+            assert completed == args.events and not failed
+            print('{0:>8} {1:>10.2f} {2:>12.0f} {3:>12}'.format(
+                processes, elapsed, completed / elapsed, duplicates[0]))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,230 @@
+""" Per-device cache of show-command output
+
+    Remediations for different events on the same switch often run the
+    same read-only commands.  Their output is cached per (device,
+    command) for a TTL that depends on the command, and concurrent
+    requests for output that is already being fetched wait for that fetch
+    instead of starting their own:
+
+        outputs = command_cache.CACHE.get(device_name, [command])
+        output = outputs[command]
+
+    Only "show" commands are cached; anything else always goes to the
+    device.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+import re
+import threading
+import time
+
+# Local modules
+import metrics
+import ssh_pool
+
+
+# Seconds output stays fresh, by command.  The first matching pattern
+# wins; commands matching none are not cached.  Counters and light levels
+# move quickly, module inventory hardly at all.
+TTL_RULES = [
+    (r'^show module uptime\b', 10),
+    (r'^show module\b', 60),
+    (r'^show interface .* transceiver\b', 30),
+    (r'^show interface\b', 5),
+    (r'^show\b', 30),
+]
+
+# Entries kept before the least recently used are evicted
+MAX_ENTRIES = 4096
+
+ROUND_TRIP_SECONDS = metrics.histogram(
+    'ssh_round_trip_seconds', 'Time per pipelined SSH round trip',
+    ('device',))
+COMMANDS = metrics.counter(
+    'ssh_commands_total', 'Commands sent to devices', ('device',))
+LOOKUPS = metrics.counter(
+    'command_cache_lookups_total', 'Lookups in the shared command cache, by '
+                                   'outcome', ('outcome',))
+
+
+def normalize(command):
+    """ Collapses runs of whitespace, so trivially different spellings of
+        a command share an entry.
+
+        @return command     the normalized command
+    """
+    return ' '.join(command.split())
+
+
+class _Fetch(object):
+    """ Output of commands being fetched by one thread, awaited by others. """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.outputs = {}
+        self.error = None
+
+
+class CommandCache(object):
+    """ Caches command output keyed by (device, normalized command), with
+        per-command TTLs and LRU eviction past "max_entries".  Misses are
+        fetched through the SSH pool, several commands in one pipelined
+        round trip.
+    """
+
+    def __init__(self, pool=None, ttl_rules=TTL_RULES,
+                 max_entries=MAX_ENTRIES):
+        self.pool = pool
+        self.ttl_rules = [(re.compile(pattern), ttl)
+                          for pattern, ttl in ttl_rules]
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()  # key -> (expires, output)
+        self._fetching = {}                         # key -> _Fetch
+
+    def ttl(self, command):
+        """ Gets how long a command's output may be cached.
+
+            @return ttl         seconds, 0 if it must not be cached
+        """
+        for pattern, ttl in self.ttl_rules:
+            if pattern.match(command):
+                return ttl
+        return 0
+
+    def _store(self, key, output, ttl):
+        """ Adds an entry, evicting the least recently used ones past the
+            size limit.  Called with the lock held.
+        """
+        self._entries[key] = (time.time() + ttl, output)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _fetch(self, device, commands):
+        """ Runs commands on the device in one round trip.
+
+            @return outputs     a dictionary of command to output
+        """
+        pool = self.pool or ssh_pool.POOL
+        COMMANDS.inc(device, amount=len(commands))
+        with pool.session(device) as ssh:
+            with ROUND_TRIP_SECONDS.time(device):
+                return ssh.write_pipelined(commands)
+
+    def get(self, device, commands):
+        """ Gets the output of each command on the device, from the cache
+            where it is still fresh.
+
+            @return outputs     an OrderedDict of command to output, in the
+                                order the commands were given
+        """
+        now = time.time()
+        found = {}
+        waiting = {}        # command -> _Fetch another thread is running
+        mine = []           # commands this thread fetches
+        fetch = _Fetch()
+        with self._lock:
+            for command in commands:
+                key = (device, normalize(command))
+                if not self.ttl(key[1]):
+                    self.misses += 1
+                    LOOKUPS.inc('miss')
+                    mine.append(command)
+                    continue
+                entry = self._entries.get(key)
+                if entry and entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    LOOKUPS.inc('hit')
+                    found[command] = entry[1]
+                elif key in self._fetching:
+                    self.coalesced += 1
+                    LOOKUPS.inc('coalesced')
+                    waiting[command] = self._fetching[key]
+                else:
+                    self.misses += 1
+                    LOOKUPS.inc('miss')
+                    self._fetching[key] = fetch
+                    mine.append(command)
+
+        if mine:
+            try:
+                fetch.outputs = self._fetch(device, mine)
+            except BaseException as error:
+                fetch.error = error
+                raise
+            finally:
+                with self._lock:
+                    for command in mine:
+                        key = (device, normalize(command))
+                        if self._fetching.get(key) is fetch:
+                            del self._fetching[key]
+                        ttl = self.ttl(key[1])
+                        if fetch.error is None and ttl:
+                            self._store(key, fetch.outputs[command], ttl)
+                fetch.done.set()
+            found.update(fetch.outputs)
+
+        for command, other in waiting.items():
+            other.done.wait()
+            if other.error is not None:
+                error = ('Fetching "{0}" from {1} failed:  {2}'.format(
+                         command, device, other.error))
+                raise Exception(error)
+            found[command] = other.outputs[
+                self._find(other.outputs, command)]
+
+        return collections.OrderedDict(
+            (command, found[command]) for command in commands)
+
+    @staticmethod
+    def _find(outputs, command):
+        """ Finds the key another thread used for the same command, which
+            may be spelled differently.
+        """
+        if command in outputs:
+            return command
+        command = normalize(command)
+        for other in outputs:
+            if normalize(other) == command:
+                return other
+        raise KeyError(command)
+
+    def invalidate(self, device=None):
+        """ Drops cached output for one device, or for every device.
+
+            @return None
+        """
+        with self._lock:
+            for key in list(self._entries):
+                if device is None or key[0] == device:
+                    del self._entries[key]
+
+    def stats(self):
+        """ @return stats       a dict of counters and the entry count """
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'hit_rate': ((self.hits + self.coalesced) / lookups
+                             if lookups else 0.0),
+            }
+
+
+# Shared cache used by the remediations
+CACHE = CommandCache()
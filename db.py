@@ -4,79 +4,463 @@
     tracking of events and remediations.
 """
 
+import array
+import contextlib
+import itertools
 import os
+import shutil
 import sqlite3
+import tempfile
+import threading
+import time
+
+# Local modules
+import events as records
+import metrics
+import timestamps
 
 
 DB_FILE = 'db.sqlite'
 SCHEMA = ('''
-    CREATE TABLE events (
+    CREATE TABLE IF NOT EXISTS events (
         id              INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
         datestamp       DATE,
         device          TEXT,
         error_code      TEXT,
         error_message   TEXT,
-        result          INTEGER)
+        result          INTEGER);
+
+    CREATE TABLE IF NOT EXISTS checkpoints (
+        log_file        TEXT PRIMARY KEY NOT NULL,
+        inode           INTEGER,
+        offset          INTEGER);
+
+    CREATE TABLE IF NOT EXISTS nodes (
+        name            TEXT PRIMARY KEY NOT NULL,
+        heartbeat       REAL);
+
+    CREATE TABLE IF NOT EXISTS partitions (
+        name            TEXT PRIMARY KEY NOT NULL,
+        day_start       INTEGER,
+        day_end         INTEGER,
+        events          INTEGER);
+
+    CREATE TABLE IF NOT EXISTS metrics (
+        taken           REAL,
+        name            TEXT,
+        labels          TEXT,
+        value           REAL);
+
+    CREATE INDEX IF NOT EXISTS metrics_taken
+        ON metrics (taken);
 ''')
 
 
+# Schema changes for existing DB files, applied in order.  Each entry
+# brings the file up to the version matching its position in the list
+# (tracked in "PRAGMA user_version").
+MIGRATIONS = [
+    # 1:  Deduplicate events with a UNIQUE index instead of a SELECT
+    #     before every insert
+    ('''
+        DELETE FROM events
+        WHERE id NOT IN (
+            SELECT MIN(id)
+            FROM events
+            GROUP BY datestamp, device, error_code, error_message);
+
+        CREATE UNIQUE INDEX IF NOT EXISTS events_dedup
+            ON events (datestamp, device, error_code, error_message);
+    '''),
+    # 2:  Lead the dedup index with (device, error_code, datestamp) so it
+    #     also serves per-device lookups, and index the filters that
+    #     query_events() pages over (an index ends with the rowid, so
+    #     these return matches already in id order)
+    ('''
+        DROP INDEX IF EXISTS events_dedup;
+
+        CREATE UNIQUE INDEX events_dedup
+            ON events (device, error_code, datestamp, error_message);
+
+        CREATE INDEX IF NOT EXISTS events_device_error_code
+            ON events (device, error_code);
+
+        CREATE INDEX IF NOT EXISTS events_result
+            ON events (result);
+    '''),
+    # 3:  Keep a sortable epoch-seconds copy of each datestamp, so time
+    #     windows and "latest N per device" are index range scans
+    ('''
+        ALTER TABLE events ADD COLUMN epoch INTEGER;
+
+        UPDATE events SET epoch = datestamp_epoch(datestamp);
+
+        CREATE INDEX IF NOT EXISTS events_epoch
+            ON events (epoch);
+
+        CREATE INDEX IF NOT EXISTS events_device_epoch
+            ON events (device, epoch);
+    '''),
+    # 4:  Count the repeats of an event suppressed instead of remediated;
+    #     see aggregator.py
+    ('''
+        ALTER TABLE events ADD COLUMN suppressed INTEGER DEFAULT 0;
+    '''),
+    # 5:  Work queue columns; see claim_events().  The partial index holds
+    #     only events still waiting for a result, so claiming stays cheap
+    #     however many finished events the table holds.
+    ('''
+        ALTER TABLE events ADD COLUMN lease_owner TEXT;
+
+        ALTER TABLE events ADD COLUMN lease_expires INTEGER;
+
+        ALTER TABLE events ADD COLUMN attempts INTEGER DEFAULT 0;
+
+        CREATE INDEX IF NOT EXISTS events_pending
+            ON events (id) WHERE result IS NULL;
+    '''),
+]
+
+# Event result codes.  Events with no result are waiting for remediation;
+# backfilled events were loaded from an archive and are never remediated.
+RESULT_FAILED = 1
+RESULT_COMPLETED = 2
+RESULT_SUPPRESSED = 3
+RESULT_BACKFILLED = 4
+
+# Work queue defaults:  seconds a claimed event stays leased to a worker,
+# and claims of an event before it is given up on as failed
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = 3
+
+# Number of events written per transaction by insert_events()
+INSERT_BATCH_SIZE = 1000
+
+# Connection settings applied to every new session; see configure().
+# WAL lets readers and a writer work concurrently, and "NORMAL" sync is
+# durable across application crashes in WAL mode.
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -16000,           # negative values are KiB
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+# Seconds to wait on a locked database before raising
+BUSY_TIMEOUT = 30
+
+# Per-thread sessions, see _open_session()
+_local = threading.local()
+
+# DB files whose schema this process has set up, see ensure_schema()
+_schema_ready = set()
+_schema_lock = threading.Lock()
+
+# Metrics snapshots older than this many seconds are deleted by
+# save_metrics()
+METRICS_RETENTION = 7 * 86400
+
+DB_SECONDS = metrics.histogram(
+    'db_call_seconds', 'Time spent in DB calls', ('call',))
+COMMIT_SECONDS = metrics.histogram(
+    'db_commit_seconds', 'Time spent committing write transactions')
+READ_PARSE_SECONDS = metrics.histogram(
+    'ingest_read_parse_seconds',
+    'Time reading and parsing each batch of events before it is inserted')
+INSERT_SECONDS = metrics.histogram(
+    'db_insert_batch_seconds', 'Time inserting each batch of events')
+EVENTS_INSERTED = metrics.counter(
+    'events_inserted_total', 'Parsed events written to the DB, including '
+                             'duplicates skipped')
+
+
 def _create_schema_if_not_exists(db_file=DB_FILE, schema=SCHEMA):
-    """ Creates a SQLite database file if it does not already exist. """
-    if not os.path.exists(db_file):
-        with sqlite3.connect(db_file) as session:
-            session.execute(schema)
+    """ Creates the SQLite database file and any missing tables, then
+        applies any migrations the file has not seen yet.
+    """
+    session = sqlite3.connect(db_file)
+    session.create_function('datestamp_epoch', 1,
+                            timestamps.datestamp_to_epoch, deterministic=True)
+    # Only takes effect on a new, empty file; existing files are switched
+    # over by partitions.incremental_vacuum()
+    session.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    session.executescript(schema)
+    version = session.execute('PRAGMA user_version').fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS, start=1):
+        if number <= version:
+            continue
+        session.executescript(
+            'BEGIN; {0}; PRAGMA user_version = {1}; COMMIT;'.format(
+                migration, number))
+    session.close()
 
 
-def _open_session(db_file=DB_FILE):
-    """ Opens a connection to the DB file.
+def ensure_schema(db_file=None):
+    """ Creates and migrates a DB file's schema the first time this
+        process uses the file; later calls return at once.  Sessions call
+        it as they open, so importing this module touches no file.
 
-        @return cursor      a database cursor
+        @return None
     """
-    return sqlite3.connect(db_file)
+    db_file = db_file or DB_FILE
+    if db_file in _schema_ready:
+        return
+    with _schema_lock:
+        if db_file not in _schema_ready:
+            _create_schema_if_not_exists(db_file)
+            _schema_ready.add(db_file)
 
 
-def _insert_event(datestamp, device, error_code, error_message):
-    """ Creates a new event based on the parameters provided.
+def configure(db_file=None, **pragmas):
+    """ Changes the DB file and/or connection pragmas used by sessions,
+        e.g. configure(synchronous='FULL', mmap_size=0).  The calling
+        thread's sessions are closed so the change applies to its next
+        query; other threads pick it up when they next connect.
 
-        @return event_id    the unique database id of the event
+        @return None
     """
-    session = _open_session()
-    sql = ('''
-        INSERT INTO events (datestamp, device, error_code, error_message)
-        VALUES (?, ?, ?, ?)
-    ''')
-    cursor = session.cursor()
-    cursor.execute(
-        sql, (datestamp, device, error_code, error_message))
-    event_id = cursor.lastrowid
-    session.commit()
-    session.close()
-    return event_id
+    global DB_FILE
+    if db_file:
+        DB_FILE = db_file
+    PRAGMAS.update(pragmas)
+    close_session()
 
 
-def insert_event(datestamp, timestamp, device, error_code, error_message):
-    """ Creates a new event based on the parameters provided.
+@contextlib.contextmanager
+def scratch(directory=None, name='scratch.sqlite'):
+    """ Points sessions at a new DB file, with its schema, for the
+        enclosed block, e.g. a benchmark run.  The file is created in
+        "directory", or in a temporary directory, and removed afterwards,
+        and the previous DB file is restored.
 
-        @return event_id    the unique database id of the event
+        @return db_file     the path of the scratch DB file
     """
-    datestamp = '{0} {1}'.format(datestamp, timestamp)
-    session = _open_session()
-    sql = ('''
+    previous = DB_FILE
+    workdir = directory or tempfile.mkdtemp()
+    db_file = os.path.join(workdir, name)
+    configure(db_file=db_file)
+    try:
+        ensure_schema(db_file)
+        yield db_file
+    finally:
+        configure(db_file=previous)
+        # A later file at the same path needs its schema again
+        _schema_ready.discard(db_file)
+        if directory is None:
+            shutil.rmtree(workdir)
+        else:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(db_file + suffix):
+                    os.remove(db_file + suffix)
+
+
+def _open_session(db_file=None):
+    """ Gets this thread's connection to the DB file, opening it on first
+        use.  Connections are reused for the life of the thread and are
+        never shared between threads or processes.
+
+        @return session     a database connection in autocommit mode
+    """
+    db_file = db_file or DB_FILE
+    sessions = getattr(_local, 'sessions', None)
+    if sessions is None:
+        sessions = _local.sessions = {}
+    # A forked child inherits its parent's thread-locals, so key on the
+    # pid as well to give the child its own connection
+    key = (os.getpid(), db_file)
+    session = sessions.get(key)
+    if session is None:
+        ensure_schema(db_file)
+        session = sqlite3.connect(
+            db_file, timeout=BUSY_TIMEOUT, isolation_level=None)
+        for name, value in PRAGMAS.items():
+            session.execute('PRAGMA {0} = {1}'.format(name, value))
+        sessions[key] = session
+    return session
+
+
+def close_session():
+    """ Closes this thread's connections.
+
+        @return None
+    """
+    sessions = getattr(_local, 'sessions', {})
+    for key, session in list(sessions.items()):
+        if key[0] == os.getpid():
+            session.close()
+        del sessions[key]
+
+
+@contextlib.contextmanager
+def transaction(db_file=None, immediate=True):
+    """ Runs the enclosed statements in one transaction on this thread's
+        connection, committing on success and rolling back on error.
+        Nested use joins the outer transaction.
+
+        Writers take the write lock up front ("BEGIN IMMEDIATE") so that
+        two writers never deadlock upgrading from a read lock.
+
+        @return session     a database connection
+    """
+    session = _open_session(db_file)
+    if session.in_transaction:
+        yield session
+        return
+    session.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+    try:
+        yield session
+    except BaseException:
+        session.execute('ROLLBACK')
+        raise
+    with COMMIT_SECONDS.time():
+        session.execute('COMMIT')
+
+
+def _batches(iterable, size):
+    """ Splits an iterable into lists of at most "size" items. """
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _find_archived(session, batch):
+    """ Looks up rows of a batch that were already moved into a day
+        partition (see partitions.py), which the UNIQUE index of the
+        events table no longer covers.  Costs one query per batch unless
+        the batch reaches back into archived days.
+
+        @return archived    a dictionary of rows to their event ids
+    """
+    epochs = [row[4] for row in batch if row[4] is not None]
+    if not epochs:
+        return {}
+    days = session.execute('''
+        SELECT name, day_start, day_end
+        FROM partitions
+        WHERE day_end > ? AND day_start <= ?
+    ''', (min(epochs), max(epochs))).fetchall()
+    archived = {}
+    for row in batch:
+        for name, day_start, day_end in days:
+            if row[4] is not None and day_start <= row[4] < day_end:
+                found = session.execute('''
+                    SELECT id
+                    FROM {0}
+                    WHERE datestamp=? AND device=? AND error_code=?
+                        AND error_message=?
+                '''.format(name), row[:4]).fetchone()
+                if found:
+                    archived[row] = found[0]
+                break
+    return archived
+
+
+def _insert_rows(rows, batch_size=INSERT_BATCH_SIZE, return_ids=True,
+                 result=None):
+    """ Writes (datestamp, device, error_code, error_message, epoch) rows
+        in batches, one executemany() and one transaction per batch.
+        Rows that already exist are skipped, by the UNIQUE index or, once
+        their day is archived, by _find_archived().  New rows are given
+        "result", so with one set they are never queued.
+
+        @return event_ids   the unique database ids, in input order, or
+                            the number of rows read if not return_ids
+    """
+    insert_sql = ('''
+        INSERT OR IGNORE INTO events
+            (datestamp, device, error_code, error_message, epoch, result)
+        VALUES (?, ?, ?, ?, ?, {0})
+    '''.format('NULL' if result is None else int(result)))
+    select_sql = ('''
         SELECT id
         FROM events
         WHERE datestamp=? AND device=? AND error_code=? AND error_message=?
     ''')
-    result = session.execute(
-        sql, (datestamp, device, error_code, error_message)).fetchone()
-    # Already exists, skip the insert to avoid duplication
-    if result:
-        event_id = result[0]
-        return event_id
-    return _insert_event(datestamp, device, error_code, error_message)
+    event_ids = []
+    count = 0
+    batches = _batches(rows, batch_size)
+    while True:
+        # Rows are usually parsed as they are read, so building the batch
+        # times the reading and parsing upstream
+        started = time.perf_counter()
+        batch = next(batches, None)
+        read = time.perf_counter()
+        if batch is None:
+            break
+        READ_PARSE_SECONDS.observe(read - started)
+        count += len(batch)
+        with transaction() as session:
+            archived = _find_archived(session, batch)
+            session.executemany(insert_sql, [
+                row for row in batch if row not in archived]
+                if archived else batch)
+            if return_ids:
+                for row in batch:
+                    event_id = archived.get(row)
+                    if event_id is None:
+                        event_id = session.execute(
+                            select_sql, row[:4]).fetchone()[0]
+                    event_ids.append(event_id)
+        INSERT_SECONDS.observe(time.perf_counter() - read)
+        EVENTS_INSERTED.inc(amount=len(batch))
+    return event_ids if return_ids else count
+
+
+def insert_events(events, batch_size=INSERT_BATCH_SIZE, return_ids=True,
+                  result=None):
+    """ Creates events in bulk from an iterable of
+        (datestamp, timestamp, device, error_code, error_message) tuples.
+
+        Each batch is written with a single executemany() inside one
+        transaction.  Events that already exist are skipped by the
+        UNIQUE index rather than a per-row SELECT.  Backfills that do not
+        need the ids can pass return_ids=False, which skips looking them
+        up and keeps memory use flat, and pass a "result" such as
+        RESULT_BACKFILLED so the events are not queued for remediation.
+
+        @return event_ids   the unique database ids, in input order, or
+                            the number of events read if not return_ids
+    """
+    rows = (
+        ('{0} {1}'.format(datestamp, timestamp),
+         device, error_code, error_message,
+         timestamps.to_epoch(datestamp, timestamp))
+        for datestamp, timestamp, device, error_code, error_message
+        in events)
+    return _insert_rows(rows, batch_size, return_ids, result)
+
+
+def insert_batch(batch, batch_size=INSERT_BATCH_SIZE, return_ids=True):
+    """ Creates the events of an events.EventBatch, as insert_events()
+        does, and fills in the batch's ids.
+
+        @return event_ids   the unique database ids, in batch order, or
+                            the number of events if not return_ids
+    """
+    result = _insert_rows(batch.rows(), batch_size, return_ids)
+    if return_ids:
+        batch.ids = array.array('q', result)
+    return result
+
+
+@metrics.timed(DB_SECONDS, 'insert_event')
+def insert_event(datestamp, timestamp, device, error_code, error_message):
+    """ Creates a new event based on the parameters provided.
+
+        @return event_id    the unique database id of the event
+    """
+    return insert_events(
+        [(datestamp, timestamp, device, error_code, error_message)])[0]
 
 
+@metrics.timed(DB_SECONDS, 'get_event_by_id')
 def get_event_by_id(event_id):
-    """ Gets an event by its unique id.
+    """ Gets an event by its unique id, if it has not been archived
+        (see partitions.py).
 
         @return event       a dictionary of column names to this event's values
     """
@@ -86,9 +470,18 @@ def get_event_by_id(event_id):
         FROM events
         WHERE id=?
     ''')
-    event = session.execute(sql, (event_id,)).fetchone()
-    session.close()
-    return event
+    return session.execute(sql, (event_id,)).fetchone()
+
+
+def get_event(event_id):
+    """ Gets an event by its unique id, if it has not been archived.
+
+        @return event       an events.Event, or None if there is no such event
+    """
+    row = get_event_by_id(event_id)
+    if row is None:
+        return None
+    return records.Event.from_row(event_id, row)
 
 
 def get_events(limit=1000):
@@ -99,26 +492,314 @@ def get_events(limit=1000):
         FROM events
         LIMIT ?
     ''')
-    events = session.execute(sql, (limit,)).fetchall()
-    session.close()
-    return events
+    return session.execute(sql, (limit,)).fetchall()
+
+
+@metrics.timed(DB_SECONDS, 'query_events')
+def query_events(device=None, error_code=None, start=None, end=None,
+                 result=None, after_id=0, limit=1000):
+    """ Gets events matching every filter provided, oldest first, from
+        the events table only.  partitions.query_events() also searches
+        the archived days.
+
+        Pages are fetched with a keyset cursor rather than OFFSET:  pass
+        the id of the last event of one page as "after_id" to get the
+        next, so deep pages cost the same as the first.
+
+        @param start, end   inclusive time range, in seconds since the epoch
+        @param result       a result code, or a list of result codes
+        @return events      a list of
+                            (id, datestamp, device, error_code,
+                             error_message, result) tuples
+    """
+    clauses = ['id > ?']
+    params = [after_id]
+    if device is not None:
+        clauses.append('device = ?')
+        params.append(device)
+    if error_code is not None:
+        clauses.append('error_code = ?')
+        params.append(error_code)
+    if start is not None:
+        clauses.append('epoch >= ?')
+        params.append(start)
+    if end is not None:
+        clauses.append('epoch <= ?')
+        params.append(end)
+    if result is not None:
+        if not isinstance(result, (list, tuple, set)):
+            result = [result]
+        clauses.append('result IN ({0})'.format(
+            ', '.join('?' * len(result))))
+        params.extend(result)
+    sql = ('''
+        SELECT id, datestamp, device, error_code, error_message, result
+        FROM events
+        WHERE {0}
+        ORDER BY id
+        LIMIT ?
+    '''.format(' AND '.join(clauses)))
+    params.append(limit)
+    return _open_session().execute(sql, params).fetchall()
 
 
+@metrics.timed(DB_SECONDS, 'latest_events')
+def latest_events(device, limit=10):
+    """ Gets a device's most recent events not yet archived, newest
+        first.
+
+        @return events      a list of
+                            (id, datestamp, device, error_code,
+                             error_message, result) tuples
+    """
+    sql = ('''
+        SELECT id, datestamp, device, error_code, error_message, result
+        FROM events
+        WHERE device=?
+        ORDER BY epoch DESC
+        LIMIT ?
+    ''')
+    return _open_session().execute(sql, (device, limit)).fetchall()
+
+
+@metrics.timed(DB_SECONDS, 'expire_events')
+def expire_events(before):
+    """ Deletes events logged before the given time (seconds since the
+        epoch).
+
+        @return count       the number of events deleted
+    """
+    sql = ('''
+        DELETE FROM events
+        WHERE epoch < ?
+    ''')
+    with transaction() as session:
+        return session.execute(sql, (before,)).rowcount
+
+
+@metrics.timed(DB_SECONDS, 'update_event_result')
 def update_event_result(event_id, result):
     """ Update an event's result.
 
         @return None
     """
-    session = _open_session()
     sql = ('''
         UPDATE events
         SET result=?
         WHERE id=?
     ''')
-    cursor = session.cursor()
-    cursor.execute(sql, (event_id, result))
-    session.commit()
-    session.close()
+    with transaction() as session:
+        session.execute(sql, (result, event_id))
+
+
+@metrics.timed(DB_SECONDS, 'update_suppressed')
+def update_suppressed(counts, suppressed_ids=()):
+    """ Sets the number of suppressed repeats of each event, from a
+        dictionary of event ids to counts, and marks the repeats
+        themselves as suppressed so they are never queued for remediation.
+
+        @return None
+    """
+    count_sql = ('''
+        UPDATE events
+        SET suppressed=?
+        WHERE id=?
+    ''')
+    result_sql = ('''
+        UPDATE events
+        SET result=?
+        WHERE id=? AND result IS NULL
+    ''')
+    with transaction() as session:
+        session.executemany(
+            count_sql,
+            [(count, event_id) for event_id, count in counts.items()])
+        session.executemany(
+            result_sql,
+            [(RESULT_SUPPRESSED, event_id) for event_id in suppressed_ids])
+
+
+@metrics.timed(DB_SECONDS, 'claim_events')
+def claim_events(owner, limit=1, lease=LEASE_SECONDS,
+                 max_attempts=MAX_ATTEMPTS, owns_device=None):
+    """ Leases up to "limit" waiting events to a worker, oldest first.
+        An event is claimable while it has no result and no unexpired
+        lease, so an event whose worker died is claimed again once its
+        lease runs out.  Events that have used up "max_attempts" claims
+        are marked failed instead.
+
+        Passing "owns_device", a function of a device name, limits the
+        claim to the devices it returns True for (see sharding.py).
+
+        The write lock is taken before looking for events, so two
+        workers never claim the same one.
+
+        @return events      a list of
+                            (id, datestamp, device, error_code,
+                             error_message) tuples
+    """
+    now = int(time.time())
+    give_up_sql = ('''
+        UPDATE events
+        SET result=?, lease_owner=NULL, lease_expires=NULL
+        WHERE result IS NULL AND attempts >= ?
+            AND (lease_expires IS NULL OR lease_expires <= ?)
+    ''')
+    select_sql = ('''
+        SELECT id, datestamp, device, error_code, error_message
+        FROM events
+        WHERE result IS NULL AND attempts < ?
+            AND (lease_expires IS NULL OR lease_expires <= ?)
+            {0}
+        ORDER BY id
+        LIMIT ?
+    '''.format('AND owns_device(device)' if owns_device else ''))
+    claim_sql = ('''
+        UPDATE events
+        SET lease_owner=?, lease_expires=?, attempts=attempts + 1
+        WHERE id=?
+    ''')
+    if owns_device:
+        _open_session().create_function('owns_device', 1, owns_device)
+    with transaction() as session:
+        session.execute(give_up_sql, (RESULT_FAILED, max_attempts, now))
+        events = session.execute(
+            select_sql, (max_attempts, now, limit)).fetchall()
+        session.executemany(
+            claim_sql, [(owner, now + lease, event[0]) for event in events])
+    return events
+
+
+@metrics.timed(DB_SECONDS, 'complete_event')
+def complete_event(event_id, owner, result=RESULT_COMPLETED):
+    """ Records the result of a claimed event and ends its lease.
+
+        @return completed   False if the lease had passed to another worker
+    """
+    sql = ('''
+        UPDATE events
+        SET result=?, lease_owner=NULL, lease_expires=NULL
+        WHERE id=? AND lease_owner=?
+    ''')
+    with transaction() as session:
+        return session.execute(sql, (result, event_id, owner)).rowcount == 1
 
 
-_create_schema_if_not_exists()
+@metrics.timed(DB_SECONDS, 'fail_event')
+def fail_event(event_id, owner, retry_delay=0, max_attempts=MAX_ATTEMPTS):
+    """ Ends the lease of a claimed event whose remediation failed.  It
+        is claimable again after "retry_delay" seconds, or marked failed
+        if it has used up its attempts.
+
+        @return failed      True if the event was marked failed for good
+    """
+    sql = ('''
+        UPDATE events
+        SET result=CASE WHEN attempts >= ? THEN ? END,
+            lease_owner=NULL,
+            lease_expires=?
+        WHERE id=? AND lease_owner=?
+    ''')
+    with transaction() as session:
+        session.execute(sql, (max_attempts, RESULT_FAILED,
+                              int(time.time() + retry_delay),
+                              event_id, owner))
+        row = session.execute('SELECT result FROM events WHERE id=?',
+                              (event_id,)).fetchone()
+    return bool(row) and row[0] == RESULT_FAILED
+
+
+@metrics.timed(DB_SECONDS, 'count_pending')
+def count_pending():
+    """ Counts the events still waiting for a result.
+
+        @return count       the number of pending events
+    """
+    sql = ('''
+        SELECT COUNT(*)
+        FROM events
+        WHERE result IS NULL
+    ''')
+    return _open_session().execute(sql).fetchone()[0]
+
+
+def heartbeat(node):
+    """ Records that a node is alive, adding it to the membership table
+        if it is new.
+
+        @return None
+    """
+    sql = ('''
+        INSERT OR REPLACE INTO nodes (name, heartbeat)
+        VALUES (?, ?)
+    ''')
+    with transaction() as session:
+        session.execute(sql, (node, time.time()))
+
+
+def live_nodes(since):
+    """ Gets the nodes that have sent a heartbeat since the given time
+        (seconds since the epoch).
+
+        @return nodes       a sorted list of node names
+    """
+    sql = ('''
+        SELECT name
+        FROM nodes
+        WHERE heartbeat >= ?
+        ORDER BY name
+    ''')
+    return [row[0] for row in _open_session().execute(sql, (since,))]
+
+
+def remove_node(node):
+    """ Removes a node from the membership table.
+
+        @return None
+    """
+    with transaction() as session:
+        session.execute('DELETE FROM nodes WHERE name=?', (node,))
+
+
+def get_checkpoint(log_file):
+    """ Gets the saved read position of a log file.
+
+        @return checkpoint  a tuple of (inode, offset), or None
+    """
+    session = _open_session()
+    sql = ('''
+        SELECT inode, offset
+        FROM checkpoints
+        WHERE log_file=?
+    ''')
+    return session.execute(sql, (log_file,)).fetchone()
+
+
+def save_checkpoint(log_file, inode, offset):
+    """ Saves the read position of a log file so a restart can resume
+        from the same byte offset.
+
+        @return None
+    """
+    sql = ('''
+        INSERT OR REPLACE INTO checkpoints (log_file, inode, offset)
+        VALUES (?, ?, ?)
+    ''')
+    with transaction() as session:
+        session.execute(sql, (log_file, inode, offset))
+
+
+def save_metrics(taken, samples, retention=METRICS_RETENTION):
+    """ Saves a snapshot of (name, labels, value) metric samples taken at
+        the given time, deleting snapshots older than "retention" seconds.
+
+        @return count       the number of samples saved
+    """
+    with transaction() as session:
+        session.execute('DELETE FROM metrics WHERE taken < ?',
+                        (taken - retention,))
+        session.executemany(
+            'INSERT INTO metrics (taken, name, labels, value) '
+            'VALUES (?, ?, ?, ?)',
+            ((taken, name, labels, value) for name, labels, value in samples))
+    return len(samples)
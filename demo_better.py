@@ -4,105 +4,526 @@
 """
 
 # Standard library modules
+import argparse
+import asyncio
+import os
 import re
 import sys
+import time
 
 # Local modules
+import aggregator
 import db
+import engine
+import metrics
+import partitions
 import remediations
+import sharding
+import ssh_helper
+import syslog_archive
+import syslog_parser
+import syslog_receiver
+import timestamps
+import transcripts
+import workers
 
 
 SYSLOG_FILE = 'syslog.txt'
 
-# Regular expressions by section, overall this matches:
-#     2015 Apr  2 14:25:06 switch1 %ETHPORT-5-IF_DOWN_INTERFACE_REMOVED: 
-#     Interface Ethernet5/1 is down (Interface removed)
-DATESTAMP_RE = r'(\d+\s+\w+\s+\d+)'  
-TIMESTAMP_RE = r'(\d+:\d+:\d+)'     
-DEVICE_NAME_RE = r'(\S+)'          
-                                    
-                                   
-ERROR_CODE_RE = r'%(\S+):'           
-ERROR_MSG_RE = r'(.*)'               
-COLUMN_DELIMITER_RE = r'\s+'        
-
-
-SYSLOG_RE = (
-    DATESTAMP_RE + COLUMN_DELIMITER_RE +
-    TIMESTAMP_RE + COLUMN_DELIMITER_RE +
-    DEVICE_NAME_RE + COLUMN_DELIMITER_RE +
-    ERROR_CODE_RE + COLUMN_DELIMITER_RE +
-    ERROR_MSG_RE)
+# Follow mode:  seconds to wait for new lines, and how many consumed
+# lines to process between checkpoint writes
+FOLLOW_POLL_INTERVAL = 1.0
+CHECKPOINT_EVERY = 1000
+
+# Matches "2015 Apr  2 14:25:06 switch1 %ETHPORT-5-IF_DOWN_...: Interface
+# Ethernet5/1 is down (Interface removed)"; see syslog_parser.py
+SYSLOG_RE = syslog_parser.SYSLOG_RE
 
 # Event result codes for database tracking
 EVENT_RESULTS = {
-    'REMEDIATION_FAILED': 1,
-    'REMEDIATION_COMPLETED': 2}
+    'REMEDIATION_FAILED': db.RESULT_FAILED,
+    'REMEDIATION_COMPLETED': db.RESULT_COMPLETED,
+    'REMEDIATION_SUPPRESSED': db.RESULT_SUPPRESSED,
+    'BACKFILLED': db.RESULT_BACKFILLED}
+
 
+# Remediations are registered with the @remediations.remediation decorator
+ERROR_CODES_TO_REMEDIATIONS = remediations.REGISTRY
 
-ERROR_CODES_TO_REMEDIATIONS = {
-    'IF_DOWN_INTERFACE_REMOVED':  remediations.linecard_failure,
-    'IF_DOWN_LINK_FAILURE':  remediations.link_failure,
-}
+REMEDIATION_SECONDS = metrics.histogram(
+    'remediation_seconds', 'Time per remediation', ('device',))
+REMEDIATION_ERRORS = metrics.counter(
+    'remediation_errors_total', 'Remediations that raised', ('device',))
+RUNNING = metrics.gauge('remediations_running', 'Remediations in progress')
 
 
 def read_logs(log_file=SYSLOG_FILE):
-    """ Reads the syslog file """
+    """ Reads the syslog file one line at a time """
     with open(log_file, mode='r') as syslog:
-        log_lines = syslog.readlines()
-    return log_lines
-
-
-def parse_logs_to_events(log_lines, regex=SYSLOG_RE):
-    """ Parses log lines """
-    event_ids = []
+        for line in syslog:
+            yield line
+
+
+def _open_at_checkpoint(log_file):
+    """ Opens the log file, seeking to the saved checkpoint if it still
+        refers to the same file (same inode, not truncated).
+
+        @return syslog      the open file (binary), or None if missing
+        @return inode       the inode of the open file
+        @return offset      the byte offset reading starts from
+    """
+    try:
+        syslog = open(log_file, mode='rb')
+    except IOError:
+        return None, None, 0
+    stat = os.fstat(syslog.fileno())
+    offset = 0
+    checkpoint = db.get_checkpoint(log_file)
+    if checkpoint:
+        inode, saved_offset = checkpoint
+        if inode == stat.st_ino and saved_offset <= stat.st_size:
+            offset = saved_offset
+    syslog.seek(offset)
+    return syslog, stat.st_ino, offset
+
+
+def _rotated_or_truncated(log_file, inode, offset):
+    """ Checks whether the log file was replaced or truncated since it
+        was opened.
+    """
+    try:
+        stat = os.stat(log_file)
+    except OSError:
+        # Mid-rotation; keep the old file until the new one shows up
+        return False
+    return stat.st_ino != inode or stat.st_size < offset
+
+
+def follow_logs(log_file=SYSLOG_FILE, poll_interval=FOLLOW_POLL_INTERVAL,
+                checkpoint_every=CHECKPOINT_EVERY):
+    """ Tails the syslog file like "tail -F", yielding one line at a time.
+
+        The file is reopened when it is rotated (new inode) and re-read
+        from the start when it is truncated.  The byte offset of consumed
+        lines is checkpointed in the DB, so a restart resumes where the
+        previous run stopped instead of rescanning the file.  A line only
+        counts as consumed once the caller asks for the next one, so a
+        crash replays at most the lines since the last checkpoint.
+    """
+    log_file = os.path.abspath(log_file)
+    syslog, inode, offset = _open_at_checkpoint(log_file)
+    saved_offset = offset
+    consumed = 0
+    partial = b''
+    try:
+        while True:
+            if syslog is None:
+                time.sleep(poll_interval)
+                syslog, inode, offset = _open_at_checkpoint(log_file)
+                saved_offset = offset
+                continue
+
+            chunk = syslog.readline()
+            if chunk:
+                # Hold on to a partially written line until its newline
+                # arrives
+                partial += chunk
+                if not partial.endswith(b'\n'):
+                    continue
+                line, partial = partial, b''
+                yield line.decode('utf-8', 'replace')
+                offset += len(line)
+                consumed += 1
+                if consumed >= checkpoint_every:
+                    db.save_checkpoint(log_file, inode, offset)
+                    saved_offset = offset
+                    consumed = 0
+                continue
+
+            # Caught up with the writer:  save our place, then look for
+            # rotation or truncation before waiting for more lines
+            if offset != saved_offset:
+                db.save_checkpoint(log_file, inode, offset)
+                saved_offset = offset
+                consumed = 0
+            if _rotated_or_truncated(log_file, inode, offset + len(partial)):
+                if partial:
+                    line, partial = partial, b''
+                    yield line.decode('utf-8', 'replace')
+                syslog.close()
+                syslog = open(log_file, mode='rb')
+                inode = os.fstat(syslog.fileno()).st_ino
+                offset = 0
+                db.save_checkpoint(log_file, inode, offset)
+                saved_offset = offset
+                continue
+            time.sleep(poll_interval)
+    finally:
+        if syslog is not None:
+            if offset != saved_offset:
+                db.save_checkpoint(log_file, inode, offset)
+            syslog.close()
+
+
+def parse_logs(log_lines, regex=SYSLOG_RE):
+    """ Parses log lines, yielding a tuple of
+        (datestamp, timestamp, device_name, error_code, error_message)
+        for every line that matches.
+    """
+    if regex == SYSLOG_RE:
+        # Standard lines skip the regex entirely
+        for fields in syslog_parser.parse_lines(log_lines):
+            yield fields
+        return
     for line in log_lines:
         matched = re.match(regex, line)
         if not matched:
             continue
+        yield matched.groups()
 
-        datestamp, timestamp, device_name, error_code, error_message = (
-            matched.groups())
 
+def iter_events(log_lines, regex=SYSLOG_RE):
+    """ Parses log lines as they arrive, yielding one event id per
+        matching line.
+    """
+    for datestamp, timestamp, device_name, error_code, error_message in (
+            parse_logs(log_lines, regex=regex)):
         # Create an event in our DB
-        event_id = db.insert_event(
+        yield db.insert_event(
             datestamp, timestamp, device_name, error_code, error_message)
-        event_ids.append(event_id)
 
-    return event_ids
+
+def parse_logs_to_events(log_lines, regex=SYSLOG_RE):
+    """ Parses log lines """
+    # Create the events in our DB in batches
+    return db.insert_events(parse_logs(log_lines, regex=regex))
 
 
 def run_remediation(event_id):
     """ Runs remediation logic for known error codes """
 
-    datestamp, device_name, error_code, error_message, result = (
-        db.get_event_by_id(event_id))
+    event = db.get_event(event_id)
+    if event is None:
+        # Moved into a day partition since it was queued (see partitions.py)
+        print('[event_id {0}]  WARNING:  Event not found, it may have been '
+              'archived - skipping remediation.'.format(event_id))
+        return
+
+    # Fetch the functions assigned to this error code
+    remediations_found = ERROR_CODES_TO_REMEDIATIONS.lookup(event.error_code)
+    if not remediations_found:
+        return
+
+    RUNNING.inc()
+    started = time.time()
+    try:
+        with metrics.sampled_profile():
+            for remediation in remediations_found:
+
+                print('[{0}]  NOTICE:  Found a known error [{1}] - '
+                      'attempting remediation.'.format(
+                      event.device, event.error_code))
+
+                # Run that function, passing in the event_id.
+                remediation(event_id, event.device, event.error_message)
+    except Exception:
+        REMEDIATION_ERRORS.inc(event.device)
+        raise
+    finally:
+        RUNNING.dec()
+        REMEDIATION_SECONDS.observe(time.time() - started, event.device)
+
+
+def run_and_record_remediation(event_id):
+    """ Runs remediation logic for an event outside the work queue, and
+        records its result so that workers do not claim it later.
+    """
+    try:
+        run_remediation(event_id)
+    except Exception:
+        db.update_event_result(event_id, EVENT_RESULTS['REMEDIATION_FAILED'])
+        raise
+    db.update_event_result(event_id, EVENT_RESULTS['REMEDIATION_COMPLETED'])
 
-    for known_error_code in ERROR_CODES_TO_REMEDIATIONS:
 
-        if known_error_code in error_code:
+def _parse_log_file(log_file, processes=1):
+    """ Parses a whole log file into events, on several processes if asked
 
-            print('[{0}]  NOTICE:  Found a known error [{1}] - attempting '
-                  'remediation.'.format(device_name, error_code))
+        @return event_ids   the unique database ids of the parsed events
+    """
+    if processes == 1:
+        return parse_logs_to_events(read_logs(log_file))
+    # Workers hand back compact column batches, which go straight to the DB
+    event_ids = []
+    for batch in syslog_parser.parse_file_batches(
+            log_file, processes=processes or None):
+        event_ids.extend(db.insert_batch(batch))
+    return event_ids
 
-            # Fetch the function assigned to this error code
-            remediation = ERROR_CODES_TO_REMEDIATIONS[known_error_code]
 
-            # Run that function, passing in the event_id.
-            remediation(event_id, device_name, error_message)
+def _event_fields(event_ids):
+    """ Looks up what the aggregator groups each event by, skipping
+        events already archived
+    """
+    for event_id in event_ids:
+        event = db.get_event(event_id)
+        if event is None:
+            continue
+        yield (event_id, event.device, event.error_code, event.error_message,
+               event.epoch)
 
 
-def main():
-    """ Main program logic """
+def _aggregate(event_ids, window=aggregator.WINDOW):
+    """ Drops repeats of the same problem within "window" seconds,
+        recording how many were suppressed on the event kept.  A window
+        of 0 keeps every event.
+    """
+    if not window:
+        return event_ids
+    return aggregator.Aggregator(window).filter(_event_fields(event_ids))
 
-    log_lines = read_logs()
 
-    event_ids = parse_logs_to_events(log_lines)
+def _queue_log_file(log_file, processes=1, window=aggregator.WINDOW):
+    """ Parses a log file, if there is one, into the DB work queue """
+    if not os.path.exists(log_file):
+        return
+    event_ids = _parse_log_file(log_file, processes)
     print('Parsed {0} events from syslog'.format(len(event_ids)))
+    # Aggregating marks the repeats as suppressed, so no worker claims them
+    for event_id in _aggregate(event_ids, window):
+        pass
+
 
+def _with_devices(event_ids):
+    """ Pairs each event id with its device name, for the engine,
+        skipping events already archived
+    """
     for event_id in event_ids:
+        event = db.get_event(event_id)
+        if event is not None:
+            yield event_id, event.device
+
+
+async def _listen(host, port, concurrency, per_device,
+                  window=aggregator.WINDOW):
+    """ Receives syslog on UDP and TCP, remediating events as they
+        arrive, until interrupted.
+    """
+    remediation_engine = engine.RemediationEngine(
+        run_and_record_remediation, max_concurrency=max(concurrency, 1),
+        per_device_limit=per_device)
+
+    def on_events(event_ids, events):
+        for event_id, (datestamp, timestamp, device_name, error_code,
+                       error_message) in zip(event_ids, events):
+            if window and not storms.add(
+                    event_id, device_name, error_code, error_message,
+                    timestamps.to_epoch(datestamp, timestamp)):
+                continue
+            remediation_engine.submit(event_id, device_name)
+
+    receiver = syslog_receiver.SyslogReceiver(host, port, on_events=on_events)
+    # Counts are written on the receiver's DB thread, after the inserts
+    storms = aggregator.Aggregator(window, submit=receiver.submit).start()
+    await receiver.start()
+    print('Listening for syslog on {0}:{1} (UDP and TCP)'.format(host, port))
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        await receiver.stop()
+        # The receiver's DB thread has stopped, so this writes directly
+        storms.stop()
+        await remediation_engine.join()
+        remediation_engine.close()
+        print(receiver.stats())
+
+
+def main(argv=None):
+    """ Main program logic """
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--log-file', default=SYSLOG_FILE,
+                        help='syslog file to read (default: %(default)s)')
+    parser.add_argument('-f', '--follow', action='store_true',
+                        help='keep reading new lines as they are written, '
+                             'resuming from the last checkpoint')
+    parser.add_argument('--archive', nargs='+', metavar='PATH',
+                        help='backfill events from rotated or compressed '
+                             'syslog files, directories or globs, oldest '
+                             'first, without running remediations')
+    parser.add_argument('--listen', metavar='HOST:PORT',
+                        help='receive syslog over UDP and TCP instead of '
+                             'reading a file, e.g. 0.0.0.0:514')
+    parser.add_argument('-j', '--processes', type=int, default=1,
+                        help='worker processes for parsing the log file; '
+                             '0 uses every CPU (default: %(default)s)')
+    parser.add_argument('-c', '--concurrency', type=int, default=1,
+                        help='remediations to run at once across devices '
+                             '(default: %(default)s)')
+    parser.add_argument('--per-device', type=int,
+                        default=engine.PER_DEVICE_LIMIT,
+                        help='remediations to run at once per device '
+                             '(default: %(default)s)')
+    parser.add_argument('-w', '--window', type=int, default=aggregator.WINDOW,
+                        help='seconds during which repeats of the same '
+                             'error on the same device and interface are '
+                             'suppressed; 0 remediates every event '
+                             '(default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='queue the parsed events in the DB and drain '
+                             'every waiting event on this many worker '
+                             'processes; safe to rerun after a crash')
+    parser.add_argument('--node', metavar='NAME',
+                        help='like --workers 1, but join a cluster of nodes '
+                             'sharing the DB and remediate only the devices '
+                             'hashed to this node')
+    parser.add_argument('--maintain', action='store_true',
+                        help='move events older than {0} days into day '
+                             'partitions, drop partitions past the '
+                             'retention period and return free space to the '
+                             'OS, then exit'.format(partitions.HOT_DAYS))
+    parser.add_argument('--retention-days', type=int,
+                        help='with --maintain, days of partitions to keep '
+                             '(default: keep all)')
+    parser.add_argument('--metrics-file', metavar='PATH',
+                        help='write counters and latency histograms to a '
+                             'Prometheus text file, e.g. for '
+                             'node_exporter\'s textfile collector')
+    parser.add_argument('--metrics-db', action='store_true',
+                        help='also snapshot the metrics into the DB\'s '
+                             'metrics table')
+    parser.add_argument('--metrics-interval', type=float,
+                        default=metrics.EXPORT_INTERVAL,
+                        help='seconds between metrics exports '
+                             '(default: %(default)s)')
+    parser.add_argument('--profile-rate', type=float, default=0,
+                        help='share of remediations to run under cProfile, '
+                             'e.g. 0.01; the merged profile is written to '
+                             '{0}'.format(metrics.PROFILE_FILE))
+    parser.add_argument('--ssh-backend', choices=sorted(ssh_helper.BACKENDS),
+                        help='open sessions to real devices (paramiko), '
+                             'canned outputs (mock) or ssh_simulator.py '
+                             '(simulator), or record them to or replay them '
+                             'from --transcript (default: $SSH_BACKEND, '
+                             'else paramiko)')
+    parser.add_argument('--ssh-simulator', metavar='HOST:PORT',
+                        help='address of ssh_simulator.py for the simulator '
+                             'backend (default: {0})'.format(
+                                 ssh_helper.SIMULATOR_ADDRESS))
+    parser.add_argument('--transcript', metavar='PATH',
+                        help='transcript file for the record and replay '
+                             'backends (default: $SSH_TRANSCRIPT, else '
+                             'transcript.sqlite)')
+    parser.add_argument('--replay-speed', type=float,
+                        help='replay at this multiple of the recorded '
+                             'speed; 0 answers instantly (default: '
+                             '$SSH_REPLAY_SPEED, else 0)')
+    args = parser.parse_args(argv)
+    if (args.workers or args.node) and (args.follow or args.listen):
+        parser.error('--workers and --node cannot be combined with --follow '
+                     'or --listen')
+
+    if args.ssh_backend or args.ssh_simulator:
+        ssh_helper.use_backend(args.ssh_backend or ssh_helper.SSH_BACKEND,
+                               args.ssh_simulator)
+        # Inherited by worker processes started afresh
+        os.environ['SSH_BACKEND'] = ssh_helper.SSH_BACKEND
+        os.environ['SSH_SIMULATOR'] = ssh_helper.SIMULATOR_ADDRESS
+    if args.transcript is not None or args.replay_speed is not None:
+        transcripts.TRANSCRIPT_FILE = (args.transcript or
+                                       transcripts.TRANSCRIPT_FILE)
+        if args.replay_speed is not None:
+            transcripts.REPLAY_SPEED = args.replay_speed
+        os.environ['SSH_TRANSCRIPT'] = transcripts.TRANSCRIPT_FILE
+        os.environ['SSH_REPLAY_SPEED'] = str(transcripts.REPLAY_SPEED)
+
+    metrics.PROFILE_RATE = args.profile_rate
+    exporter = None
+    if args.metrics_file or args.metrics_db or args.profile_rate:
+        exporter = metrics.Exporter(args.metrics_interval,
+                                    path=args.metrics_file,
+                                    to_db=args.metrics_db).start()
+    try:
+        return _run(args)
+    finally:
+        if exporter:
+            exporter.stop()
+
+
+def _run(args):
+    """ Runs the mode selected on the command line """
+
+    if args.maintain:
+        summary = partitions.maintain(retention_days=args.retention_days)
+        print('Archived {0} events, dropped {1} partitions, {2} free pages '
+              'left'.format(summary['archived'], len(summary['dropped']),
+                            summary['free']))
+        return
+
+    if args.archive:
+        count = db.insert_events(
+            parse_logs(syslog_archive.read_archive(args.archive)),
+            return_ids=False, result=EVENT_RESULTS['BACKFILLED'])
+        print('Backfilled {0} events from the archive'.format(count))
+        return
+
+    if args.listen:
+        host, _, port = args.listen.rpartition(':')
+        try:
+            asyncio.run(_listen(host or '0.0.0.0', int(port),
+                                args.concurrency, args.per_device,
+                                args.window))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if args.node or args.workers:
+        metrics.QUEUE_DEPTH.track(db.count_pending, 'work')
+
+    if args.node:
+        _queue_log_file(args.log_file, args.processes, args.window)
+        completed, failed = sharding.run_node(args.node, run_remediation)
+        print('[{0}]  Completed {1} remediations, {2} failed'.format(
+            args.node, completed, failed))
+        return
+
+    if args.workers:
+        _queue_log_file(args.log_file, args.processes, args.window)
+        print('Remediating {0} waiting events on {1} workers'.format(
+            db.count_pending(), args.workers))
+        completed, failed = workers.run_workers(
+            run_remediation, processes=args.workers)
+        print('Completed {0} remediations, {1} failed'.format(
+            completed, failed))
+        return
+
+    if args.concurrency > 1:
+        if args.follow:
+            event_ids = iter_events(follow_logs(args.log_file))
+        else:
+            event_ids = _parse_log_file(args.log_file, args.processes)
+            print('Parsed {0} events from syslog'.format(len(event_ids)))
+        engine.run_remediations(
+            _with_devices(_aggregate(event_ids, args.window)),
+            run_and_record_remediation,
+            max_concurrency=args.concurrency,
+            per_device_limit=args.per_device)
+        return
+
+    if args.follow:
+        for event_id in _aggregate(iter_events(follow_logs(args.log_file)),
+                                   args.window):
+            print('Running remediation for event_id:  {0}'.format(event_id))
+            run_and_record_remediation(event_id)
+        return
+
+    event_ids = _parse_log_file(args.log_file, args.processes)
+    print('Parsed {0} events from syslog'.format(len(event_ids)))
+
+    for event_id in _aggregate(event_ids, args.window):
         print('Running remediation for event_id:  {0}'.format(event_id))
-        run_remediation(event_id)
+        run_and_record_remediation(event_id)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,174 @@
+#!/usr/bin/python
+""" Compiled dispatch of syslog error codes to remediations
+
+    Remediations are registered against an error code pattern:
+
+        @REGISTRY.register('IF_DOWN_LINK_FAILURE')
+        def link_failure(event_id, device_name, error_message):
+            ...
+
+    Exact patterns match a full "FACILITY-SEVERITY-MNEMONIC" error code or
+    just its mnemonic, and are looked up in a dict.  Substring and wildcard
+    patterns are compiled together into one Aho-Corasick automaton, so a
+    lookup scans the error code once no matter how many rules exist.
+"""
+
+# Standard library modules
+import collections
+import fnmatch
+import re
+
+
+EXACT = 'exact'
+SUBSTRING = 'substring'
+WILDCARD = 'wildcard'
+
+
+class AhoCorasick(object):
+    """ Multi-pattern substring matcher.  Finds every pattern occurring in
+        a text in a single pass over the text.
+    """
+
+    def __init__(self, patterns):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for index, pattern in enumerate(patterns):
+            self._add(pattern, index)
+        self._link()
+
+    def _add(self, pattern, index):
+        node = 0
+        for char in pattern:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = next_node
+        self._out[node].append(index)
+
+    def _link(self):
+        """ Builds the failure links breadth first. """
+        queue = collections.deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                if self._fail[child] == child:
+                    self._fail[child] = 0
+                self._out[child] = self._out[child] + self._out[
+                    self._fail[child]]
+
+    def search(self, text):
+        """ Finds the patterns that occur in the text.
+
+            @return indexes     the indexes of matching patterns
+        """
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if out[node]:
+                found.update(out[node])
+        return found
+
+
+class RemediationRegistry(object):
+    """ Maps error codes to the remediation functions registered for them.
+
+        Lookups are compiled on first use after a registration, and the
+        result for each distinct error code is memoized.
+    """
+
+    def __init__(self):
+        self._rules = []            # (pattern, kind, function)
+        self._exact = {}            # pattern -> [rule index, ...]
+        self._automaton = None
+        self._fragments = []        # automaton key -> [rule index, ...]
+        self._wildcards = {}        # rule index -> compiled regex
+        self._cache = {}
+
+    def register(self, pattern, match=EXACT):
+        """ Decorator registering a remediation for an error code pattern.
+
+            @param match        EXACT for a full error code or mnemonic,
+                                SUBSTRING for any code containing the
+                                pattern, or WILDCARD for a glob such as
+                                "ETHPORT-*-IF_DOWN_*"
+        """
+        if match not in (EXACT, SUBSTRING, WILDCARD):
+            raise ValueError('Unknown match type "{0}"'.format(match))
+
+        def decorator(function):
+            self._rules.append((pattern, match, function))
+            self._automaton = None
+            self._cache.clear()
+            return function
+        return decorator
+
+    def compile(self):
+        """ Builds the exact-match table and the substring automaton.
+
+            @return None
+        """
+        exact = {}
+        fragments = collections.OrderedDict()
+        wildcards = {}
+        for index, (pattern, match, _) in enumerate(self._rules):
+            if match == EXACT:
+                exact.setdefault(pattern, []).append(index)
+                continue
+            key = pattern
+            if match == WILDCARD:
+                # Find candidates by the longest literal run, then confirm
+                # them against the whole glob
+                wildcards[index] = re.compile(fnmatch.translate(pattern))
+                key = max(re.split(r'[*?\[\]]+', pattern), key=len)
+            fragments.setdefault(key, []).append(index)
+        self._exact = exact
+        self._fragments = list(fragments.values())
+        self._wildcards = wildcards
+        self._automaton = AhoCorasick(list(fragments))
+
+    def match(self, error_code):
+        """ Finds the remediations for an error code without the memo.
+
+            @return functions   matching remediations, in registration order
+        """
+        if self._automaton is None:
+            self.compile()
+        indexes = set(self._exact.get(error_code, ()))
+        mnemonic = error_code.split('-', 2)[-1]
+        indexes.update(self._exact.get(mnemonic, ()))
+        for key in self._automaton.search(error_code):
+            for index in self._fragments[key]:
+                wildcard = self._wildcards.get(index)
+                if wildcard is None or wildcard.match(error_code):
+                    indexes.add(index)
+        return [self._rules[index][2] for index in sorted(indexes)]
+
+    def lookup(self, error_code):
+        """ Finds the remediations for an error code.
+
+            @return functions   matching remediations, in registration order
+        """
+        functions = self._cache.get(error_code)
+        if functions is None:
+            functions = self._cache[error_code] = self.match(error_code)
+        return functions
+
+    def __iter__(self):
+        return iter(pattern for pattern, _, _ in self._rules)
+
+    def __len__(self):
+        return len(self._rules)
@@ -0,0 +1,158 @@
+#!/usr/bin/python
+""" Concurrent remediation engine
+
+    Runs remediations for different devices at the same time while
+    keeping each device's events in the order they were logged.  The
+    remediation functions themselves are ordinary blocking code; they are
+    run on a thread pool driven by an asyncio event loop.
+"""
+
+# Standard library modules
+import asyncio
+import concurrent.futures
+import traceback
+
+# Local modules
+import metrics
+
+
+# Remediations running at once across all devices
+MAX_CONCURRENCY = 32
+
+# Remediations running at once against any one device.  With the default
+# of 1, a device's events are remediated strictly one after another.
+PER_DEVICE_LIMIT = 1
+
+
+class RemediationEngine(object):
+    """ Schedules remediate(event_id) calls with a global concurrency limit
+        and a per-device limit.  Events for the same device start in the
+        order they were submitted.
+    """
+
+    def __init__(self, remediate, max_concurrency=MAX_CONCURRENCY,
+                 per_device_limit=PER_DEVICE_LIMIT):
+        self.remediate = remediate
+        self.max_concurrency = max_concurrency
+        self.per_device_limit = per_device_limit
+        self.completed = 0
+        self.failed = 0
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_concurrency)
+        self._slots = None
+        self._queues = {}       # device -> asyncio.Queue of event ids
+        self._workers = {}      # device -> task draining its queue
+        metrics.QUEUE_DEPTH.track(self.waiting, 'engine')
+
+    def waiting(self):
+        """ @return count       events queued but not yet started """
+        return sum(queue.qsize() for queue in list(self._queues.values()))
+
+    def submit(self, event_id, device):
+        """ Queues an event for remediation.  Must be called from the
+            engine's event loop.
+
+            @return None
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        queue = self._queues.get(device)
+        if queue is None:
+            queue = self._queues[device] = asyncio.Queue()
+            self._workers[device] = asyncio.ensure_future(
+                self._drain(device, queue))
+        queue.put_nowait(event_id)
+
+    async def _drain(self, device, queue):
+        """ Starts a device's queued events in order, at most
+            per_device_limit at a time, until its queue stays empty.
+        """
+        device_slots = asyncio.Semaphore(self.per_device_limit)
+        running = set()
+        while True:
+            while not queue.empty():
+                event_id = queue.get_nowait()
+                await device_slots.acquire()
+                task = asyncio.ensure_future(
+                    self._run(device, event_id, device_slots))
+                running.add(task)
+                task.add_done_callback(running.discard)
+            if running:
+                await asyncio.wait(set(running))
+                continue
+            # Nothing queued or running; there is no await between this
+            # check and the removal, so no event can slip in between
+            del self._queues[device]
+            del self._workers[device]
+            return
+
+    async def _run(self, device, event_id, device_slots):
+        """ Runs one remediation on the thread pool. """
+        loop = asyncio.get_running_loop()
+        try:
+            async with self._slots:
+                await loop.run_in_executor(
+                    self._executor, self.remediate, event_id)
+            self.completed += 1
+        except Exception:
+            self.failed += 1
+            print('[{0}]  ERROR:  Remediation for event_id {1} failed:\n'
+                  '{2}'.format(device, event_id, traceback.format_exc()))
+        finally:
+            device_slots.release()
+
+    async def join(self):
+        """ Waits until every submitted event has been remediated.
+
+            @return None
+        """
+        while self._workers:
+            await asyncio.gather(*list(self._workers.values()))
+
+    async def run(self, events):
+        """ Remediates (event_id, device) pairs from an iterable, which
+            may block between items (e.g. a followed log file).  Items are
+            pulled on a separate thread so the loop keeps running
+            remediations in the meantime.
+
+            @return None
+        """
+        loop = asyncio.get_running_loop()
+        events = iter(events)
+        done = object()
+        reader = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        try:
+            while True:
+                item = await loop.run_in_executor(reader, next, events, done)
+                if item is done:
+                    break
+                event_id, device = item
+                self.submit(event_id, device)
+            await self.join()
+        finally:
+            reader.shutdown(wait=False)
+
+    def close(self):
+        """ Shuts down the thread pool and stops exporting the queue
+            depth.
+
+            @return None
+        """
+        metrics.QUEUE_DEPTH.untrack(self.waiting, 'engine')
+        self._executor.shutdown(wait=True)
+
+
+def run_remediations(events, remediate, max_concurrency=MAX_CONCURRENCY,
+                     per_device_limit=PER_DEVICE_LIMIT):
+    """ Remediates an iterable of (event_id, device) pairs concurrently,
+        blocking until all of them are done.
+
+        @return engine      the finished engine, with completed/failed counts
+    """
+    engine = RemediationEngine(remediate, max_concurrency=max_concurrency,
+                               per_device_limit=per_device_limit)
+    try:
+        asyncio.run(engine.run(events))
+    finally:
+        engine.close()
+    return engine
@@ -0,0 +1,265 @@
+#!/usr/bin/python
+""" Compact in-memory event records.
+
+    Device names, error codes and dates repeat across millions of syslog
+    lines, so they are stored once and shared:
+
+        Event       one event, with __slots__ and interned strings
+        EventBatch  many events as columns:  arrays of integers, plus one
+                    table holding each distinct string once
+
+    An EventBatch costs a few dozen bytes per event and pickles as a
+    handful of flat buffers, which makes it the cheap way to hand parsed
+    events between processes and to the DB.
+"""
+
+# Standard library modules
+import array
+import itertools
+import sys
+
+# Local modules
+import timestamps
+
+
+# Stored in EventBatch.epochs for events whose time could not be parsed
+NO_EPOCH = -2 ** 63
+
+_intern = sys.intern
+
+
+def facility(error_code):
+    """ Gets the facility of an error code, "ETHPORT" from
+        "ETHPORT-5-IF_DOWN_LINK_FAILURE".
+
+        @return facility    an interned string
+    """
+    return _intern(error_code.split('-', 1)[0])
+
+
+class Event(object):
+    """ One syslog event.  Repeating strings are interned, so a million
+        events from one device share a single device name.
+    """
+
+    __slots__ = ('id', 'epoch', 'datestamp', 'timestamp', 'device',
+                 'facility', 'error_code', 'error_message', 'result')
+
+    def __init__(self, datestamp, timestamp, device, error_code,
+                 error_message, epoch=None, event_id=None, result=None):
+        self.id = event_id
+        self.datestamp = _intern(datestamp)
+        self.timestamp = _intern(timestamp)
+        self.device = _intern(device)
+        self.error_code = _intern(error_code)
+        self.facility = facility(error_code)
+        self.error_message = error_message
+        self.epoch = (timestamps.to_epoch(datestamp, timestamp)
+                      if epoch is None else epoch)
+        self.result = result
+
+    @classmethod
+    def from_fields(cls, fields, event_id=None):
+        """ Builds an event from parsed
+            (datestamp, timestamp, device, error_code, error_message)
+            fields.
+
+            @return event       an Event
+        """
+        return cls(*fields, event_id=event_id)
+
+    @classmethod
+    def from_row(cls, event_id, row):
+        """ Builds an event from a
+            (datestamp, device, error_code, error_message, result) DB row,
+            where the datestamp includes the time.
+
+            @return event       an Event
+        """
+        stamp, device, error_code, error_message, result = row
+        datestamp, _, timestamp = stamp.rpartition(' ')
+        return cls(datestamp.rstrip(), timestamp, device, error_code,
+                   error_message, event_id=event_id, result=result)
+
+    @property
+    def stamp(self):
+        """ @return stamp       "2016 Apr  2 14:25:06", as stored in the DB """
+        return '{0} {1}'.format(self.datestamp, self.timestamp)
+
+    def fields(self):
+        """ @return fields      (datestamp, timestamp, device, error_code,
+                                 error_message)
+        """
+        return (self.datestamp, self.timestamp, self.device,
+                self.error_code, self.error_message)
+
+    def __repr__(self):
+        return 'Event(id={0!r}, {1!r}, {2!r}, {3!r}, {4!r})'.format(
+            self.id, self.stamp, self.device, self.error_code,
+            self.error_message)
+
+
+class StringTable(object):
+    """ Numbers distinct strings in the order they are first added. """
+
+    def __init__(self, strings=()):
+        self.strings = []
+        self._index = {}
+        for string in strings:
+            self.add(string)
+
+    def add(self, string):
+        """ @return index       the number of the string """
+        index = self._index.get(string)
+        if index is None:
+            index = self._index[string] = len(self.strings)
+            self.strings.append(string)
+        return index
+
+    def __getitem__(self, index):
+        return self.strings[index]
+
+    def __len__(self):
+        return len(self.strings)
+
+    def __getstate__(self):
+        # The index is rebuilt on the other side rather than pickled
+        return self.strings
+
+    def __setstate__(self, strings):
+        self.strings = strings
+        self._index = dict(zip(strings, range(len(strings))))
+
+
+class EventBatch(object):
+    """ Events stored as columns.  Ids and epochs are 64-bit integer
+        arrays, and every string column is an array of indexes into one
+        shared StringTable.  Ids are 0 until the events are inserted.
+    """
+
+    def __init__(self):
+        self.ids = array.array('q')
+        self.epochs = array.array('q')
+        self.datestamps = array.array('I')
+        self.timestamps = array.array('I')
+        self.devices = array.array('I')
+        self.error_codes = array.array('I')
+        self.error_messages = array.array('I')
+        self.strings = StringTable()
+
+    def append(self, fields, event_id=0):
+        """ Adds one event from parsed
+            (datestamp, timestamp, device, error_code, error_message)
+            fields.
+
+            @return None
+        """
+        datestamp, timestamp, device, error_code, error_message = fields
+        add = self.strings.add
+        epoch = timestamps.to_epoch(datestamp, timestamp)
+        self.ids.append(event_id)
+        self.epochs.append(NO_EPOCH if epoch is None else epoch)
+        self.datestamps.append(add(datestamp))
+        self.timestamps.append(add(timestamp))
+        self.devices.append(add(device))
+        self.error_codes.append(add(error_code))
+        self.error_messages.append(add(error_message))
+
+    def extend(self, events):
+        """ Adds events from an iterable of parsed fields.
+
+            @return None
+        """
+        # append() spelled out with bound methods, since a method call per
+        # field costs more than the work itself
+        index = self.strings._index
+        strings = self.strings.strings
+        get = index.get
+
+        def add(string):
+            number = get(string)
+            if number is None:
+                number = index[string] = len(strings)
+                strings.append(string)
+            return number
+
+        add_id = self.ids.append
+        add_epoch = self.epochs.append
+        add_datestamp = self.datestamps.append
+        add_timestamp = self.timestamps.append
+        add_device = self.devices.append
+        add_error_code = self.error_codes.append
+        add_error_message = self.error_messages.append
+        to_epoch = timestamps.to_epoch
+        for datestamp, timestamp, device, error_code, error_message in events:
+            epoch = to_epoch(datestamp, timestamp)
+            add_id(0)
+            add_epoch(NO_EPOCH if epoch is None else epoch)
+            add_datestamp(add(datestamp))
+            add_timestamp(add(timestamp))
+            add_device(add(device))
+            add_error_code(add(error_code))
+            add_error_message(add(error_message))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        strings = self.strings.strings
+        epoch = self.epochs[index]
+        return Event(strings[self.datestamps[index]],
+                     strings[self.timestamps[index]],
+                     strings[self.devices[index]],
+                     strings[self.error_codes[index]],
+                     strings[self.error_messages[index]],
+                     epoch=None if epoch == NO_EPOCH else epoch,
+                     event_id=self.ids[index] or None)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def fields(self):
+        """ Yields each event as parsed
+            (datestamp, timestamp, device, error_code, error_message)
+            fields, sharing the table's strings.
+        """
+        strings = self.strings.strings
+        for datestamp, timestamp, device, error_code, error_message in zip(
+                self.datestamps, self.timestamps, self.devices,
+                self.error_codes, self.error_messages):
+            yield (strings[datestamp], strings[timestamp], strings[device],
+                   strings[error_code], strings[error_message])
+
+    def rows(self):
+        """ Yields each event as a
+            (datestamp, device, error_code, error_message, epoch) row for
+            the events table.  The stored datestamp is built once per
+            distinct second rather than once per event.
+        """
+        strings = self.strings.strings
+        last = None
+        stamp = None
+        for datestamp, timestamp, device, error_code, error_message, epoch \
+                in zip(self.datestamps, self.timestamps, self.devices,
+                       self.error_codes, self.error_messages, self.epochs):
+            if (datestamp, timestamp) != last:
+                last = (datestamp, timestamp)
+                stamp = '{0} {1}'.format(
+                    strings[datestamp], strings[timestamp])
+            yield (stamp, strings[device], strings[error_code],
+                   strings[error_message],
+                   None if epoch == NO_EPOCH else epoch)
+
+
+def batches(events, size):
+    """ Collects parsed fields into EventBatch objects of at most "size"
+        events.
+    """
+    events = iter(events)
+    while True:
+        batch = EventBatch()
+        batch.extend(itertools.islice(events, size))
+        if not len(batch):
+            return
+        yield batch
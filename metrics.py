@@ -0,0 +1,410 @@
+#!/usr/bin/python
+""" Counters, gauges and latency histograms for the hot paths.
+
+    Each module declares the metrics it updates at import:
+
+        ROUND_TRIPS = metrics.histogram(
+            'ssh_round_trip_seconds', 'Time per SSH round trip',
+            ('device',))
+
+        with ROUND_TRIPS.time(device):
+            ...
+
+    Updating a metric costs a dict lookup and a lock, so they are kept
+    to batches, round trips and remediations rather than single lines.
+    An Exporter thread periodically writes every metric to a Prometheus
+    text file (for node_exporter's textfile collector) and/or a snapshot
+    in the DB's metrics table.
+
+    sampled_profile() runs cProfile around a random share of the calls it
+    wraps (PROFILE_RATE, off by default), merging the profiles into one
+    pstats file.
+"""
+
+# Standard library modules
+import bisect
+import collections
+import contextlib
+import functools
+import os
+import random
+import threading
+import time
+
+
+# Upper bounds of the latency buckets, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+           0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Exporter defaults
+PROMETHEUS_FILE = 'remediation.prom'
+EXPORT_INTERVAL = 15.0
+
+# Share of sampled_profile() calls profiled, and where the merged
+# profile is written
+PROFILE_RATE = 0.0
+PROFILE_FILE = 'remediation.pstats'
+
+# Every metric, by name, in the order declared
+_metrics = collections.OrderedDict()
+
+_clock = time.perf_counter
+
+
+def _escape(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def _labels(names, values, extra=()):
+    """ @return labels      '{device="switch1",le="0.5"}', or '' """
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{{{0}}}'.format(','.join(
+        '{0}="{1}"'.format(name, _escape(value)) for name, value in pairs))
+
+
+class Counter(object):
+    """ A count that only goes up, per combination of label values. """
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        """ @return None """
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        """ @return value       the current value, 0 if never updated """
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        """ Yields (name, labels, value) for every series. """
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield self.name, _labels(self.labels, labels), value
+
+
+class Gauge(Counter):
+    """ A value that goes up and down, or is read from a callback when
+        exported (see track()).
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels=()):
+        super(Gauge, self).__init__(name, help, labels)
+        self._callbacks = {}
+
+    def dec(self, *labels, amount=1):
+        """ @return None """
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value, *labels):
+        """ @return None """
+        with self._lock:
+            self._values[labels] = value
+
+    def track(self, callback, *labels):
+        """ Reads the value from callback() whenever the gauge is exported,
+            e.g. the length of a queue.  A callback that raises is dropped.
+
+            @return None
+        """
+        self._callbacks[labels] = callback
+
+    def untrack(self, callback, *labels):
+        """ Stops reading the value from callback(), e.g. when the object
+            it belongs to is closed.  A callback tracked since under the
+            same labels is left alone.
+
+            @return None
+        """
+        with self._lock:
+            if self._callbacks.get(labels) == callback:
+                self._callbacks.pop(labels, None)
+                self._values.pop(labels, None)
+
+    def samples(self):
+        for labels, callback in list(self._callbacks.items()):
+            try:
+                self.set(callback(), *labels)
+            except Exception:
+                self._callbacks.pop(labels, None)
+        return super(Gauge, self).samples()
+
+
+class Histogram(object):
+    """ Counts observations into latency buckets, per combination of
+        label values.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}       # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        """ @return None """
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 3)
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextlib.contextmanager
+    def time(self, *labels):
+        """ Observes the time taken by the enclosed block, including one
+            that raises.
+        """
+        started = _clock()
+        try:
+            yield
+        finally:
+            self.observe(_clock() - started, *labels)
+
+    def count(self, *labels):
+        """ @return count       observations made """
+        series = self._series.get(labels)
+        return series[-1] if series else 0
+
+    def quantile(self, fraction, *labels):
+        """ Estimates a quantile as the upper bound of the bucket it falls
+            in.
+
+            @return seconds     the estimate, or None with no observations
+        """
+        series = self._series.get(labels)
+        if not series:
+            return None
+        rank = fraction * series[-1]
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), series):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def samples(self):
+        """ Yields (name, labels, value) for every bucket, sum and count,
+            with cumulative bucket counts as Prometheus expects.
+        """
+        with self._lock:
+            items = [(labels, list(series))
+                     for labels, series in self._series.items()]
+        bounds = ['{0:g}'.format(bound) for bound in self.buckets] + ['+Inf']
+        for labels, series in items:
+            total = 0
+            for bound, count in zip(bounds, series):
+                total += count
+                yield (self.name + '_bucket',
+                       _labels(self.labels, labels, [('le', bound)]), total)
+            yield self.name + '_sum', _labels(self.labels, labels), series[-2]
+            yield (self.name + '_count', _labels(self.labels, labels),
+                   series[-1])
+
+    def summaries(self):
+        """ Yields (name, labels, value) for the count, sum and estimated
+            p50 and p99 of every series; a compact form of samples().
+        """
+        for labels in list(self._series):
+            text = _labels(self.labels, labels)
+            series = self._series[labels]
+            yield self.name + '_count', text, series[-1]
+            yield self.name + '_sum', text, series[-2]
+            yield self.name + '_p50', text, self.quantile(0.50, *labels)
+            yield self.name + '_p99', text, self.quantile(0.99, *labels)
+
+
+def _register(cls, name, help, labels, **kwargs):
+    """ Gets a declared metric, declaring it on first use.
+
+        @return metric      the metric named "name"
+    """
+    metric = _metrics.get(name)
+    if metric is None:
+        metric = _metrics[name] = cls(name, help, labels, **kwargs)
+    elif type(metric) is not cls or metric.labels != tuple(labels):
+        error = 'Metric {0} is already declared as a {1} of {2}.'.format(
+            name, metric.kind, metric.labels)
+        raise Exception(error)
+    return metric
+
+
+def counter(name, help, labels=()):
+    """ @return counter     the Counter named "name" """
+    return _register(Counter, name, help, labels)
+
+
+def gauge(name, help, labels=()):
+    """ @return gauge       the Gauge named "name" """
+    return _register(Gauge, name, help, labels)
+
+
+def histogram(name, help, labels=(), buckets=BUCKETS):
+    """ @return histogram   the Histogram named "name" """
+    return _register(Histogram, name, help, labels, buckets=buckets)
+
+
+def timed(metric, *labels):
+    """ Decorates a function to observe its run time in a histogram. """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            started = _clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                metric.observe(_clock() - started, *labels)
+        return wrapper
+    return decorator
+
+
+def prometheus_text():
+    """ @return text        every metric in the Prometheus text format """
+    lines = []
+    for metric in list(_metrics.values()):
+        lines.append('# HELP {0} {1}'.format(metric.name, metric.help))
+        lines.append('# TYPE {0} {1}'.format(metric.name, metric.kind))
+        for name, labels, value in metric.samples():
+            lines.append('{0}{1} {2}'.format(name, labels, value))
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(path=PROMETHEUS_FILE):
+    """ Writes every metric to a Prometheus text file, replacing it in
+        one step so a scrape never sees half a file.
+
+        @return None
+    """
+    temporary = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(temporary, mode='w') as output:
+        output.write(prometheus_text())
+    os.replace(temporary, path)
+
+
+def snapshot():
+    """ Saves every counter and gauge, and the count, sum, p50 and p99 of
+        every histogram, to the DB's metrics table.
+
+        @return count       the number of values saved
+    """
+    # Imported here, since db itself declares metrics at import
+    import db
+    values = []
+    for metric in list(_metrics.values()):
+        values.extend(metric.summaries() if metric.kind == 'histogram'
+                      else metric.samples())
+    return db.save_metrics(time.time(), values)
+
+
+class Exporter(object):
+    """ A thread exporting the metrics every "interval" seconds, and once
+        more when stopped.
+    """
+
+    def __init__(self, interval=EXPORT_INTERVAL, path=None, to_db=False):
+        self.interval = interval
+        self.path = path
+        self.to_db = to_db
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='metrics')
+        self._thread.daemon = True
+
+    def export(self):
+        """ @return None """
+        if self.path:
+            write_prometheus(self.path)
+        if self.to_db:
+            snapshot()
+        write_profile()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.export()
+            except Exception as error:
+                print('[metrics]  ERROR:  Export failed:  {0}'.format(error))
+
+    def start(self):
+        """ @return self """
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """ Stops the thread and exports a last time.
+
+            @return None
+        """
+        self._stopped.set()
+        self._thread.join()
+        self.export()
+
+
+# Shared by every module with a queue, labelled by queue
+QUEUE_DEPTH = gauge('queue_depth', 'Items waiting in each queue', ('queue',))
+
+
+_profile_lock = threading.Lock()
+_profile_stats = None
+PROFILED = counter('profiled_calls_total',
+                   'Calls run under the sampling profiler')
+
+
+@contextlib.contextmanager
+def sampled_profile(rate=None):
+    """ Profiles the enclosed block for a "rate" share of calls (by
+        default PROFILE_RATE), merging the result into the profile that
+        write_profile() saves.  One block is profiled at a time; blocks
+        entered meanwhile run unprofiled.
+    """
+    global _profile_stats
+    rate = PROFILE_RATE if rate is None else rate
+    if not rate or random.random() >= rate or \
+            not _profile_lock.acquire(False):
+        yield
+        return
+    # Imported here, so they only load once a call is actually profiled
+    import cProfile
+    import pstats
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+        PROFILED.inc()
+        if _profile_stats is None:
+            _profile_stats = pstats.Stats(profile)
+        else:
+            _profile_stats.add(profile)
+    finally:
+        _profile_lock.release()
+
+
+def write_profile(path=None):
+    """ Saves the merged profile, if anything was profiled.
+
+        @return None
+    """
+    with _profile_lock:
+        if _profile_stats is not None:
+            _profile_stats.dump_stats(path or PROFILE_FILE)
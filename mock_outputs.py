@@ -1,4 +1,5 @@
 
+import collections
 import time
 
 
@@ -45,6 +46,9 @@ Ethernet1/4 is up
 SHOW_INTERFACE_TRANSCEIVER = ('''switch2# show int eth 1/45 transceiver details | egrep "(Rx|rx)"
   Rx Power       -8.84 dBm       1.99 dBm  -13.97 dBm   -1.00 dBm     -9.91 dBm''')
 
+# Seconds each round trip to the "device" takes
+LATENCY = 2
+
 
 class SSHSession(object):
     """ A mock object to act like an SSH connection, but instead returns
@@ -56,20 +60,35 @@ class SSHSession(object):
         self.username = username
         self.passwd = passwd
 
+    def _output(self, command):
+        if command.startswith('show module 5'):
+            return SHOW_MODULE_5
+        elif command.startswith('show module uptime'):
+            return SHOW_MODULE_5_UPTIME
+        elif command.startswith('show interface') and (
+                'transceiver' in command):
+            return SHOW_INTERFACE_TRANSCEIVER
+        elif command.startswith('show interface'):
+            return SHOW_INTERFACE
+        return ''
+
     def write(self, commands):
         output = ''
         for command in commands:
-            if command.startswith('show module 5'):
-                output += SHOW_MODULE_5
-            elif command.startswith('show module uptime'):
-                output += SHOW_MODULE_5_UPTIME
-            elif command.startswith('show interface') and (
-                    'transceiver' in command):
-                output += SHOW_INTERFACE_TRANSCEIVER
-            elif command.startswith('show interface'):
-                output += SHOW_INTERFACE
-        time.sleep(2)
+            output += self._output(command)
+        time.sleep(LATENCY)
         return output.rsplit('\n')
 
+    def write_pipelined(self, commands):
+        outputs = collections.OrderedDict()
+        for command in commands:
+            # Drop the echoed command line, like the real session does
+            outputs[command] = self._output(command).partition('\n')[2]
+        time.sleep(LATENCY)
+        return outputs
+
+    def is_alive(self):
+        return True
+
     def close(self):
         return
@@ -0,0 +1,285 @@
+#!/usr/bin/python
+""" Time-partitioned storage for old events.
+
+    New events land in the events table, which stays small:  it holds the
+    last few days, the work queue and the dedup index.  archive() moves
+    each older day into its own table (events_20160402), listed in the
+    partitions registry table, so that:
+
+        - expiry drops whole days (drop_before()) instead of deleting
+          millions of rows one by one
+        - the freed pages go back to the OS a few at a time
+          (incremental_vacuum()) rather than by rewriting the whole file
+        - a time range query (query_events()) reads only the day tables
+          the range covers
+
+    The recent_events view joins the events table with the latest
+    partitions, for ad hoc queries.  The lookups in db.py (get_event(),
+    query_events(), latest_events()) read only the events table; archived
+    events are read with query_events() here or through the view.  maintain() runs all three steps and
+    is meant to be run periodically:
+
+        partitions.maintain(retention_days=90)
+"""
+
+# Standard library modules
+import heapq
+import time
+
+# Local modules
+import db
+
+
+DAY = 86400
+
+# Days of events kept in the events table before they are archived,
+# counted back from the newest event
+HOT_DAYS = 7
+
+# Day partitions included in the recent_events view
+VIEW_DAYS = 30
+
+# Free pages returned to the OS per incremental_vacuum() call
+VACUUM_PAGES = 2000
+
+# Columns copied into partitions.  Lease columns are left behind, since
+# only the events table is a work queue.
+COLUMNS = ('id', 'datestamp', 'device', 'error_code', 'error_message',
+           'result', 'epoch', 'suppressed')
+
+PARTITION_SCHEMA = ('''
+    CREATE TABLE IF NOT EXISTS {0} (
+        id              INTEGER PRIMARY KEY NOT NULL,
+        datestamp       DATE,
+        device          TEXT,
+        error_code      TEXT,
+        error_message   TEXT,
+        result          INTEGER,
+        epoch           INTEGER,
+        suppressed      INTEGER DEFAULT 0);
+
+    CREATE UNIQUE INDEX IF NOT EXISTS {0}_dedup
+        ON {0} (device, error_code, datestamp, error_message);
+
+    CREATE INDEX IF NOT EXISTS {0}_device_epoch
+        ON {0} (device, epoch);
+''')
+
+
+def partition_name(epoch):
+    """ @return name        "events_20160402", the table of an epoch's day """
+    return time.strftime('events_%Y%m%d', time.gmtime(epoch))
+
+
+def _create_partition(session, day_start):
+    """ Creates a day's table and registers it, if it does not exist.
+
+        @return name        the table name
+    """
+    name = partition_name(day_start)
+    for statement in PARTITION_SCHEMA.format(name).split(';'):
+        if statement.strip():
+            session.execute(statement)
+    session.execute('''
+        INSERT OR IGNORE INTO partitions (name, day_start, day_end, events)
+        VALUES (?, ?, ?, 0)
+    ''', (name, day_start, day_start + DAY))
+    return name
+
+
+def list_partitions(start=None, end=None):
+    """ Gets the partitions overlapping an inclusive time range, oldest
+        first.
+
+        @param start, end   seconds since the epoch; None is unbounded
+        @return partitions  a list of (name, day_start, day_end, events)
+                            tuples
+    """
+    sql = ('''
+        SELECT name, day_start, day_end, events
+        FROM partitions
+        WHERE day_end > ? AND day_start <= ?
+        ORDER BY day_start
+    ''')
+    return db._open_session().execute(sql, (
+        start if start is not None else -2 ** 63,
+        end if end is not None else 2 ** 63 - 1)).fetchall()
+
+
+def rebuild_view(days=VIEW_DAYS):
+    """ Recreates the recent_events view over the events table and the
+        newest "days" partitions.
+
+        @return None
+    """
+    columns = ', '.join(COLUMNS)
+    with db.transaction() as session:
+        names = [name for name, in session.execute(
+            'SELECT name FROM partitions ORDER BY day_start DESC LIMIT ?',
+            (days,))]
+        selects = ['SELECT {0} FROM {1}'.format(columns, name)
+                   for name in ['events'] + names]
+        session.execute('DROP VIEW IF EXISTS recent_events')
+        session.execute('CREATE VIEW recent_events AS {0}'.format(
+            ' UNION ALL '.join(selects)))
+
+
+def archive(before=None, hot_days=HOT_DAYS):
+    """ Moves events logged before a day boundary out of the events table
+        and into their day partitions, one transaction per day.  Events
+        still leased to a worker stay put; any other event still waiting
+        for remediation is archived with the rest, since it is too old to
+        act on.
+
+        @param before       seconds since the epoch; by default midnight
+                            "hot_days" before the newest event
+        @return moved       the number of events moved
+    """
+    session = db._open_session()
+    if before is None:
+        newest = session.execute('SELECT MAX(epoch) FROM events').fetchone()[0]
+        if newest is None:
+            return 0
+        before = newest - hot_days * DAY
+    before -= before % DAY
+    days = [day for day, in session.execute('''
+        SELECT DISTINCT epoch / ? * ?
+        FROM events
+        WHERE epoch < ?
+    ''', (DAY, DAY, before))]
+    columns = ', '.join(COLUMNS)
+    now = int(time.time())
+    moved = 0
+    for day_start in sorted(days):
+        with db.transaction() as session:
+            name = _create_partition(session, day_start)
+            where = ('epoch >= ? AND epoch < ? '
+                     'AND (lease_expires IS NULL OR lease_expires <= ?)')
+            params = (day_start, day_start + DAY, now)
+            # Deleted rows leave the events table's dedup index, so events
+            # of an archived day that are logged again are checked against
+            # its partition by db.insert_events() instead
+            session.execute(
+                'INSERT OR IGNORE INTO {0} ({1}) SELECT {1} FROM events '
+                'WHERE {2}'.format(name, columns, where), params)
+            count = session.execute(
+                'DELETE FROM events WHERE {0}'.format(where), params).rowcount
+            session.execute('''
+                UPDATE partitions
+                SET events = (SELECT COUNT(*) FROM {0})
+                WHERE name = ?
+            '''.format(name), (name,))
+        moved += count
+    if days:
+        rebuild_view()
+    return moved
+
+
+def drop_before(before):
+    """ Drops every partition that ends on or before the given time.
+
+        @param before       seconds since the epoch
+        @return names       the names of the dropped partitions
+    """
+    with db.transaction() as session:
+        names = [name for name, in session.execute(
+            'SELECT name FROM partitions WHERE day_end <= ?', (before,))]
+        if names:
+            # The view refers to the tables, so it goes first
+            session.execute('DROP VIEW IF EXISTS recent_events')
+        for name in names:
+            session.execute('DROP TABLE IF EXISTS {0}'.format(name))
+            session.execute('DELETE FROM partitions WHERE name = ?', (name,))
+    if names:
+        rebuild_view()
+    return names
+
+
+def incremental_vacuum(pages=VACUUM_PAGES):
+    """ Returns up to "pages" free pages to the OS.  A file created before
+        partitioning was added is first switched to incremental
+        auto-vacuum, which takes one full VACUUM.
+
+        @return free        the number of free pages left in the file
+    """
+    session = db._open_session()
+    if session.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        print('[{0}]  NOTICE:  Switching to incremental auto-vacuum with a '
+              'one-time VACUUM'.format(db.DB_FILE))
+        session.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        session.execute('VACUUM')
+    # execute() stops after the first page; executescript() runs the
+    # statement to the end
+    session.executescript(
+        'PRAGMA incremental_vacuum({0});'.format(int(pages)))
+    return session.execute('PRAGMA freelist_count').fetchone()[0]
+
+
+def maintain(retention_days=None, hot_days=HOT_DAYS, pages=VACUUM_PAGES):
+    """ Archives old events, drops partitions older than the retention
+        period (counted back from the newest partition's end, so replayed
+        logs are not dropped as soon as they are archived) and returns up
+        to "pages" free pages to the OS.
+
+        @return summary     a dict of "archived" events, "dropped" partition
+                            names and "free" pages left
+    """
+    archived = archive(hot_days=hot_days)
+    dropped = []
+    if retention_days is not None:
+        newest = db._open_session().execute(
+            'SELECT MAX(day_end) FROM partitions').fetchone()[0]
+        if newest is not None:
+            dropped = drop_before(newest - retention_days * DAY)
+    free = incremental_vacuum(pages)
+    return {'archived': archived, 'dropped': dropped, 'free': free}
+
+
+def query_events(device=None, error_code=None, start=None, end=None,
+                 result=None, after_id=0, limit=1000):
+    """ Gets events matching every filter provided, oldest first, from the
+        events table and only the partitions the time range covers.  Event
+        ids are kept when archived, so pages use the same keyset cursor as
+        db.query_events().
+
+        @param start, end   inclusive time range, in seconds since the epoch
+        @param result       a result code, or a list of result codes
+        @return events      a list of
+                            (id, datestamp, device, error_code,
+                             error_message, result) tuples
+    """
+    clauses = ['id > ?']
+    params = [after_id]
+    if device is not None:
+        clauses.append('device = ?')
+        params.append(device)
+    if error_code is not None:
+        clauses.append('error_code = ?')
+        params.append(error_code)
+    if start is not None:
+        clauses.append('epoch >= ?')
+        params.append(start)
+    if end is not None:
+        clauses.append('epoch <= ?')
+        params.append(end)
+    if result is not None:
+        if not isinstance(result, (list, tuple, set)):
+            result = [result]
+        clauses.append('result IN ({0})'.format(
+            ', '.join('?' * len(result))))
+        params.extend(result)
+    params.append(limit)
+    session = db._open_session()
+    tables = ['events'] + [name for name, _, _, _ in
+                           list_partitions(start, end)]
+    pages = []
+    for table in tables:
+        sql = ('''
+            SELECT id, datestamp, device, error_code, error_message, result
+            FROM {0}
+            WHERE {1}
+            ORDER BY id
+            LIMIT ?
+        '''.format(table, ' AND '.join(clauses)))
+        pages.append(session.execute(sql, params).fetchall())
+    return list(heapq.merge(*pages))[:limit]
@@ -3,111 +3,107 @@
 """
 
 # Standard library modules
+import datetime
 import re
 
 # Local modules
+import command_cache
 import db
-import ssh_helper
+import dispatch
+import show_parsers
 
 
+# Error code patterns to remediation functions; see dispatch.py
+REGISTRY = dispatch.RemediationRegistry()
+remediation = REGISTRY.register
+
+# Matches "5/1" from:
+#     Interface Ethernet5/1 is down (Interface removed)
+MODULE_PORT_RE = re.compile(r'.+?(\d+)/(\d+)')
+
+# Interface resets above which the light levels are checked, and the Rx
+# power (dBm) below which the optics are reported
+RESET_THRESHOLD = 10
+RX_POWER_THRESHOLD = -7.00
+
+
+@remediation('IF_DOWN_INTERFACE_REMOVED')
 def linecard_failure(event_id, device_name, error_message):
     """ Linecard Failure Remediation """
 
-    # Matches "5/1" from:
-    #     Interface Ethernet5/1 is down (Interface removed)
-    interface = re.match(r'.+(\d+)/\d+', error_message)
+    interface = MODULE_PORT_RE.match(error_message)
     if not interface:
         return
 
     module_number = interface.group(1)
     command = ('show module {module_number}'.format(
                module_number=module_number))
+    uptime_command = ('show module uptime | '
+                      'egrep -A 3 "Module {module_number}"'.format(
+                      module_number=module_number))
 
-    # Open an SSH connection to the device
-    ssh = ssh_helper.SSHSession(
-        device=device_name,
-        username='',
-        passwd='')
+    # Fetch the output of "show module" and "show module uptime" in a
+    # single round trip, unless another event on this device just did
+    outputs = command_cache.CACHE.get(device_name, [command, uptime_command])
 
-    # Fetch output of "show module"
-    show_module = ssh.write([command])
-
-    status = show_module[3]
-    if 'ok' in status.lower():
-        command = ('show module uptime | '
-                   'egrep -A 3 "Module {module_number}"'.format(
-                   module_number=module_number))
-
-        # Fetch output of "show module uptime"
-        show_module_uptime = ssh.write([command])
+    module = show_parsers.find(show_parsers.show_module(outputs[command]),
+                               int(module_number))
+    status = module.status if module else 'not found'
 
+    if status.lower() == 'ok':
         # If we wanted to dive deeper, we could alter the flow based on
         # how long its been online.  (It could be in a reboot loop...)
-        uptime = show_module_uptime[3]
+        uptime = show_parsers.find(
+            show_parsers.show_module_uptime(outputs[uptime_command]),
+            int(module_number))
         print('[{0}]  NOTICE:  Module {1} is suspect but appears fine.\n'
-              '[{0}]  {2}\n'.format(device_name, module_number, uptime))
+              '[{0}]  Up Time:  {2}\n'.format(
+              device_name, module_number,
+              datetime.timedelta(seconds=uptime.uptime_seconds)
+              if uptime else 'unknown'))
     else:
-        print('[{0}]  WARNING:  Module {0} may be faulty!\n'
-              '[{0}]  {2}\n'.format(module_number, device_name, status))
-    ssh.close()
+        print('[{0}]  WARNING:  Module {1} may be faulty!\n'
+              '[{0}]  Status:  {2}\n'.format(
+              device_name, module_number, status))
 
 
+@remediation('IF_DOWN_LINK_FAILURE')
 def link_failure(event_id, device_name, error_message):
     """  Interface Link Down Remediation """
 
-    # Matches "1/4" from:
-    # Interface Ethernet1/4 is down (Link failure)
-    interface = re.match(r'.+(\d+/\d+)', error_message)
+    interface = MODULE_PORT_RE.match(error_message)
     if not interface:
         return
 
-    interface = interface.group(1)
+    interface = '{0}/{1}'.format(*interface.groups())
     command = 'show interface eth {interface}'.format(interface=interface)
-
-    # Open an SSH connection to the device
-    ssh = ssh_helper.SSHSession(
-        device=device_name,
-        username='',
-        passwd='')
-
-    # Fetch output of "show interface"
-    show_interface = ssh.write([command])
-
-    for line in show_interface:
-        interface_resets = re.match(r'^\s+(\d+) interface resets', line)
-        if not interface_resets:
-            continue
-
-        reset_count = int(interface_resets.group(1))
-
-        if reset_count <= 10:
+    transceiver_command = ('show interface eth {interface} transceiver '
+                           'details | egrep "(Rx|rx)"'.format(
+                           interface=interface))
+
+    # Fetch the output of "show interface" along with the Rx light levels
+    # in a single round trip, unless another event on this device just
+    # did; the light levels are only needed if the link is flapping, but
+    # asking for them up front is cheaper than a second round trip
+    outputs = command_cache.CACHE.get(
+        device_name, [command, transceiver_command])
+
+    for status in show_parsers.show_interface(outputs[command]):
+        reset_count = status.interface_resets
+        if reset_count is None or reset_count <= RESET_THRESHOLD:
             continue
 
         print('[{0}]  NOTICE:  Interface reset count [{1}] too '
               'high!  Checking for proper light levels.'.format(
               device_name, reset_count))
 
-        # Check Rx Light Levels
-        command = ('show interface eth {interface} transceiver '
-                   'details | egrep "(Rx|rx)"'.format(
-                   interface=interface))
-
-        # Fetch output of "show interface transceiver details"
-        show_int_transceiver = ssh.write([command])[1]
-
-        # Matches "-3.84" from:
-        #  Rx Power       -3.84 dBm
-        rx_power = re.match(
-            r'.+power\s+(-\d+.\d+) dbm',
-            show_int_transceiver.lower())
-        if not rx_power:
-            continue
-
-        # Check to see if it's less than our threshold
-        rx_power = float(rx_power.group(1))
-        if rx_power < -7.00:
-            print('[{0}]  WARNING:  Rx Power for {interface} is '
-                  'too low [{power} dBm]!  The fiber and '
-                  'patch-panel ports should be checked.'.format(
-                  device_name, interface=interface, power=rx_power))
-    ssh.close()
+        # Check Rx Light Levels against our threshold
+        for optic in show_parsers.show_transceiver(
+                outputs[transceiver_command]):
+            rx_power = optic.rx_dbm
+            if rx_power is not None and rx_power < RX_POWER_THRESHOLD:
+                print('[{0}]  WARNING:  Rx Power for {interface} is '
+                      'too low [{power} dBm]!  The fiber and '
+                      'patch-panel ports should be checked.'.format(
+                      device_name, interface=interface, power=rx_power))
+                break
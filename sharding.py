@@ -0,0 +1,157 @@
+#!/usr/bin/python
+""" Device-hash sharding across remediation nodes.
+
+    Every node ingests everything, but remediates only the devices that
+    a consistent-hash ring of the live nodes assigns to it.  Membership
+    is a table of heartbeats in the shared DB:  a node that joins, leaves
+    or stops sending heartbeats changes the ring, and each device moves
+    to a new owner only if its old owner was the node that left (or its
+    new owner is the node that joined).  Events leased by a node that
+    died are claimed again by the new owner when their leases expire.
+
+        sharding.run_node('node1', demo_better.run_remediation)
+"""
+
+# Standard library modules
+import bisect
+import hashlib
+import threading
+import time
+
+# Local modules
+import db
+import workers
+
+
+# Points each node gets on the ring; more points even out the shard sizes
+VNODES = 64
+
+# Seconds between heartbeats, and without one before a node is dropped
+HEARTBEAT_INTERVAL = 2.0
+NODE_TIMEOUT = 10
+
+
+def _hash(key):
+    """ Maps a string to a point on the ring. """
+    return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+
+
+class HashRing(object):
+    """ A consistent-hash ring mapping device names to nodes. """
+
+    def __init__(self, nodes=(), vnodes=VNODES):
+        self.nodes = sorted(nodes)
+        points = sorted(
+            (_hash('{0}#{1}'.format(node, number)), node)
+            for node in self.nodes for number in range(vnodes))
+        self._points = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def owner(self, device):
+        """ Gets the node a device belongs to.
+
+            @return node        a node name, or None if the ring is empty
+        """
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, _hash(device))
+        return self._owners[index % len(self._owners)]
+
+
+class Shard(object):
+    """ One node's view of the ring, kept current from the membership
+        table by refresh().  Heartbeats are sent from a thread started by
+        join(), so a node stays live however long its remediations take.
+    """
+
+    def __init__(self, name, vnodes=VNODES,
+                 heartbeat_interval=HEARTBEAT_INTERVAL,
+                 node_timeout=NODE_TIMEOUT):
+        self.name = name
+        self.vnodes = vnodes
+        self.heartbeat_interval = heartbeat_interval
+        self.node_timeout = node_timeout
+        self.ring = HashRing()
+        self._owned = {}        # device -> True if this node owns it
+        self._checked = 0
+        self._stopped = threading.Event()
+        self._heartbeats = None
+
+    def _send_heartbeats(self):
+        """ Sends a heartbeat every heartbeat interval until leave(). """
+        while not self._stopped.wait(self.heartbeat_interval):
+            try:
+                db.heartbeat(self.name)
+            except Exception as error:
+                print('[{0}]  ERROR:  Heartbeat failed:  {1}'.format(
+                    self.name, error))
+
+    def join(self):
+        """ Sends a first heartbeat, starts the heartbeat thread and
+            builds the ring.
+
+            @return None
+        """
+        db.heartbeat(self.name)
+        self._stopped.clear()
+        self._heartbeats = threading.Thread(target=self._send_heartbeats,
+                                            name='shard-heartbeat')
+        self._heartbeats.daemon = True
+        self._heartbeats.start()
+        self.refresh(force=True)
+
+    def refresh(self, force=False):
+        """ Rebuilds the ring if the live nodes have changed.  Does
+            nothing until the heartbeat interval has passed, unless forced.
+
+            @return changed     True if the ring was rebuilt
+        """
+        now = time.time()
+        if not force and now - self._checked < self.heartbeat_interval:
+            return False
+        self._checked = now
+        nodes = db.live_nodes(now - self.node_timeout)
+        if nodes == self.ring.nodes:
+            return False
+        self.ring = HashRing(nodes, self.vnodes)
+        self._owned = {}
+        print('[{0}]  NOTICE:  Rebalanced across {1} nodes:  {2}'.format(
+            self.name, len(nodes), ', '.join(nodes)))
+        return True
+
+    def owns(self, device):
+        """ @return owned       True if this node remediates the device """
+        owned = self._owned.get(device)
+        if owned is None:
+            owned = self._owned[device] = (
+                self.ring.owner(device) == self.name)
+        return owned
+
+    def leave(self):
+        """ Stops the heartbeats and removes this node from the
+            membership table, handing its devices to the other nodes.
+
+            @return None
+        """
+        self._stopped.set()
+        if self._heartbeats is not None:
+            self._heartbeats.join()
+            self._heartbeats = None
+        db.remove_node(self.name)
+
+
+def run_node(name, remediate, heartbeat_interval=HEARTBEAT_INTERVAL,
+             node_timeout=NODE_TIMEOUT, **kwargs):
+    """ Joins the cluster and remediates this node's shard of the queue
+        until no event is waiting anywhere, then leaves.  Other keyword
+        arguments are passed to workers.work().
+
+        @return counts      a tuple of (completed, failed) remediations
+    """
+    shard = Shard(name, heartbeat_interval=heartbeat_interval,
+                  node_timeout=node_timeout)
+    shard.join()
+    try:
+        return workers.work(remediate, shard=shard, **kwargs)
+    finally:
+        shard.leave()
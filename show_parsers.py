@@ -0,0 +1,229 @@
+#!/usr/bin/python
+""" Parsers for NX-OS show-command output.
+
+    Each parser reads an output in one pass with patterns compiled at
+    import, and returns a tuple of records:
+
+        show_module()       "show module"
+        show_module_uptime() "show module uptime"
+        show_interface()    "show interface"
+        show_transceiver()  "show interface transceiver details"
+
+    Tables are split into columns at the "---  -----" line under their
+    headers, so banners, extra tables and added columns do not shift the
+    fields.  Outputs narrowed with "| egrep" parse the same way, with the
+    fields they leave out set to None.
+
+    Results are memoized by output, so parsing the same output again
+    (another event on the same device, served by command_cache) costs a
+    dictionary lookup.  Records are immutable and safe to share.
+"""
+
+# Standard library modules
+import collections
+import functools
+import re
+
+
+# Distinct outputs remembered per parser
+MEMO_SIZE = 1024
+
+Module = collections.namedtuple(
+    'Module', 'number ports module_type model status diag_status')
+ModuleUptime = collections.namedtuple(
+    'ModuleUptime', 'number start_time uptime_seconds')
+Interface = collections.namedtuple(
+    'Interface', 'name state last_flapped input_errors input_discards '
+                 'output_errors interface_resets')
+Transceiver = collections.namedtuple(
+    'Transceiver', 'interface lane tx_dbm rx_dbm rx_low_alarm '
+                   'rx_low_warning')
+
+# "---  -----  ------" under a table header
+SEPARATOR_RE = re.compile(r'^\s*-+(\s+-+)+\s*$')
+COLUMN_RE = re.compile(r'-+')
+
+UPTIME_RE = re.compile(r'''
+    ^-+\ Module\ (?P<number>\d+)\ -+
+  | ^Module\ Start\ Time:\s+(?P<start_time>.+?)\s*$
+  | ^Up\ Time:\s+(?P<uptime>.+?)\s*$
+''', re.M | re.X)
+DURATION_RE = re.compile(r'(\d+)\s+(day|hour|minute|second)s?')
+DURATION_SECONDS = {'day': 86400, 'hour': 3600, 'minute': 60, 'second': 1}
+
+INTERFACE_RE = re.compile(r'''
+    ^(?P<name>\S+)\ is\ (?P<state>up|down|administratively\ down)
+  | Last\ link\ flapped\ (?P<last_flapped>\S+)
+  | (?P<count>\d+)\ (?P<counter>input\ error|input\ discard|output\ error
+                               |interface\ resets)
+''', re.M | re.X)
+INTERFACE_COUNTERS = {
+    'input error': 'input_errors',
+    'input discard': 'input_discards',
+    'output error': 'output_errors',
+    'interface resets': 'interface_resets',
+}
+
+# Rows of the diagnostics table are "Tx Power  -2.34 dBm  1.69 dBm
+# -11.30 dBm  -1.30 dBm  -7.30 dBm":  the current value, then the high
+# and low alarm and the high and low warning thresholds
+TRANSCEIVER_RE = re.compile(r'''
+    ^(?P<interface>(?:Ethernet|Eth)\d\S*)\s*$
+  | Lane\ Number:\s*(?P<lane>\d+)
+  | ^\s*(?P<direction>[RT]x)\ Power\s+(?P<levels>.*?)\s*$
+''', re.M | re.X | re.I)
+DBM_RE = re.compile(r'(-?\d+(?:\.\d+)?)\s*dBm|N/A', re.I)
+
+
+def _number(text):
+    return int(text) if text is not None else None
+
+
+def tables(output):
+    """ Yields the tables in an output as (columns, rows), where columns
+        are the header names and each row is a tuple of stripped cells.
+        A table's columns are where the runs of dashes under its header
+        start; it ends at the first blank line.
+    """
+    previous = ''
+    spans = None
+    columns = rows = None
+    for line in output.splitlines():
+        if spans is not None:
+            if line.strip():
+                rows.append(tuple(line[start:end].strip()
+                                  for start, end in spans))
+                continue
+            yield columns, rows
+            spans = None
+        elif SEPARATOR_RE.match(line):
+            starts = [match.start() for match in COLUMN_RE.finditer(line)]
+            spans = list(zip(starts, starts[1:] + [None]))
+            columns = tuple(previous[start:end].strip()
+                            for start, end in spans)
+            rows = []
+        previous = line
+    if spans is not None:
+        yield columns, rows
+
+
+@functools.lru_cache(maxsize=MEMO_SIZE)
+def show_module(output):
+    """ Parses "show module" or "show module N".
+
+        @return modules     a tuple of Module records, in table order
+    """
+    modules = collections.OrderedDict()
+    diags = {}
+    for columns, rows in tables(output):
+        if columns[:1] != ('Mod',):
+            continue
+        if 'Status' in columns and 'Model' in columns:
+            index = {name: number for number, name in enumerate(columns)}
+            for row in rows:
+                modules[row[0]] = (
+                    int(row[0]), _number(row[index['Ports']] or None),
+                    row[index['Module-Type']], row[index['Model']],
+                    row[index['Status']])
+        elif 'Online Diag Status' in columns:
+            for row in rows:
+                diags[row[0]] = row[1]
+    return tuple(Module(*fields, diag_status=diags.get(number))
+                 for number, fields in modules.items())
+
+
+def duration_seconds(text):
+    """ @return seconds     "45 days, 19 hours, 35 minutes, 45 seconds" in
+                            seconds
+    """
+    return sum(int(count) * DURATION_SECONDS[unit]
+               for count, unit in DURATION_RE.findall(text.lower()))
+
+
+@functools.lru_cache(maxsize=MEMO_SIZE)
+def show_module_uptime(output):
+    """ Parses "show module uptime", whole or narrowed to one module.
+
+        @return uptimes     a tuple of ModuleUptime records
+    """
+    uptimes = []
+    number = start_time = None
+    for match in UPTIME_RE.finditer(output):
+        if match.group('number'):
+            number = int(match.group('number'))
+            start_time = None
+        elif match.group('start_time'):
+            start_time = match.group('start_time')
+        else:
+            uptimes.append(ModuleUptime(
+                number, start_time, duration_seconds(match.group('uptime'))))
+    return tuple(uptimes)
+
+
+@functools.lru_cache(maxsize=MEMO_SIZE)
+def show_interface(output):
+    """ Parses "show interface", whole or narrowed with egrep.  Counters
+        the output leaves out are None.
+
+        @return interfaces  a tuple of Interface records
+    """
+    interfaces = []
+    fields = None
+    for match in INTERFACE_RE.finditer(output):
+        # Each alternative ends with a different group
+        name = match.lastgroup
+        if name == 'state' or fields is None:
+            fields = dict.fromkeys(Interface._fields)
+            interfaces.append(fields)
+        if name == 'state':
+            fields['name'] = match.group('name')
+            fields['state'] = match.group('state')
+        elif name == 'counter':
+            fields[INTERFACE_COUNTERS[match.group('counter')]] = int(
+                match.group('count'))
+        else:
+            fields[name] = match.group(name)
+    return tuple(Interface(**fields) for fields in interfaces)
+
+
+def _levels(text):
+    """ @return levels      the dBm values of a power row, None for N/A """
+    return [float(value) if value else None
+            for value in DBM_RE.findall(text)]
+
+
+@functools.lru_cache(maxsize=MEMO_SIZE)
+def show_transceiver(output):
+    """ Parses "show interface transceiver details", whole or narrowed
+        with egrep, into one record per Rx Power row (one per lane on
+        multi-lane optics).
+
+        @return transceivers    a tuple of Transceiver records
+    """
+    transceivers = []
+    interface = lane = tx_dbm = None
+    for match in TRANSCEIVER_RE.finditer(output):
+        if match.group('interface'):
+            interface = match.group('interface')
+            lane = tx_dbm = None
+        elif match.group('lane'):
+            lane = int(match.group('lane'))
+            tx_dbm = None
+        else:
+            levels = _levels(match.group('levels')) + [None] * 5
+            if match.group('direction').lower() == 'tx':
+                tx_dbm = levels[0]
+                continue
+            transceivers.append(Transceiver(
+                interface, lane, tx_dbm, levels[0], levels[2], levels[4]))
+    return tuple(transceivers)
+
+
+def find(records, key, attribute='number'):
+    """ @return record      the first record whose attribute equals "key",
+                            or None
+    """
+    for record in records:
+        if getattr(record, attribute) == key:
+            return record
+    return None
@@ -3,6 +3,19 @@
     This module supports SSH-based communication natively from
     Python using the Paramiko module.  Interactive prompts and IPv6
     are both supported here.
+
+    SSHSession is the class the rest of the code opens sessions with,
+    resolved when first used.  It is the paramiko session unless another
+    backend is configured, with the SSH_BACKEND environment variable or
+    use_backend():
+
+        paramiko    real devices (default)
+        mock        canned outputs from mock_outputs, no network
+        simulator   real paramiko sessions to ssh_simulator, logging in
+                    as the device at SSH_SIMULATOR (default 127.0.0.1:2222)
+        record      sessions of SSH_RECORD_BACKEND (default paramiko),
+                    saved to the transcript at SSH_TRANSCRIPT
+        replay      outputs served from that transcript; see transcripts
 """
 
 from __future__ import absolute_import
@@ -10,28 +23,61 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import codecs
+import collections
+import importlib
+import os
 import re
+import select
 import socket
 import time
 
-# Third-party
-import paramiko
+
+# Matches a device prompt such as "switch1# " or "switch1(config)# " at
+# the very end of the output received so far
+PROMPT_RE = r'\S+# ?$'
+
+# Only this many trailing characters are searched for the prompt
+PROMPT_WINDOW = 256
+
+# Bytes requested per read from the channel
+RECV_SIZE = 65536
+
+# Backend to the module and class providing SSHSession
+BACKENDS = {
+    'paramiko': ('ssh_helper', 'ParamikoSSHSession'),
+    'mock': ('mock_outputs', 'SSHSession'),
+    'simulator': ('ssh_simulator', 'SimulatedSession'),
+    'record': ('transcripts', 'RecordingSession'),
+    'replay': ('transcripts', 'ReplaySession'),
+}
+SSH_BACKEND = os.environ.get('SSH_BACKEND', 'paramiko')
+
+# "host:port" of the ssh_simulator the simulator backend connects to
+SIMULATOR_ADDRESS = os.environ.get('SSH_SIMULATOR', '127.0.0.1:2222')
 
 
-class SSHSession(object):
+class ParamikoSSHSession(object):
     """ Opens an SSH session to the device and returns a connection object. """
 
-    def __init__(self, device, username, passwd, debug=False):
+    def __init__(self, device, username, passwd, debug=False, timeout=30,
+                 host=None, port=22):
         self.device = device
+        self.host = host or device
+        self.port = port
         self.username = username
         self.passwd = passwd
         self.debug = debug
+        self.timeout = timeout
         self._connect()
 
     def _connect(self):
         """ Performs the initial SSH connection setup.  This is an internal
             method called when an instance of this class is created.
         """
+        # Imported here, so paramiko and its crypto stack load with the
+        # first session rather than with every module importing this one
+        import paramiko
         self.ssh_conn = paramiko.SSHClient()
         if self.debug:
             self.ssh_conn.log = paramiko.common.logging.basicConfig(
@@ -39,45 +85,161 @@ class SSHSession(object):
         # "known_hosts" is ignored, so there's no potential for mismatched keys
         self.ssh_conn.set_missing_host_key_policy(paramiko.AutoAddPolicy())
         # The default for allow_agent (False) breaks SSH to some devices
-        self.ssh_conn.connect(self.device, username=self.username,
-                              password=self.passwd, allow_agent=False)
+        self.ssh_conn.connect(self.host, port=self.port,
+                              username=self.username, password=self.passwd,
+                              allow_agent=False)
         self.ssh_shell = self.ssh_conn.invoke_shell()
         self.ssh_shell.set_combine_stderr(True)
         self.ssh_shell.setblocking(True)
+        # Consume the banner and first prompt so that output read by
+        # write() starts with the echo of its own command.  The prompt
+        # itself is kept to split pipelined output on.
+        banner = self._read_until(
+            PROMPT_RE, time.time() + self.timeout, 'login')
+        self.prompt = banner.rsplit('\n', 1)[-1].lstrip('\r')
 
-    def write(self, commands, delay=2, read_until='#', timeout=30,
+    def _read_until(self, read_until, deadline, command):
+        """ Reads from the shell until the "read_until" regex matches the
+            end of the output, waking as soon as data arrives rather than
+            polling.  Only the last PROMPT_WINDOW characters are searched
+            after each read.
+
+            @return output      everything read, as a string
+        """
+        prompt = re.compile(read_until)
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        # poll() rather than select(), which fails on descriptors past
+        # 1024 once a few hundred sessions are open
+        poller = select.poll()
+        poller.register(self.ssh_shell, select.POLLIN)
+        chunks = []
+        tail = ''
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                error = ('Timeout exceeded while attempting to read '
+                         'response after issuing "{0}" to {1}.'.format(
+                         command, self.device))
+                raise Exception(error)
+            if not self.ssh_shell.recv_ready():
+                poller.poll(remaining * 1000)
+                if not self.ssh_shell.recv_ready():
+                    if self.ssh_shell.closed or self.ssh_shell.eof_received:
+                        error = ('Connection to {0} closed while waiting for '
+                                 'the response to "{1}".'.format(
+                                 self.device, command))
+                        raise Exception(error)
+                    continue
+            try:
+                resp = self.ssh_shell.recv(RECV_SIZE)
+            except socket.timeout:
+                continue
+            text = decoder.decode(resp)
+            chunks.append(text)
+            tail = (tail + text)[-PROMPT_WINDOW:]
+            if prompt.search(tail):
+                return ''.join(chunks)
+
+    def write(self, commands, delay=0, read_until=PROMPT_RE, timeout=30,
               wait_for_output=True):
-        """ Writes the commands provided and attempts to read the output
-            until the "read_until" value is found, or until the timeout
-            (seconds) is reached.  The delay parameter is a sleep time
+        """ Writes the commands provided and reads each one's output until
+            the "read_until" regex matches the end of it (by default, the
+            device prompt).  The timeout (seconds) is a deadline for the
+            whole call.  The delay parameter is an optional sleep time
             between commands.
         """
+        deadline = time.time() + timeout
         self.ssh_shell.settimeout(timeout)
 
+        output = []
         for command in commands:
             self.ssh_shell.send('{0}\n'.format(command))
-            time.sleep(delay)
-
-        self.output_buffer = ''
-        if wait_for_output:
-            while not re.search(read_until, self.output_buffer):
-                if self.ssh_shell.recv_ready():
-                    try:
-                        resp = self.ssh_shell.recv(8096)
-                    except socket.timeout:
-                        error = ('Timeout exceeded while attempting to read '
-                                 'response after issuing "{0}" to {1}.'.format(
-                                 command, self.device))
-                        raise Exception(error)
-                    self.output_buffer += resp
-                else:
-                    time.sleep(1)
+            if wait_for_output:
+                output.append(self._read_until(read_until, deadline, command))
+            if delay:
+                time.sleep(delay)
+
+        self.output_buffer = ''.join(output)
         return self.output_buffer
 
+    def write_pipelined(self, commands, read_until=PROMPT_RE, timeout=30):
+        """ Sends all of the commands back to back, then reads until every
+            one of them has returned to the prompt.  The combined output is
+            split at the echoed prompts, so the whole batch costs a single
+            round trip.  The timeout (seconds) is a deadline for the batch.
+
+            @return outputs     an OrderedDict of command to its output,
+                                without the echoed command line
+        """
+        deadline = time.time() + timeout
+        self.ssh_shell.settimeout(timeout)
+        self.ssh_shell.send(''.join(
+            '{0}\n'.format(command) for command in commands))
+
+        # Each command ends at a prompt; keep reading until the output
+        # holds one per command
+        output = []
+        while True:
+            output.append(
+                self._read_until(read_until, deadline, commands[-1]))
+            combined = ''.join(output)
+            segments = combined.split(self.prompt)
+            if len(segments) > len(commands):
+                break
+
+        self.output_buffer = combined
+        outputs = collections.OrderedDict()
+        for command, segment in zip(commands, segments):
+            # Drop the echo of the command itself
+            echo, _, text = segment.partition('\n')
+            outputs[command] = text if command in echo else segment
+        return outputs
+
+    def is_alive(self):
+        """ Checks that the transport and shell are still usable, without
+            a round trip to the device.
+        """
+        transport = self.ssh_conn.get_transport()
+        return bool(transport and transport.is_active() and
+                    not self.ssh_shell.closed)
+
     def close(self):
         self.ssh_conn.close()
 
 
-import socket
-if socket.gethostname() in ['DEVBOX01']:
-    from mock_outputs import SSHSession
+def backend_class(backend):
+    """ Imports one of the BACKENDS.
+
+        @return session_class   the backend's session class
+    """
+    if backend not in BACKENDS:
+        error = 'Unknown SSH backend "{0}", expected one of {1}.'.format(
+            backend, ', '.join(sorted(BACKENDS)))
+        raise Exception(error)
+    module, name = BACKENDS[backend]
+    return getattr(importlib.import_module(module), name)
+
+
+def use_backend(backend, simulator_address=None):
+    """ Points SSHSession at one of the BACKENDS.  Modules opening
+        sessions look SSHSession up at call time, so this takes effect for
+        every session opened afterwards.
+
+        @return session_class   the class SSHSession now refers to
+    """
+    global SSHSession, SSH_BACKEND, SIMULATOR_ADDRESS
+    if simulator_address:
+        SIMULATOR_ADDRESS = simulator_address
+    SSHSession = backend_class(backend)
+    SSH_BACKEND = backend
+    return SSHSession
+
+
+def __getattr__(name):
+    """ Resolves SSHSession from SSH_BACKEND the first time it is used,
+        so no backend is imported until a session opens.
+    """
+    if name == 'SSHSession':
+        return use_backend(SSH_BACKEND)
+    error = 'module {0!r} has no attribute {1!r}'.format(__name__, name)
+    raise AttributeError(error)
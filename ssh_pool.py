@@ -0,0 +1,238 @@
+""" Per-device pool of warm SSH sessions
+
+    Opening an SSH session costs a TCP connect, key exchange, auth and an
+    interactive shell, which can take seconds.  Remediations borrow
+    sessions from the pool instead, so a burst of events from one device
+    reuses the same connection:
+
+        with ssh_pool.POOL.session(device_name) as ssh:
+            output = ssh.write([command])
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import atexit
+import contextlib
+import threading
+import time
+
+# Local modules
+import metrics
+import ssh_helper
+
+
+# Most seconds between sweeps of the reaper thread closing idle sessions
+REAP_INTERVAL = 30
+
+CONNECT_SECONDS = metrics.histogram(
+    'ssh_connect_seconds', 'Time opening an SSH session', ('device',))
+CONNECT_ERRORS = metrics.counter(
+    'ssh_connect_errors_total', 'SSH sessions that failed to open',
+    ('device',))
+WAIT_SECONDS = metrics.histogram(
+    'ssh_pool_wait_seconds',
+    'Time waiting for a pool slot or idle session, excluding connecting')
+SESSIONS_OPEN = metrics.gauge(
+    'ssh_sessions_open', 'SSH sessions open in the shared pool, idle or '
+                         'borrowed')
+
+
+class SSHPool(object):
+    """ Hands out reusable SSHSession objects keyed by device name.
+
+        At most "max_per_device" sessions are open to any one device and
+        "max_total" overall; callers beyond either cap wait for a session
+        to be returned.  Idle sessions are closed after "idle_timeout"
+        seconds, by a reaper thread started with the first release, and
+        each one is health-checked before it is handed out.
+    """
+
+    def __init__(self, username='', passwd='', max_per_device=2,
+                 max_total=64, idle_timeout=300):
+        self.username = username
+        self.passwd = passwd
+        self.max_per_device = max_per_device
+        self.max_total = max_total
+        self.idle_timeout = idle_timeout
+        self._cond = threading.Condition()
+        self._idle = {}      # device -> [(session, last used), ...]
+        self._open = {}      # device -> sessions open (idle or borrowed)
+        self._total = 0
+        self._reaper = None
+
+    def _connect(self, device):
+        """ Opens a new session to the device.  Looked up at call time so
+            that a substituted SSHSession class is honoured.
+        """
+        with CONNECT_SECONDS.time(device):
+            return ssh_helper.SSHSession(
+                device=device, username=self.username, passwd=self.passwd)
+
+    def _forget(self, device):
+        """ Releases the slot held by a closed session.  Called with the
+            lock held.
+        """
+        self._open[device] -= 1
+        if not self._open[device]:
+            del self._open[device]
+        self._total -= 1
+        self._cond.notify_all()
+
+    def _close(self, device, session):
+        """ Closes a session, ignoring errors from dead connections.
+            Called with the lock held.
+        """
+        try:
+            session.close()
+        except Exception:
+            pass
+        self._forget(device)
+
+    def _expire_idle(self):
+        """ Closes sessions that have sat idle longer than the idle
+            timeout.  Called with the lock held.
+        """
+        cutoff = time.time() - self.idle_timeout
+        for device in list(self._idle):
+            idle = self._idle[device]
+            while idle and idle[0][1] < cutoff:
+                session, _ = idle.pop(0)
+                self._close(device, session)
+            if not idle:
+                del self._idle[device]
+
+    def _reap(self):
+        """ Closes expired idle sessions periodically, so sessions to
+            devices that are not borrowed again still time out.
+        """
+        interval = min(self.idle_timeout, REAP_INTERVAL)
+        while True:
+            time.sleep(interval)
+            with self._cond:
+                self._expire_idle()
+
+    def _start_reaper(self):
+        """ Starts the reaper thread, again in a forked child where it
+            did not survive.  Called with the lock held.
+        """
+        if self._reaper is None or not self._reaper.is_alive():
+            self._reaper = threading.Thread(target=self._reap,
+                                            name='ssh-pool-reaper')
+            self._reaper.daemon = True
+            self._reaper.start()
+
+    def _evict_other_idle(self, device):
+        """ Closes the longest-idle session of another device to make
+            room under the global cap.  Called with the lock held.
+
+            @return evicted     True if a session was closed
+        """
+        oldest = None
+        for other, idle in self._idle.items():
+            if other != device and idle and (
+                    oldest is None or idle[0][1] < self._idle[oldest][0][1]):
+                oldest = other
+        if oldest is None:
+            return False
+        session, _ = self._idle[oldest].pop(0)
+        if not self._idle[oldest]:
+            del self._idle[oldest]
+        self._close(oldest, session)
+        return True
+
+    def acquire(self, device, timeout=None):
+        """ Borrows a session to the device, reusing an idle one when
+            possible.  Waits up to "timeout" seconds (forever if None) when
+            the pool is at capacity.
+
+            @return session     an SSHSession to return with release()
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        started = time.time()
+        with self._cond:
+            while True:
+                self._expire_idle()
+                idle = self._idle.get(device)
+                while idle:
+                    session, _ = idle.pop()
+                    if not idle:
+                        del self._idle[device]
+                    if session.is_alive():
+                        WAIT_SECONDS.observe(time.time() - started)
+                        return session
+                    self._close(device, session)
+                    idle = self._idle.get(device)
+
+                if self._open.get(device, 0) < self.max_per_device:
+                    if (self._total < self.max_total or
+                            self._evict_other_idle(device)):
+                        # Reserve the slot, then connect without the lock
+                        self._open[device] = self._open.get(device, 0) + 1
+                        self._total += 1
+                        break
+
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        error = ('Timeout exceeded while waiting for an SSH '
+                                 'session to {0}.'.format(device))
+                        raise Exception(error)
+                self._cond.wait(remaining)
+
+        WAIT_SECONDS.observe(time.time() - started)
+        try:
+            return self._connect(device)
+        except BaseException:
+            CONNECT_ERRORS.inc(device)
+            with self._cond:
+                self._forget(device)
+            raise
+
+    def release(self, device, session, discard=False):
+        """ Returns a borrowed session to the pool, or closes it if
+            "discard" is set or it is no longer healthy.
+
+            @return None
+        """
+        with self._cond:
+            if discard or not session.is_alive():
+                self._close(device, session)
+                return
+            self._idle.setdefault(device, []).append((session, time.time()))
+            self._start_reaper()
+            self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def session(self, device, timeout=None):
+        """ Borrows a session for the duration of a "with" block.  A session
+            that raised is discarded, since its shell may be mid-command.
+        """
+        session = self.acquire(device, timeout=timeout)
+        try:
+            yield session
+        except BaseException:
+            self.release(device, session, discard=True)
+            raise
+        self.release(device, session)
+
+    def close_all(self):
+        """ Closes every idle session.  Sessions that are borrowed at the
+            time are left to their callers.
+
+            @return None
+        """
+        with self._cond:
+            for device, idle in list(self._idle.items()):
+                for session, _ in idle:
+                    self._close(device, session)
+            self._idle.clear()
+
+
+# Shared pool used by the remediations
+POOL = SSHPool()
+atexit.register(POOL.close_all)
+SESSIONS_OPEN.track(lambda: POOL._total)
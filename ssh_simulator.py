@@ -0,0 +1,470 @@
+#!/usr/bin/python
+""" Local SSH server simulating a fleet of NX-OS devices.
+
+    One paramiko server on loopback stands in for any number of devices:
+    the SSH username names the device, and its show-command output is
+    rendered from TEMPLATES with counters, light levels and module states
+    derived from the device name, so every device answers differently
+    but always the same way.  Output piped through "| egrep", "| grep" or
+    "| include" is filtered as a switch would.
+
+    Prompt, banner, per-command latency and jitter, output size and
+    injected failures (refused connections, failed logins, dropped
+    sessions and hung commands) are all configurable, so the real
+    ssh_helper.SSHSession code path can be load tested at fleet scale:
+
+        python ssh_simulator.py --port 2222 --latency 0.05
+        SSH_BACKEND=simulator SSH_SIMULATOR=127.0.0.1:2222 \\
+            python demo_better.py -c 32
+
+    Each connection costs two threads (paramiko's transport and the
+    shell), so a few thousand concurrent sessions is a practical limit.
+"""
+
+# Standard library modules
+import argparse
+import random
+import re
+import socket
+import sys
+import threading
+import time
+import zlib
+
+# Third-party
+import paramiko
+
+# Local modules
+import ssh_helper
+
+
+HOST = '127.0.0.1'
+PORT = 2222
+
+PROMPT = '{device}# '
+BANNER = ('Cisco Nexus Operating System (NX-OS) Software\r\n'
+          'TAC support: http://www.cisco.com/tac\r\n')
+
+# Seconds listened connections wait for the client to open a shell
+SHELL_TIMEOUT = 30
+
+# Filler line used to pad outputs up to "output_size" bytes
+FILLER = '  {0:<70}\r\n'
+
+
+def _rng(*keys):
+    """ @return rng         a random.Random seeded by the keys, so values
+                            derived from it are stable across runs
+    """
+    return random.Random(zlib.crc32('/'.join(
+        str(key) for key in keys).encode('utf-8')))
+
+
+def _module_status(device, module):
+    rng = _rng(device, 'module', module)
+    return 'powered-dn' if rng.random() < 0.05 else 'ok'
+
+
+def show_module(device, module=None):
+    modules = [int(module)] if module else range(1, 9)
+    rows = []
+    diags = []
+    for number in modules:
+        rows.append('{0:<4} {1:<6} {2:<35} {3:<18} {4}'.format(
+            number, 48, '1/10 Gbps Ethernet Module', 'N7K-F248XP-25E',
+            _module_status(device, number)))
+        diags.append('{0:<4} {1}'.format(
+            number, 'Pass' if _module_status(device, number) == 'ok'
+            else 'Untested'))
+    return ('Mod  Ports  Module-Type                         Model'
+            '              Status\r\n'
+            '---  -----  ----------------------------------- '
+            '------------------ ----------\r\n'
+            '{0}\r\n\r\n'
+            'Mod  Online Diag Status\r\n'
+            '---  ------------------\r\n'
+            '{1}\r\n\r\n'
+            'Chassis Ejector Support: Enabled\r\n'.format(
+                '\r\n'.join(rows), '\r\n'.join(diags)))
+
+
+def show_module_uptime(device):
+    blocks = []
+    for number in range(1, 9):
+        seconds = _rng(device, 'uptime', number).randrange(60, 400 * 86400)
+        days, seconds = divmod(seconds, 86400)
+        blocks.append(
+            '------ Module {0} -----\r\n'
+            'Module Start Time:    Thu Apr  2 14:40:07 2015\r\n'
+            'Up Time:             {1} days, {2} hours, {3} minutes, '
+            '{4} seconds\r\n'.format(number, days, seconds // 3600,
+                                     seconds // 60 % 60, seconds % 60))
+    return ''.join(blocks)
+
+
+def show_interface(device, interface):
+    rng = _rng(device, 'interface', interface)
+    return ('Ethernet{0} is {1}\r\n'
+            'admin state is up, Dedicated Interface\r\n'
+            '  Hardware: 1000/10000 Ethernet, address: 0000.0000.0000\r\n'
+            '  MTU 1500 bytes, BW 10000000 Kbit, DLY 10 usec\r\n'
+            '  Last link flapped {2}d{3:02d}h\r\n'
+            '  30 seconds input rate {4} bits/sec, {5} packets/sec\r\n'
+            '  30 seconds output rate {6} bits/sec, {7} packets/sec\r\n'
+            '  RX\r\n'
+            '    {8} input error  0 short frame  0 overrun   0 underrun\r\n'
+            '    0 input with dribble  {9} input discard\r\n'
+            '  TX\r\n'
+            '    {10} output errors  0 collision  0 deferred\r\n'
+            '  {11} interface resets\r\n'.format(
+                interface, 'up' if rng.random() < 0.5 else 'down',
+                rng.randrange(10), rng.randrange(24),
+                rng.randrange(10 ** 9), rng.randrange(10 ** 5),
+                rng.randrange(10 ** 9), rng.randrange(10 ** 5),
+                rng.randrange(100), rng.randrange(10 ** 6),
+                rng.randrange(10), rng.randrange(300)))
+
+
+def show_transceiver(device, interface):
+    rng = _rng(device, 'transceiver', interface)
+    return ('Ethernet{0}\r\n'
+            '    transceiver is present\r\n'
+            '    type is 10Gbase-SR\r\n'
+            '  SFP Detail Diagnostics Information (internal calibrated)\r\n'
+            '  ----------------------------------------------------------'
+            '------------------\r\n'
+            '                Current              Alarms                  '
+            'Warnings\r\n'
+            '                Measurement     High        Low         High'
+            '          Low\r\n'
+            '  ----------------------------------------------------------'
+            '------------------\r\n'
+            '  Temperature   30.62 C        75.00 C     -5.00 C     '
+            '70.00 C        0.00 C\r\n'
+            '  Tx Power      {1:.2f} dBm       1.69 dBm  -11.30 dBm   '
+            '-1.30 dBm     -7.30 dBm\r\n'
+            '  Rx Power      {2:.2f} dBm       1.99 dBm  -13.97 dBm   '
+            '-1.00 dBm     -9.91 dBm\r\n'.format(
+                interface, rng.uniform(-3.5, -1.5), rng.uniform(-10, -2)))
+
+
+# Show commands to the function rendering their output, which is called
+# with the device name and the groups of the pattern
+TEMPLATES = [
+    (r'show module uptime', show_module_uptime),
+    (r'show module(?:\s+(\d+))?', show_module),
+    (r'show int(?:erface)?\s+e(?:th(?:ernet)?)?\s*(\d+/\d+)\s+'
+     r'transceiver(?:\s+details)?', show_transceiver),
+    (r'show int(?:erface)?\s+e(?:th(?:ernet)?)?\s*(\d+/\d+)',
+     show_interface),
+]
+TEMPLATES = [(re.compile(pattern + r'\s*$'), render)
+             for pattern, render in TEMPLATES]
+
+INVALID = "% Invalid command at '^' marker.\r\n"
+
+# A "|" outside double quotes
+PIPE_RE = re.compile(r'\|(?=(?:[^"]*"[^"]*")*[^"]*$)')
+
+# "| egrep -A 3 "Module 5"", "| grep Rx" or "| include Rx"
+FILTER_RE = re.compile(
+    r'^\s*(?:e?grep|include)\s+(?:-A\s*(\d+)\s+)?(?:"([^"]*)"|(\S+))\s*$')
+
+
+def _filter(output, stage):
+    """ Applies one "| egrep" stage to an output. """
+    matched = FILTER_RE.match(stage)
+    if not matched:
+        return INVALID
+    after = int(matched.group(1) or 0)
+    try:
+        pattern = re.compile(matched.group(2) or matched.group(3))
+    except re.error:
+        return INVALID
+    lines = []
+    remaining = 0
+    for line in output.splitlines(True):
+        if pattern.search(line):
+            lines.append(line)
+            remaining = after
+        elif remaining:
+            lines.append(line)
+            remaining -= 1
+    return ''.join(lines)
+
+
+def render(device, command):
+    """ Renders a command's output for a device.
+
+        @return output      the output, with "\\r\\n" line endings
+    """
+    command, *pipeline = PIPE_RE.split(command)
+    command = ' '.join(command.split())
+    for pattern, template in TEMPLATES:
+        matched = pattern.match(command)
+        if matched:
+            output = template(device, *(
+                group for group in matched.groups() if group is not None))
+            break
+    else:
+        return INVALID
+    for stage in pipeline:
+        output = _filter(output, stage)
+    return output
+
+
+class _Server(paramiko.ServerInterface):
+    """ Accepts any password for any device, unless a failure is
+        injected.
+    """
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+        self.device = None
+        self.shell = threading.Event()
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        if self.simulator._inject('auth_failure_rate'):
+            return paramiko.AUTH_FAILED
+        self.device = username
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_pty_request(self, channel, term, width, height,
+                                  pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_shell_request(self, channel):
+        self.shell.set()
+        return True
+
+
+class DeviceSimulator(object):
+    """ An SSH server answering as whichever device logs in.
+
+        @param latency          seconds before each command's output
+        @param jitter           standard deviation of the latency
+        @param output_size      pad every output to at least this many
+                                bytes, to load the transport
+        @param refuse_rate      share of connections closed on accept
+        @param auth_failure_rate share of logins rejected
+        @param drop_rate        share of commands that close the session
+                                part way through the output
+        @param hang_rate        share of commands that never return to
+                                the prompt
+    """
+
+    def __init__(self, host=HOST, port=PORT, prompt=PROMPT, banner=BANNER,
+                 latency=0.0, jitter=0.0, output_size=0, refuse_rate=0.0,
+                 auth_failure_rate=0.0, drop_rate=0.0, hang_rate=0.0,
+                 host_key=None, seed=None):
+        self.host = host
+        self.port = port
+        self.prompt = prompt
+        self.banner = banner
+        self.latency = latency
+        self.jitter = jitter
+        self.output_size = output_size
+        self.refuse_rate = refuse_rate
+        self.auth_failure_rate = auth_failure_rate
+        self.drop_rate = drop_rate
+        self.hang_rate = hang_rate
+        self.host_key = host_key or paramiko.RSAKey.generate(2048)
+        self.connections = 0
+        self.sessions = 0
+        self.commands = 0
+        self.failures = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._socket = None
+        self._stopped = threading.Event()
+        self._transports = set()
+
+    def _inject(self, rate_name):
+        """ @return failed      True if this call should fail """
+        rate = getattr(self, rate_name)
+        with self._lock:
+            failed = bool(rate) and self._random.random() < rate
+            if failed:
+                self.failures += 1
+        return failed
+
+    def start(self):
+        """ Starts listening on a background thread.  Port 0 picks a free
+            port, found in self.port afterwards.
+
+            @return self
+        """
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((self.host, self.port))
+        self._socket.listen(1024)
+        self.port = self._socket.getsockname()[1]
+        thread = threading.Thread(target=self._accept, name='ssh-simulator')
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        """ Stops listening and closes every open session.
+
+            @return None
+        """
+        self._stopped.set()
+        self._socket.close()
+        for transport in list(self._transports):
+            transport.close()
+
+    def _accept(self):
+        while not self._stopped.is_set():
+            try:
+                client, _ = self._socket.accept()
+            except OSError:
+                return
+            with self._lock:
+                self.connections += 1
+            if self._inject('refuse_rate'):
+                client.close()
+                continue
+            thread = threading.Thread(target=self._serve, args=(client,))
+            thread.daemon = True
+            thread.start()
+
+    def _serve(self, client):
+        """ Runs one SSH connection until the client leaves. """
+        # Each command's output is sent on its own; without this, the
+        # second of a pipelined batch waits on Nagle and a delayed ACK
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        transport = paramiko.Transport(client)
+        transport.add_server_key(self.host_key)
+        server = _Server(self)
+        self._transports.add(transport)
+        try:
+            transport.start_server(server=server)
+            channel = transport.accept(SHELL_TIMEOUT)
+            if channel is None or not server.shell.wait(SHELL_TIMEOUT):
+                return
+            with self._lock:
+                self.sessions += 1
+            self._shell(channel, server.device)
+        except (paramiko.SSHException, EOFError, OSError):
+            pass
+        finally:
+            self._transports.discard(transport)
+            transport.close()
+
+    def _shell(self, channel, device):
+        """ Answers commands on an interactive shell:  each one is echoed,
+            followed by its output and the prompt.
+        """
+        prompt = self.prompt.format(device=device)
+        channel.sendall('{0}\r\n{1}'.format(self.banner, prompt))
+        pending = b''
+        while True:
+            data = channel.recv(65536)
+            if not data:
+                return
+            pending += data
+            while b'\n' in pending:
+                line, pending = pending.split(b'\n', 1)
+                command = line.decode('utf-8', 'replace').strip()
+                if not self._answer(channel, device, prompt, command):
+                    return
+
+    def _answer(self, channel, device, prompt, command):
+        """ Sends one command's echo, output and prompt.
+
+            @return alive       False once the session has been dropped
+        """
+        with self._lock:
+            self.commands += 1
+        if self.latency or self.jitter:
+            time.sleep(max(0, self._random.gauss(self.latency, self.jitter)))
+        output = render(device, command) if command else ''
+        if len(output) < self.output_size:
+            output += ''.join(
+                FILLER.format(number) for number in range(
+                    (self.output_size - len(output)) // 75 + 1))
+        if self._inject('drop_rate'):
+            channel.sendall('{0}\r\n{1}'.format(
+                command, output[:len(output) // 2]))
+            channel.close()
+            return False
+        if self._inject('hang_rate'):
+            channel.sendall('{0}\r\n{1}'.format(command, output))
+            return True
+        channel.sendall('{0}\r\n{1}{2}'.format(command, output, prompt))
+        return True
+
+    def stats(self):
+        """ @return stats       a dict of counters """
+        return {
+            'connections': self.connections,
+            'sessions': self.sessions,
+            'open': len(self._transports),
+            'commands': self.commands,
+            'failures': self.failures,
+        }
+
+
+class SimulatedSession(ssh_helper.ParamikoSSHSession):
+    """ A real paramiko session to the simulator, logging in as the
+        device.  Selected with SSH_BACKEND=simulator; the simulator's
+        address is ssh_helper.SIMULATOR_ADDRESS.
+    """
+
+    def __init__(self, device, username='', passwd='', debug=False,
+                 timeout=30):
+        host, _, port = ssh_helper.SIMULATOR_ADDRESS.rpartition(':')
+        super(SimulatedSession, self).__init__(
+            device, device, passwd, debug=debug, timeout=timeout,
+            host=host, port=int(port))
+
+
+def main(argv=None):
+    """ Main program logic """
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--prompt', default=PROMPT,
+                        help='prompt, with {device} for the device name '
+                             '(default: "%(default)s")')
+    parser.add_argument('--banner', default=BANNER)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds before each output')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='standard deviation of the latency')
+    parser.add_argument('--output-size', type=int, default=0,
+                        help='pad outputs to this many bytes')
+    parser.add_argument('--refuse-rate', type=float, default=0.0)
+    parser.add_argument('--auth-failure-rate', type=float, default=0.0)
+    parser.add_argument('--drop-rate', type=float, default=0.0)
+    parser.add_argument('--hang-rate', type=float, default=0.0)
+    args = parser.parse_args(argv)
+
+    simulator = DeviceSimulator(
+        args.host, args.port, prompt=args.prompt,
+        banner=args.banner.replace('\\n', '\r\n'), latency=args.latency,
+        jitter=args.jitter, output_size=args.output_size,
+        refuse_rate=args.refuse_rate,
+        auth_failure_rate=args.auth_failure_rate,
+        drop_rate=args.drop_rate, hang_rate=args.hang_rate).start()
+    print('Simulating devices on {0}:{1}'.format(args.host, simulator.port))
+    try:
+        while True:
+            time.sleep(60)
+            print(simulator.stats())
+    except KeyboardInterrupt:
+        simulator.stop()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,126 @@
+#!/usr/bin/python
+""" Ingestion of rotated and compressed syslog archives.
+
+    Reads whole directories or globs of rotated files ("syslog.1",
+    "syslog.2.gz", "syslog.3.xz", "syslog.4.zst", ...) one line at a time,
+    oldest file first.  Plain files are memory-mapped rather than read
+    into memory, and compressed files are decompressed as a stream, so
+    memory use stays constant however large the archive is.
+"""
+
+# Standard library modules
+import glob
+import gzip
+import io
+import lzma
+import mmap
+import os
+
+# Local modules
+import syslog_parser
+import timestamps
+
+# Third-party (optional, only needed for .zst archives)
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Lines read from the start of each file to find its first timestamp
+PEEK_LINES = 100
+
+
+def expand(paths):
+    """ Expands files, directories and glob patterns into a sorted list of
+        unique files.
+
+        @return files       a list of file paths
+    """
+    files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            matches = [os.path.join(path, name) for name in os.listdir(path)]
+        else:
+            matches = glob.glob(path)
+        files.update(match for match in matches if os.path.isfile(match))
+    return sorted(files)
+
+
+def _mmap_lines(path):
+    """ Yields the lines of a plain file through a read-only memory map,
+        translating CRLF endings as a text-mode file would.
+    """
+    with open(path, mode='rb') as syslog:
+        if not os.fstat(syslog.fileno()).st_size:
+            return
+        mapped = mmap.mmap(syslog.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        if hasattr(mapped, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+        for line in iter(mapped.readline, b''):
+            if line.endswith(b'\r\n'):
+                line = line[:-2] + b'\n'
+            yield line.decode('utf-8', 'replace')
+    finally:
+        mapped.close()
+
+
+def _open_compressed(path):
+    """ Opens a compressed file as a stream of decompressed bytes.
+
+        @return stream      a binary file object, or None if not compressed
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, mode='rb')
+    if path.endswith('.xz') or path.endswith('.lzma'):
+        return lzma.open(path, mode='rb')
+    if path.endswith('.zst') or path.endswith('.zstd'):
+        if zstandard is None:
+            raise ImportError('The "zstandard" module is needed to read '
+                              '{0}'.format(path))
+        return zstandard.ZstdDecompressor().stream_reader(
+            open(path, mode='rb'), read_across_frames=True)
+    return None
+
+
+def read_lines(path):
+    """ Yields the lines of one archive file, decompressing on the fly. """
+    stream = _open_compressed(path)
+    if stream is None:
+        for line in _mmap_lines(path):
+            yield line
+        return
+    with io.TextIOWrapper(io.BufferedReader(stream), encoding='utf-8',
+                          errors='replace') as syslog:
+        for line in syslog:
+            yield line
+
+
+def first_epoch(path, peek_lines=PEEK_LINES):
+    """ Finds the time of the first parsable line of a file, falling back
+        to its modification time.
+
+        @return epoch       seconds since the epoch
+    """
+    lines = read_lines(path)
+    try:
+        for _, line in zip(range(peek_lines), lines):
+            fields = syslog_parser.parse_line(line)
+            if fields:
+                epoch = timestamps.to_epoch(fields[0], fields[1])
+                if epoch is not None:
+                    return epoch
+    finally:
+        lines.close()
+    return os.path.getmtime(path)
+
+
+def read_archive(paths):
+    """ Yields every line of the files matched by "paths" (files,
+        directories or globs), processing files in timestamp order.
+    """
+    files = sorted(expand(paths), key=lambda path: (first_epoch(path), path))
+    for path in files:
+        for line in read_lines(path):
+            yield line
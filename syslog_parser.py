@@ -0,0 +1,204 @@
+#!/usr/bin/python
+""" High-throughput parsing of syslog lines into event fields.
+
+    Well-formed lines ("2016 Apr  2 14:25:06 switch1 %CODE: message") are
+    matched by a fixed-layout pattern with no backtracking.  Anything else
+    falls back to the precompiled SYSLOG_RE, so both paths give identical
+    results.  Large files can be split into newline-aligned chunks and
+    parsed on a process pool.
+"""
+
+# Standard library modules
+import collections
+import io
+import itertools
+import multiprocessing
+import os
+import re
+
+# Local modules
+import events
+
+
+# Regular expressions by section, overall this matches:
+#     2015 Apr  2 14:25:06 switch1 %ETHPORT-5-IF_DOWN_INTERFACE_REMOVED:
+#     Interface Ethernet5/1 is down (Interface removed)
+DATESTAMP_RE = r'(\d+\s+\w+\s+\d+)'  # Group 1:  year month day
+TIMESTAMP_RE = r'(\d+:\d+:\d+)'      # Group 2:  hours:mins:secs
+DEVICE_NAME_RE = r'(\S+)'            # Group 3:  device name
+ERROR_CODE_RE = r'%(\S+):'           # Group 4:  error code
+ERROR_MSG_RE = r'(.*)'               # Group 5:  everything else
+COLUMN_DELIMITER_RE = r'\s+'         # space(s)
+
+SYSLOG_RE = (
+    DATESTAMP_RE + COLUMN_DELIMITER_RE +
+    TIMESTAMP_RE + COLUMN_DELIMITER_RE +
+    DEVICE_NAME_RE + COLUMN_DELIMITER_RE +
+    ERROR_CODE_RE + COLUMN_DELIMITER_RE +
+    ERROR_MSG_RE)
+SYSLOG_PATTERN = re.compile(SYSLOG_RE)
+
+# The same fields for lines with the standard layout (4-digit year, 3-letter
+# month, space-padded day, single spaces).  Fixed widths leave the engine
+# nothing to backtrack over; any line it rejects is retried with
+# SYSLOG_PATTERN, and lines it accepts give the same groups as SYSLOG_RE.
+FAST_RE = (r'(\d{4} \w{3} [ \d]\d) (\d\d:\d\d:\d\d) (\S+) %(\S+): (\S.*)')
+FAST_PATTERN = re.compile(FAST_RE)
+
+# Bytes of the file handed to each worker by parse_file()
+CHUNK_SIZE = 16 * 1024 * 1024
+
+# Chunks parsed ahead of the consumer, per worker process.  Workers wait
+# rather than run ahead of a slow consumer with the whole file.
+CHUNKS_AHEAD = 2
+
+_SPLITLINES_ONLY_BREAKS = '\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029'
+
+
+def parse_line_regex(line):
+    """ Parses one line with SYSLOG_RE.
+
+        @return fields      (datestamp, timestamp, device_name, error_code,
+                             error_message), or None if it does not match
+    """
+    matched = SYSLOG_PATTERN.match(line)
+    if not matched:
+        return None
+    return matched.groups()
+
+
+def parse_line(line):
+    """ Parses one line, trying the fixed-layout FAST_PATTERN before
+        falling back to SYSLOG_RE.
+
+        @return fields      (datestamp, timestamp, device_name, error_code,
+                             error_message), or None if it does not match
+    """
+    matched = FAST_PATTERN.match(line) or SYSLOG_PATTERN.match(line)
+    if not matched:
+        return None
+    return matched.groups()
+
+
+def parse_lines(lines, fast=True):
+    """ Parses lines, yielding the fields of every line that matches. """
+    # The loop is spelled out rather than calling parse_line(), since a
+    # Python call per line costs about as much as the match itself
+    slow_match = SYSLOG_PATTERN.match
+    if not fast:
+        for line in lines:
+            matched = slow_match(line)
+            if matched:
+                yield matched.groups()
+        return
+    fast_match = FAST_PATTERN.match
+    for line in lines:
+        matched = fast_match(line) or slow_match(line)
+        if matched:
+            yield matched.groups()
+
+
+def chunk_offsets(path, chunk_size=CHUNK_SIZE):
+    """ Splits a file into byte ranges that start and end on line
+        boundaries.
+
+        @return chunks      a list of (start, end) offsets
+    """
+    size = os.path.getsize(path)
+    chunks = []
+    start = 0
+    with open(path, mode='rb') as syslog:
+        while start < size:
+            syslog.seek(min(start + chunk_size, size))
+            syslog.readline()
+            end = min(syslog.tell(), size)
+            chunks.append((start, end))
+            start = end
+    return chunks
+
+
+def _parse_chunk(args):
+    """ Parses the lines in one byte range of a file.  Runs in a worker
+        process.
+
+        @return events      a list of parsed fields
+    """
+    path, start, end, fast = args
+    with open(path, mode='rb') as syslog:
+        syslog.seek(start)
+        data = syslog.read(end - start)
+    text = data.decode('utf-8', 'replace')
+    # Lines must split exactly as a text-mode file would split them.
+    # str.splitlines() agrees, and is much quicker, unless the text holds
+    # carriage returns or one of the other breaks only it recognises.
+    if any(char in text for char in _SPLITLINES_ONLY_BREAKS):
+        lines = io.StringIO(text, newline=None)
+    else:
+        lines = text.splitlines(True)
+    return list(parse_lines(lines, fast=fast))
+
+
+def _parse_chunk_batch(args):
+    """ Parses one byte range of a file into an events.EventBatch, which
+        is far cheaper to send back from a worker than a list of tuples.
+
+        @return batch       an EventBatch
+    """
+    batch = events.EventBatch()
+    batch.extend(_parse_chunk(args))
+    return batch
+
+
+def _map_chunks(parse, path, processes, fast, chunk_size):
+    """ Applies parse() to each newline-aligned chunk of a file, on a
+        pool of worker processes, yielding the results in file order.
+        At most CHUNKS_AHEAD chunks per process are submitted beyond the
+        one being consumed, so only a few are held in memory at once.
+    """
+    chunks = [(path, start, end, fast)
+              for start, end in chunk_offsets(path, chunk_size)]
+    processes = processes or os.cpu_count() or 1
+    if processes == 1 or len(chunks) == 1:
+        for chunk in chunks:
+            yield parse(chunk)
+        return
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        chunks = iter(chunks)
+        pending = collections.deque(
+            pool.apply_async(parse, (chunk,))
+            for chunk in itertools.islice(chunks, processes * CHUNKS_AHEAD))
+        while pending:
+            result = pending.popleft().get()
+            # Keep the workers busy while the consumer handles this one
+            for chunk in itertools.islice(chunks, 1):
+                pending.append(pool.apply_async(parse, (chunk,)))
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def parse_file(path, processes=None, fast=True, chunk_size=CHUNK_SIZE):
+    """ Parses a whole file on a pool of worker processes, one
+        newline-aligned chunk at a time.  Results are yielded in file
+        order, and only a few chunks are held in memory at once.
+
+        @param processes    worker count, defaults to the number of CPUs;
+                            1 parses in this process
+    """
+    for chunk_events in _map_chunks(_parse_chunk, path, processes, fast,
+                                    chunk_size):
+        for fields in chunk_events:
+            yield fields
+
+
+def parse_file_batches(path, processes=None, fast=True,
+                       chunk_size=CHUNK_SIZE):
+    """ Parses a whole file like parse_file(), yielding one
+        events.EventBatch per chunk.
+    """
+    for batch in _map_chunks(_parse_chunk_batch, path, processes, fast,
+                             chunk_size):
+        yield batch
@@ -0,0 +1,422 @@
+#!/usr/bin/python
+""" Local syslog receiver feeding the ingest pipeline directly.
+
+    Listens for RFC 3164 and RFC 5424 messages over UDP and TCP (both
+    octet-counted and newline-framed), rewrites them into the
+    "2016 Apr  2 14:25:06 switch1 %CODE: message" form SYSLOG_RE expects,
+    and inserts them into the DB in batches.  Received messages wait in a
+    bounded queue:  UDP datagrams that find it full are dropped and
+    counted, while TCP senders are made to wait (backpressure).
+
+        python syslog_receiver.py --port 5514
+        python syslog_receiver.py --loadgen --port 5514 --count 100000
+"""
+
+# Standard library modules
+import argparse
+import asyncio
+import calendar
+import concurrent.futures
+import re
+import socket
+import sys
+import time
+
+# Local modules
+import db
+import metrics
+import syslog_parser
+import timestamps
+
+
+# Messages held between the sockets and the DB writer
+QUEUE_SIZE = 10000
+
+# Messages written to the DB per transaction
+BATCH_SIZE = 500
+
+# Longest TCP frame accepted, in bytes, and the most digits read as an
+# octet count before a frame is taken to be newline-framed
+MAX_FRAME = 65536
+LENGTH_DIGITS = 6
+
+MESSAGES = metrics.counter(
+    'syslog_messages_total', 'Syslog messages seen by the receiver, by '
+                             'outcome', ('outcome',))
+BATCH_ERRORS = metrics.counter(
+    'syslog_batch_errors_total',
+    'Batches of received events whose insert or callback raised')
+PARSE_SECONDS = metrics.histogram(
+    'syslog_parse_batch_seconds',
+    'Time normalizing and parsing each batch of received messages')
+
+# Kernel receive buffer requested for the UDP socket, so bursts queue in
+# the kernel rather than being dropped before we see them
+UDP_RCVBUF = 4 * 1024 * 1024
+
+PRI_RE = re.compile(r'<\d{1,3}>')
+# NX-OS:  "2016 Apr  2 14:25:06 UTC: %CODE: message", optionally with
+# milliseconds and a host name
+NXOS_RE = re.compile(
+    r'(\d{4} \w{3} +\d{1,2}) (\d\d:\d\d:\d\d)(?:\.\d+)?(?: [A-Z]{3,4}:)?'
+    r'(?: ([^%\s]\S*))? (%.*)', re.DOTALL)
+# "Apr  2 14:25:06 switch1 %CODE: message"
+RFC3164_RE = re.compile(
+    r'(\w{3}) +(\d{1,2}) (\d\d:\d\d:\d\d) (\S+) (.*)', re.DOTALL)
+# "1 2016-04-02T14:25:06.003Z switch1 app - - - %CODE: message"
+RFC5424_RE = re.compile(
+    r'\d+ (\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(?:\.\d+)?'
+    r'(Z|[+-]\d\d:\d\d) (\S+) \S+ \S+ \S+ (?:-|(?:\[.*?\])+) ?(.*)',
+    re.DOTALL)
+
+
+def _datestamp(year, month, day):
+    """ Formats a date the way the syslog files do:  "2016 Apr  2" """
+    return '{0} {1} {2:2d}'.format(
+        year, timestamps.MONTH_NAMES[month - 1], day)
+
+
+def normalize(message, host=None, now=None):
+    """ Rewrites a received syslog message as a line SYSLOG_RE can parse.
+        "host" names the sender of messages that leave it out.
+
+        @return line        the rewritten line, or None if the message is
+                            in no format we recognise
+    """
+    if isinstance(message, bytes):
+        message = message.decode('utf-8', 'replace')
+    message = message.strip('\r\n\x00')
+    pri = PRI_RE.match(message)
+    if pri:
+        message = message[pri.end():]
+    message = message.lstrip(': ').lstrip('\ufeff')
+    if syslog_parser.parse_line(message):
+        return message
+
+    matched = NXOS_RE.match(message)
+    if matched:
+        datestamp, timestamp, sender, text = matched.groups()
+        if sender or host:
+            return '{0} {1} {2} {3}'.format(
+                datestamp, timestamp, sender or host, text)
+        return None
+
+    matched = RFC5424_RE.match(message)
+    if matched:
+        (year, month, day, hours, minutes, seconds,
+         offset, host, text) = matched.groups()
+        stamp = calendar.timegm((int(year), int(month), int(day), int(hours),
+                                 int(minutes), int(seconds)))
+        if offset != 'Z':
+            sign = -1 if offset[0] == '+' else 1
+            stamp += sign * (int(offset[1:3]) * 3600 + int(offset[4:6]) * 60)
+        utc = time.gmtime(stamp)
+        return '{0} {1} {2} {3}'.format(
+            _datestamp(utc.tm_year, utc.tm_mon, utc.tm_mday),
+            time.strftime('%H:%M:%S', utc), host, text.lstrip('\ufeff'))
+
+    matched = RFC3164_RE.match(message)
+    if matched and matched.group(1) in timestamps.MONTH_NAMES:
+        month_name, day, timestamp, host, text = matched.groups()
+        # RFC 3164 has no year; assume the current one, or last year for
+        # a December message received in January
+        now = now or time.gmtime()
+        month = timestamps.MONTH_NAMES.index(month_name) + 1
+        year = now.tm_year - 1 if month > now.tm_mon + 1 else now.tm_year
+        return '{0} {1} {2} {3}'.format(
+            _datestamp(year, month, int(day)), timestamp, host, text)
+    return None
+
+
+class _UDPProtocol(asyncio.DatagramProtocol):
+    """ Hands each datagram to the receiver without blocking. """
+
+    def __init__(self, receiver):
+        self.receiver = receiver
+
+    def connection_made(self, transport):
+        sock = transport.get_extra_info('socket')
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UDP_RCVBUF)
+        except (AttributeError, OSError):
+            pass
+
+    def datagram_received(self, data, addr):
+        self.receiver.offer((data, addr[0]))
+
+
+class SyslogReceiver(object):
+    """ Receives syslog over UDP and TCP and inserts the events in
+        batches.  "on_events" is called on the event loop with the new
+        event ids and their parsed fields after every batch, e.g. to
+        queue remediations.
+    """
+
+    def __init__(self, host='127.0.0.1', port=5514, udp=True, tcp=True,
+                 queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE,
+                 on_events=None):
+        self.host = host
+        self.port = port
+        self.udp = udp
+        self.tcp = tcp
+        self.batch_size = batch_size
+        self.on_events = on_events
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.received = 0
+        self.dropped = 0
+        self.unparsed = 0
+        self.inserted = 0
+        self.framing_errors = 0
+        self.errors = 0
+        self._transport = None
+        self._server = None
+        self._consumer = None
+        # All DB writes happen on one thread, so on one connection
+        self._writer = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def offer(self, message):
+        """ Queues a (message, sender) pair if there is room, otherwise
+            drops it.
+
+            @return queued      True if the message was queued
+        """
+        self.received += 1
+        MESSAGES.inc('received')
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            MESSAGES.inc('dropped')
+            return False
+        return True
+
+    def submit(self, function, *args):
+        """ Runs function(*args) on the DB writer thread, after the
+            batches already being written.
+
+            @return future      a concurrent.futures.Future of the result
+        """
+        return self._writer.submit(function, *args)
+
+    async def _read_frame(self, reader):
+        """ Reads one TCP frame:  octet-counted ("<length> <PRI>...", RFC
+            6587) when the digits are followed by a space and "<", and
+            newline-framed otherwise, so lines such as "2016 Apr  2 ..."
+            are not mistaken for lengths.
+
+            @return message     the frame, or None at the end of the stream
+        """
+        prefix = await reader.read(1)
+        if not prefix:
+            return None
+        try:
+            while prefix[-1:].isdigit() and len(prefix) <= LENGTH_DIGITS:
+                prefix += await reader.readexactly(1)
+            if prefix[-1:] == b' ' and prefix[:-1].isdigit():
+                prefix += await reader.readexactly(1)
+        except asyncio.IncompleteReadError as error:
+            # A last line without its newline is still a message
+            return prefix + error.partial
+        if prefix[-1:] == b'<' and prefix[-2:-1] == b' ':
+            length = int(prefix[:-2])
+            if not 0 < length <= MAX_FRAME:
+                raise ValueError(length)
+            return b'<' + await reader.readexactly(length - 1)
+        if prefix[-1:] == b'\n':
+            return prefix
+        try:
+            return prefix + await reader.readuntil(b'\n')
+        except asyncio.IncompleteReadError as error:
+            return prefix + error.partial
+
+    async def _handle_tcp(self, reader, writer):
+        """ Reads messages from one TCP client until it disconnects or
+            sends a frame that cannot be read, which is counted as a
+            framing error.  Waiting on the queue pauses reading, which
+            pushes back on the sender.
+        """
+        sender = writer.get_extra_info('peername')[0]
+        try:
+            while True:
+                message = await self._read_frame(reader)
+                if message is None:
+                    break
+                self.received += 1
+                MESSAGES.inc('received')
+                await self.queue.put((message, sender))
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                ValueError):
+            self.framing_errors += 1
+            MESSAGES.inc('framing_errors')
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _consume(self):
+        """ Writes queued messages to the DB in batches, until it reads
+            the None queued by stop().  A batch that fails to insert, or
+            whose on_events callback raises, is logged and counted in
+            "errors".
+        """
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            messages = [await self.queue.get()]
+            while len(messages) < self.batch_size and not self.queue.empty():
+                messages.append(self.queue.get_nowait())
+            if None in messages:
+                stopping = True
+                messages = [message for message in messages if message]
+
+            events = []
+            with PARSE_SECONDS.time():
+                for message, sender in messages:
+                    fields = syslog_parser.parse_line(
+                        normalize(message, sender) or '')
+                    if fields:
+                        events.append(fields)
+            unparsed = len(messages) - len(events)
+            if unparsed:
+                self.unparsed += unparsed
+                MESSAGES.inc('unparsed', amount=unparsed)
+            if not events:
+                continue
+            # One failed batch must not stop the consumer for good
+            try:
+                event_ids = await loop.run_in_executor(
+                    self._writer, db.insert_events, events)
+                self.inserted += len(event_ids)
+                MESSAGES.inc('inserted', amount=len(event_ids))
+                if self.on_events:
+                    self.on_events(event_ids, events)
+            except Exception as error:
+                self.errors += 1
+                BATCH_ERRORS.inc()
+                print('[syslog]  ERROR:  Batch of {0} events failed:  {1}'
+                      ''.format(len(events), error))
+
+    async def start(self):
+        """ Opens the sockets and starts the DB writer.
+
+            @return None
+        """
+        loop = asyncio.get_running_loop()
+        metrics.QUEUE_DEPTH.track(self.queue.qsize, 'syslog')
+        if self.udp:
+            self._transport, _ = await loop.create_datagram_endpoint(
+                lambda: _UDPProtocol(self), local_addr=(self.host, self.port))
+        if self.tcp:
+            self._server = await asyncio.start_server(
+                self._handle_tcp, self.host, self.port, limit=MAX_FRAME)
+        self._consumer = asyncio.ensure_future(self._consume())
+
+    async def stop(self):
+        """ Closes the sockets, then waits for the messages already
+            queued to be written.
+
+            @return None
+        """
+        if self._transport:
+            self._transport.close()
+        if self._server:
+            self._server.close()
+        if self._consumer:
+            await self.queue.put(None)
+            await self._consumer
+        self._writer.shutdown(wait=True)
+        metrics.QUEUE_DEPTH.untrack(self.queue.qsize, 'syslog')
+
+    def stats(self):
+        """ @return stats       a dict of counters and the queue depth """
+        return {
+            'received': self.received,
+            'dropped': self.dropped,
+            'unparsed': self.unparsed,
+            'inserted': self.inserted,
+            'framing_errors': self.framing_errors,
+            'errors': self.errors,
+            'queue_depth': self.queue.qsize(),
+        }
+
+
+def generate_load(host='127.0.0.1', port=5514, count=10000, protocol='udp',
+                  rate=None, devices=100):
+    """ Sends synthetic RFC 3164 link-failure messages to a receiver.
+
+        @param rate         messages per second, or None for flat out
+        @return elapsed     seconds taken to send them all
+    """
+    if protocol == 'udp':
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.connect((host, port))
+    else:
+        sock = socket.create_connection((host, port))
+    started = time.time()
+    try:
+        for number in range(count):
+            now = time.gmtime(started + number // 1000)
+            message = (
+                '<189>{0} {1:2d} {2} switch{3} %ETHPORT-5-IF_DOWN_LINK_FAILURE'
+                ': Interface Ethernet1/{4} is down (Link failure) [{5}]'
+                .format(timestamps.MONTH_NAMES[now.tm_mon - 1], now.tm_mday,
+                        time.strftime('%H:%M:%S', now), number % devices,
+                        number % 48, number)).encode('utf-8')
+            if protocol == 'udp':
+                sock.send(message)
+            else:
+                sock.sendall('{0} '.format(len(message)).encode() + message)
+            if rate:
+                delay = started + (number + 1) / rate - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+    finally:
+        sock.close()
+    return time.time() - started
+
+
+async def _listen(args):
+    """ Runs a receiver until interrupted, printing its counters. """
+    receiver = SyslogReceiver(args.host, args.port)
+    await receiver.start()
+    print('Listening for syslog on {0}:{1} (UDP and TCP)'.format(
+        args.host, args.port))
+    try:
+        while True:
+            await asyncio.sleep(args.interval)
+            print(receiver.stats())
+    finally:
+        await receiver.stop()
+
+
+def main(argv=None):
+    """ Main program logic """
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5514)
+    parser.add_argument('--interval', type=float, default=5.0,
+                        help='seconds between printed counters')
+    parser.add_argument('--loadgen', action='store_true',
+                        help='send synthetic messages instead of listening')
+    parser.add_argument('--count', type=int, default=10000)
+    parser.add_argument('--protocol', choices=['udp', 'tcp'], default='udp')
+    parser.add_argument('--rate', type=float, default=None,
+                        help='messages per second (default: flat out)')
+    args = parser.parse_args(argv)
+
+    if args.loadgen:
+        elapsed = generate_load(args.host, args.port, args.count,
+                                args.protocol, args.rate)
+        print('Sent {0} messages over {1} in {2:.2f} s ({3:.0f}/sec)'.format(
+            args.count, args.protocol.upper(), elapsed,
+            args.count / elapsed))
+        return
+    try:
+        asyncio.run(_listen(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    sys.exit(main())
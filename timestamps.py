@@ -0,0 +1,100 @@
+#!/usr/bin/python
+""" Fast conversion of syslog datestamps to sortable epoch seconds.
+
+    Syslog lines carry "2016 Apr  2" and "14:25:06" as separate fields.
+    Most lines in a file share a handful of dates, so the midnight epoch of
+    each date is cached and only the time of day is parsed per line.
+    Timestamps carry no zone and are treated as UTC.
+"""
+
+# Standard library modules
+import calendar
+
+
+MONTHS = {
+    'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
+    'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12,
+}
+
+# "Jan" .. "Dec", as they appear in syslog datestamps
+MONTH_NAMES = [name.title() for name in MONTHS]
+
+# Most distinct dates remembered before the cache is reset
+DAY_CACHE_SIZE = 4096
+
+# Most distinct times of day remembered before the cache is reset; there
+# are only 86400 well-formed ones
+TIME_CACHE_SIZE = 100000
+
+_day_cache = {}
+_time_cache = {}
+
+
+def day_epoch(datestamp):
+    """ Converts a "2016 Apr  2" datestamp to the epoch of its midnight.
+
+        @return epoch       seconds since the epoch, or None if unparsable
+    """
+    epoch = _day_cache.get(datestamp)
+    if epoch is not None:
+        return epoch
+    try:
+        year, month, day = datestamp.split()
+        epoch = calendar.timegm(
+            (int(year), MONTHS[month[:3].lower()], int(day), 0, 0, 0))
+    except (KeyError, ValueError):
+        return None
+    if len(_day_cache) >= DAY_CACHE_SIZE:
+        _day_cache.clear()
+    _day_cache[datestamp] = epoch
+    return epoch
+
+
+def time_of_day(timestamp):
+    """ Converts a "14:25:06" timestamp to seconds after midnight.
+
+        @return seconds     seconds after midnight, or None if unparsable
+    """
+    seconds = _time_cache.get(timestamp)
+    if seconds is not None:
+        return seconds
+    try:
+        hours, minutes, seconds = timestamp.split(':')
+        seconds = int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+    except ValueError:
+        return None
+    if len(_time_cache) >= TIME_CACHE_SIZE:
+        _time_cache.clear()
+    _time_cache[timestamp] = seconds
+    return seconds
+
+
+def to_epoch(datestamp, timestamp):
+    """ Converts "2016 Apr  2" and "14:25:06" to seconds since the epoch.
+
+        @return epoch       seconds since the epoch, or None if unparsable
+    """
+    epoch = _day_cache.get(datestamp)
+    if epoch is None:
+        epoch = day_epoch(datestamp)
+        if epoch is None:
+            return None
+    seconds = _time_cache.get(timestamp)
+    if seconds is None:
+        seconds = time_of_day(timestamp)
+        if seconds is None:
+            return None
+    return epoch + seconds
+
+
+def datestamp_to_epoch(datestamp):
+    """ Converts a stored "2016 Apr  2 14:25:06" datestamp to seconds
+        since the epoch.
+
+        @return epoch       seconds since the epoch, or None if unparsable
+    """
+    try:
+        date, timestamp = datestamp.rsplit(None, 1)
+    except (AttributeError, ValueError):
+        return None
+    return to_epoch(date, timestamp)
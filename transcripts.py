@@ -0,0 +1,298 @@
+#!/usr/bin/python
+""" Recorded SSH transcripts, and sessions that record or replay them.
+
+    With the "record" SSH backend, every login, command and output of
+    the sessions opened, together with how long the device took to
+    answer, is saved to a transcript file.  With the "replay" backend,
+    sessions answer from that file instead of a device, at the recorded
+    speed or instantly, so an incident captured once can be remediated
+    again as often as needed:
+
+        SSH_BACKEND=record SSH_TRANSCRIPT=incident.sqlite \\
+            python demo_better.py --log-file incident.log
+        SSH_BACKEND=replay SSH_TRANSCRIPT=incident.sqlite \\
+            python demo_better.py --log-file incident.log
+
+    A transcript is an SQLite file.  Outputs are stored once each,
+    compressed, however often a device returned them; exchanges refer to
+    them and are indexed by device and command.  When a device answered
+    the same command more than once, replay serves the answers in the
+    order recorded and then keeps repeating the last one.  Recorded
+    failures (timeouts, dropped connections) are raised again on replay.
+"""
+
+# Standard library modules
+import collections
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+# Local modules
+import ssh_helper
+
+
+TRANSCRIPT_FILE = os.environ.get('SSH_TRANSCRIPT', 'transcript.sqlite')
+
+# Backend whose sessions are recorded
+RECORD_BACKEND = os.environ.get('SSH_RECORD_BACKEND', 'paramiko')
+
+# Replay speed relative to the recording: 1 is the recorded speed, 2
+# twice as fast and 0 instant
+REPLAY_SPEED = float(os.environ.get('SSH_REPLAY_SPEED', 0))
+
+SCHEMA = ('''
+    CREATE TABLE IF NOT EXISTS outputs (
+        id              INTEGER PRIMARY KEY NOT NULL,
+        digest          BLOB UNIQUE NOT NULL,
+        output          BLOB NOT NULL);
+
+    CREATE TABLE IF NOT EXISTS exchanges (
+        id              INTEGER PRIMARY KEY NOT NULL,
+        recorded        REAL NOT NULL,
+        device          TEXT NOT NULL,
+        mode            TEXT NOT NULL,
+        command         TEXT NOT NULL,
+        output_id       INTEGER NOT NULL REFERENCES outputs (id),
+        seconds         REAL NOT NULL,
+        failed          INTEGER NOT NULL DEFAULT 0);
+
+    CREATE INDEX IF NOT EXISTS exchanges_lookup
+        ON exchanges (device, mode, command, id);
+''')
+
+# Exchange modes:  the login, and calls to write() and write_pipelined()
+LOGIN = 'login'
+WRITE = 'write'
+PIPELINED = 'pipelined'
+
+
+class Transcript(object):
+    """ A transcript file, shared by the sessions of every thread. """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._sessions = {}         # pid -> connection
+        self._exchanges = None      # (device, mode, command) -> [rows]
+        self._outputs = {}          # output id -> text
+        self._cursors = collections.Counter()
+
+    def _session(self):
+        """ @return session     this process's connection to the file """
+        session = self._sessions.get(os.getpid())
+        if session is None:
+            session = sqlite3.connect(self.path, timeout=30,
+                                      isolation_level=None,
+                                      check_same_thread=False)
+            session.execute('PRAGMA journal_mode = WAL')
+            session.executescript(SCHEMA)
+            self._sessions[os.getpid()] = session
+        return session
+
+    def record(self, device, mode, exchanges):
+        """ Saves a call's exchanges, each (command, output, seconds,
+            failed), in one transaction.
+
+            @return None
+        """
+        now = time.time()
+        with self._lock:
+            session = self._session()
+            session.execute('BEGIN IMMEDIATE')
+            try:
+                for command, output, seconds, failed in exchanges:
+                    data = output.encode('utf-8')
+                    digest = hashlib.sha1(data).digest()
+                    session.execute(
+                        'INSERT OR IGNORE INTO outputs (digest, output) '
+                        'VALUES (?, ?)', (digest, zlib.compress(data)))
+                    session.execute(
+                        'INSERT INTO exchanges (recorded, device, mode, '
+                        'command, output_id, seconds, failed) SELECT ?, ?, '
+                        '?, ?, id, ?, ? FROM outputs WHERE digest = ?',
+                        (now, device, mode, command, seconds, int(failed),
+                         digest))
+                session.execute('COMMIT')
+            except Exception:
+                session.execute('ROLLBACK')
+                raise
+            self._exchanges = None
+
+    def _load(self):
+        """ Reads the exchange index, leaving outputs to be read and
+            decompressed when first replayed.  Called with the lock held.
+        """
+        exchanges = collections.defaultdict(list)
+        for row in self._session().execute(
+                'SELECT device, mode, command, output_id, seconds, failed '
+                'FROM exchanges ORDER BY id'):
+            exchanges[row[:3]].append(row[3:])
+        self._exchanges = exchanges
+
+    def lookup(self, device, mode, command):
+        """ Gets the next recorded answer to a command.
+
+            @return exchange    (output, seconds, failed), or None if the
+                                device was never sent the command
+        """
+        key = (device, mode, command)
+        with self._lock:
+            if self._exchanges is None:
+                self._load()
+            rows = self._exchanges.get(key)
+            if not rows:
+                return None
+            output_id, seconds, failed = rows[
+                min(self._cursors[key], len(rows) - 1)]
+            self._cursors[key] += 1
+            output = self._outputs.get(output_id)
+            if output is None:
+                output = self._outputs[output_id] = zlib.decompress(
+                    self._session().execute(
+                        'SELECT output FROM outputs WHERE id = ?',
+                        (output_id,)).fetchone()[0]).decode('utf-8')
+        return output, seconds, bool(failed)
+
+    def rewind(self):
+        """ Replays from the first recorded answers again.
+
+            @return None
+        """
+        with self._lock:
+            self._cursors.clear()
+
+    def stats(self):
+        """ @return stats       a dict of the transcript's size """
+        with self._lock:
+            session = self._session()
+            exchanges, devices = session.execute(
+                'SELECT COUNT(*), COUNT(DISTINCT device) '
+                'FROM exchanges').fetchone()
+            outputs, stored = session.execute(
+                'SELECT COUNT(*), TOTAL(LENGTH(output)) '
+                'FROM outputs').fetchone()
+        return {'devices': devices, 'exchanges': exchanges,
+                'outputs': outputs, 'stored_bytes': int(stored),
+                'file_bytes': os.path.getsize(self.path)}
+
+    def close(self):
+        """ @return None """
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+_transcripts = {}
+_transcripts_lock = threading.Lock()
+
+
+def open_transcript(path=None):
+    """ @return transcript  the shared Transcript for a file, by default
+                            TRANSCRIPT_FILE
+    """
+    path = path or TRANSCRIPT_FILE
+    with _transcripts_lock:
+        transcript = _transcripts.get(path)
+        if transcript is None:
+            transcript = _transcripts[path] = Transcript(path)
+        return transcript
+
+
+class RecordingSession(object):
+    """ A session of RECORD_BACKEND whose exchanges are saved to the
+        transcript, failures included.
+    """
+
+    def __init__(self, device, username='', passwd='', **kwargs):
+        self.device = device
+        self.transcript = open_transcript()
+        session_class = ssh_helper.backend_class(RECORD_BACKEND)
+        self.session = self._call(
+            LOGIN, [''], lambda: session_class(
+                device=device, username=username, passwd=passwd, **kwargs))
+
+    def _call(self, mode, commands, call, outputs=None):
+        """ Runs a call to the session, recording its result split
+            evenly across its commands.
+
+            @return result      what the call returned
+        """
+        started = time.perf_counter()
+        try:
+            result = call()
+        except Exception as error:
+            seconds = (time.perf_counter() - started) / len(commands)
+            self.transcript.record(self.device, mode, [
+                (command, str(error), seconds, True)
+                for command in commands])
+            raise
+        seconds = (time.perf_counter() - started) / len(commands)
+        texts = outputs(result) if outputs else [''] * len(commands)
+        self.transcript.record(self.device, mode, [
+            (command, text, seconds, False)
+            for command, text in zip(commands, texts)])
+        return result
+
+    def write(self, commands, **kwargs):
+        return self._call(
+            WRITE, ['\n'.join(commands)],
+            lambda: self.session.write(commands, **kwargs),
+            lambda output: [output])
+
+    def write_pipelined(self, commands, **kwargs):
+        return self._call(
+            PIPELINED, list(commands),
+            lambda: self.session.write_pipelined(commands, **kwargs),
+            lambda outputs: [outputs[command] for command in commands])
+
+    def is_alive(self):
+        return self.session.is_alive()
+
+    def close(self):
+        self.session.close()
+
+
+class ReplaySession(object):
+    """ A session answering from the transcript, after the recorded time
+        scaled by REPLAY_SPEED.
+    """
+
+    def __init__(self, device, username='', passwd='', **kwargs):
+        self.device = device
+        self.transcript = open_transcript()
+        self._replay(LOGIN, [''])
+
+    def _replay(self, mode, commands):
+        """ @return outputs     the recorded outputs of the commands """
+        exchanges = []
+        for command in commands:
+            exchange = self.transcript.lookup(self.device, mode, command)
+            if exchange is None:
+                error = 'No recorded {0} of "{1}" on {2} in {3}.'.format(
+                    mode, command, self.device, self.transcript.path)
+                raise Exception(error)
+            exchanges.append(exchange)
+        if REPLAY_SPEED:
+            time.sleep(sum(seconds for _, seconds, _ in exchanges) /
+                       REPLAY_SPEED)
+        for output, _, failed in exchanges:
+            if failed:
+                raise Exception(output)
+        return [output for output, _, _ in exchanges]
+
+    def write(self, commands, **kwargs):
+        return self._replay(WRITE, ['\n'.join(commands)])[0]
+
+    def write_pipelined(self, commands, **kwargs):
+        return collections.OrderedDict(
+            zip(commands, self._replay(PIPELINED, commands)))
+
+    def is_alive(self):
+        return True
+
+    def close(self):
+        return
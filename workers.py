@@ -0,0 +1,116 @@
+#!/usr/bin/python
+""" Worker processes draining the events table as a work queue.
+
+    Each worker repeatedly leases a few waiting events (db.claim_events),
+    remediates them and records the result.  Leases are taken under the
+    database write lock, so several workers on one host never remediate
+    the same event; an event whose worker crashes is picked up again when
+    its lease expires.  Restarting simply resumes with whatever is still
+    waiting.
+"""
+
+# Standard library modules
+import multiprocessing
+import os
+import socket
+import time
+import traceback
+
+# Local modules
+import db
+import metrics
+
+
+# Events leased per claim
+CLAIM_BATCH = 4
+
+# Seconds an idle worker waits before looking for new events
+POLL_INTERVAL = 1.0
+
+# Seconds before a failed event is retried
+RETRY_DELAY = 30
+
+CLAIMED = metrics.counter('events_claimed_total',
+                          'Events leased from the work queue')
+OUTCOMES = metrics.counter(
+    'work_queue_outcomes_total',
+    'Claimed events by outcome:  completed, failed, or lost (the lease '
+    'expired first)', ('outcome',))
+
+
+def worker_name():
+    """ @return owner       "host:pid", the lease owner of this process """
+    return '{0}:{1}'.format(socket.gethostname(), os.getpid())
+
+
+def work(remediate, claim_batch=CLAIM_BATCH, lease=db.LEASE_SECONDS,
+         max_attempts=db.MAX_ATTEMPTS, retry_delay=RETRY_DELAY,
+         poll_interval=POLL_INTERVAL, exit_when_idle=True, shard=None):
+    """ Claims and remediates events until none is left to claim (or
+        forever, if not "exit_when_idle").  Failed events not yet due for
+        a retry are left for a later run.
+
+        With a sharding.Shard, only the shard's devices are claimed, and
+        the worker stays until no event is waiting on any shard, so it
+        can take over devices from nodes that leave.
+
+        @return counts      a tuple of (completed, failed) remediations
+    """
+    owner = worker_name()
+    completed = failed = 0
+    while True:
+        if shard:
+            shard.refresh()
+        events = db.claim_events(owner, claim_batch, lease, max_attempts,
+                                 owns_device=shard.owns if shard else None)
+        if not events:
+            if exit_when_idle and (shard is None or not db.count_pending()):
+                return completed, failed
+            time.sleep(poll_interval)
+            continue
+        CLAIMED.inc(amount=len(events))
+        for event in events:
+            event_id, device_name = event[0], event[2]
+            try:
+                remediate(event_id)
+            except Exception:
+                failed += 1
+                OUTCOMES.inc('failed')
+                gave_up = db.fail_event(event_id, owner, retry_delay,
+                                        max_attempts)
+                print('[{0}]  ERROR:  Remediation for event_id {1} failed{2}:'
+                      '\n{3}'.format(device_name, event_id,
+                                     '' if gave_up else ', will retry',
+                                     traceback.format_exc()))
+                continue
+            if db.complete_event(event_id, owner):
+                completed += 1
+                OUTCOMES.inc('completed')
+            else:
+                OUTCOMES.inc('lost')
+
+
+def _work(args):
+    """ Runs work() in a pool process. """
+    remediate, kwargs = args
+    return work(remediate, **kwargs)
+
+
+def run_workers(remediate, processes=2, **kwargs):
+    """ Drains the queue on several worker processes, blocking until they
+        finish.  Keyword arguments are passed to work().
+
+        @return counts      a tuple of (completed, failed) remediations
+    """
+    if processes == 1:
+        return work(remediate, **kwargs)
+    # Sessions must not be shared with the children
+    db.close_session()
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(_work, [(remediate, kwargs)] * processes)
+    finally:
+        pool.close()
+        pool.join()
+    return (sum(result[0] for result in results),
+            sum(result[1] for result in results))